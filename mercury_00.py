@@ -12,6 +12,7 @@ import numpy as np
 from PIL import Image, ImageTk, ImageOps, ImageChops
 
 from mercury_01 import open_file_dialog
+from mercury_core import load_mask_preset
 
 # from main import PARAMS_DTP
 # from main import PARAMS_EXP
@@ -1195,40 +1196,6 @@ def convert_to_rgba(img: Image.Image, alpha: int = 255) -> Image.Image:
     return img
 
 
-def load_mask_preset(file_path, scaling_factor):
-    """
-    Function: load preset from yaml/yml, adjust for scaling factor. Return false if failed.
-    """
-    try:
-        with open(file_path, 'r+', encoding="utf-8") as file:
-            data = yaml.safe_load(file)
-            rotation = int(data['rotation'])
-            vertical = bool(data['flip_vertical'])
-            horizontal = bool(data['flip_horizontal'])
-            x = round(float(data['x'])*scaling_factor)
-            y = round(float(data['y'])*scaling_factor)
-            w = round(float(data['w'])*scaling_factor)
-            h = round(float(data['h'])*scaling_factor)
-    except (ValueError, TypeError, RuntimeError) as e:
-        print(f"Warning: unable to load preset at {file_path}: {e}")
-        return False
-    return (rotation, vertical, horizontal, x, y, w, h)
-    # # for older txt-based preset files
-    # try:
-    #     file = open(file_path, 'r+', encoding="utf-8").readlines()
-    #     rotation = int(file[0])
-    #     vertical = False if file[1] == "0\n" else True
-    #     horizontal = False if file[2] == "0\n" else True
-    #     x = round(int(file[3])*scaling_factor)
-    #     y = round(int(file[4])*scaling_factor)
-    #     w = round(int(file[5])*scaling_factor)
-    #     h = round(int(file[6])*scaling_factor)
-    # except (ValueError, TypeError, RuntimeError) as e:
-    #     print(f"Warning: unable to load preset at {file_path}: {e}")
-    #     return False
-    # return (rotation, vertical, horizontal, x, y, w, h)
-
-
 def ctk_entry_warning(entry: customtkinter.CTkEntry, color="brown", duration=50):
     """
     Function: briefly set designated ctk entry's foreground to a specific color.
@@ -4,6 +4,7 @@ Mercury 01: image scheme constructor, project version 1.24 (with python 3.9).
 
 import os
 import math
+import inspect
 import tkinter
 from tkinter import filedialog
 from datetime import date
@@ -12,13 +13,29 @@ import customtkinter
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba
+from matplotlib.path import Path
 from PIL import Image
 
+from mercury_core import PARAMS_CRC, coordinate_journal, compact_journal
+
 WINDOW_TXT = "Mercury I - Image Scheme Constructor"
-WINDOW_RES = "807x237"
+WINDOW_RES = "917x237"
 PARAMS_TAB = ["Global Tissue", "Square Subgroup"]
 PARAMS_CRN = 4
 PARAMS_RES = 366
+PARAMS_MSC = 8192
+PARAMS_COV = 0.0  # FOVs planned from a tissue overview must have more tissue than this fraction
+PARAMS_OVS = 16   # tissue overview polygons are rasterized with this many pixels per FOV side
+PARAMS_RTM = "euclidean"  # stage travel metric of route optimization, or "chebyshev"
+PARAMS_FOV = "native"  # FOV imaging order, a key of FOV_ORDERS or "fastest" (reorders FOVs)
+PARAMS_STG = {          # stage model for estimated acquisition times, per axis [x, y]
+    "speed": [5000, 5000],              # um/s
+    "acceleration": [20000, 20000],     # um/s^2
+    "settle": 0.2,                      # s after every move
+    "exposure": 2.0,                    # s of imaging (all channels, focus) per FOV
+}
 
 PARAMS_DTP = os.path.join(os.path.expanduser("~"), "Desktop")
 PARAMS_EXP = os.path.join(PARAMS_DTP, f"latest_{date.today()}")
@@ -126,6 +143,14 @@ class App(customtkinter.CTk, Moa):
             textvar = PARAMS_RES
         )
         self.inp_rs0.grid(row=0, column=7, padx=(0,5), pady=0)
+        # tissue overview (image or polygon), replaces corner radii
+        self.inp_ovr = Entry(
+            master = self.tab_ent.tab(PARAMS_TAB[0]),
+            width = 105,
+            label = "  Overview",
+            placeholder = "(Optional)"
+        )
+        self.inp_ovr.grid(row=0, column=8, padx=(0,5), pady=0)
         # configure the tabview for square subgroup imaging
         # center x
         self.inp_ctrx = Entry(
@@ -232,7 +257,8 @@ class App(customtkinter.CTk, Moa):
                         float(self.inp_miny.get_entry()),
                         float(self.inp_maxy.get_entry()),
                         int(self.inp_crn.get_entry()),
-                        float(self.inp_rs0.get_entry())
+                        float(self.inp_rs0.get_entry()),
+                        self.inp_ovr.get_entry().strip() or None
                     ),
                     self.ent_pth.get(),
                     float(self.inp_rz0.get_entry()),
@@ -392,6 +418,7 @@ def scheme_create_global(
         max_y: float,
         scan_crn: int,
         scan_res: float,
+        overview = None
 ):
     """
     ### Return a tuple of xy coordinates and the autofocus scheme, passing a plot preview.
@@ -402,6 +429,8 @@ def scheme_create_global(
     `max_y` : maximum y value (up).
     `scan_crn` : corner radius of the scan scheme.
     `scan_res` : scan resolution of each image (IU or um).
+    `overview` : tissue overview spanning the min/max box (see `scheme_load_overview`), only
+    FOVs with tissue are kept instead of cutting corners. Default = `None`.
     """
     # make sure scan resolution and corner radii are constant and always positive
     res = abs(scan_res)
@@ -415,11 +444,13 @@ def scheme_create_global(
     dim_y = math.ceil(range_y / res)        # must be int
     # initialize corner mapping and return variable
     crn_map = scheme_create_crnmap(dim_y, dim_x, crn)
+    tissue = None
     # initialize local variables
     current_x = 0
     current_y = 0
     current_i = 0
     rtn = []
+    regions = []
     # find start coordinates (on the top-left corner) of the tissue
     if dim_x % 2 != 0:
         current_x = center_x - math.floor(dim_x / 2) * res
@@ -429,6 +460,16 @@ def scheme_create_global(
         current_y = center_y + math.floor(dim_y / 2) * res
     else:
         current_y = center_y + (math.floor(dim_y / 2) - 0.5) * res
+    # with a tissue overview, map out FOVs without tissue instead of corners
+    if overview is not None:
+        tissue = scheme_load_overview(
+            overview, min_x, max_x, min_y, max_y, min(res, PARAMS_RES) / PARAMS_OVS)
+        rows, cols = np.mgrid[0:dim_y, 0:dim_x]
+        steps = np.where(rows % 2 == 0, cols, dim_x - 1 - cols)
+        centers = np.stack([current_x + steps * res, current_y - rows * res], axis=-1)
+        coverage = scheme_tissue_coverage(
+            tissue, min_x, max_x, min_y, max_y, centers, PARAMS_RES).reshape(dim_y, dim_x)
+        crn_map = (coverage <= PARAMS_COV).astype(int).tolist()
     # loop through all imaging positions (in an S-shape order)
     # append xy coordinates, pfs, and store a preview into pyplot
     for row in range(dim_y):
@@ -437,16 +478,16 @@ def scheme_create_global(
             if crn_map[row][col] == 0:
                 # first append the image's coordinates
                 rtn.append([current_x, current_y])
-                # store a preview area in pyplot
-                pyplot_create_region(
-                    current_x,
-                    current_y,
-                    PARAMS_RES,
-                    PARAMS_RES,
+                # store a preview area for pyplot
+                regions.append(dict(
+                    x = current_x,
+                    y = current_y,
+                    w = PARAMS_RES,
+                    h = PARAMS_RES,
                     c = 'b',
                     e = 'b',
                     i = current_i
-                )
+                ))
                 # increment the number of images taken
                 current_i += 1
             # move the coordinates to the next region
@@ -462,10 +503,97 @@ def scheme_create_global(
                 # then instead of moving the x coordinate, move the y coordinate
                 # this will move the current xy coordinates to the next row
                 current_y -= res
+    if tissue is not None:
+        print(f"Tissue overview: {len(rtn)} of {dim_x * dim_y} bounding box FOVs "
+              f"({dim_x * dim_y - len(rtn)} saved).")
+        plt.imshow(tissue, extent=(min_x, max_x, min_y, max_y), cmap='Greys', alpha=0.25,
+                   zorder=0)
+    # order FOVs (PARAMS_FOV), preview areas are numbered in the new order
+    order = scheme_order_fovs(rtn, res)
+    rtn = [rtn[k] for k in order]
+    regions = [dict(regions[k], i=n) for n, k in enumerate(order)]
+    # draw all preview areas in one batch
+    pyplot_create_regions(regions)
     # return compiled xy coordinates
     return rtn
 
 
+def scheme_load_overview(
+        file_path: str,
+        min_x: float,
+        max_x: float,
+        min_y: float,
+        max_y: float,
+        pixel_size: float,
+        threshold = None
+):
+    """
+    ### Return a boolean tissue mask (row 0 = max y) covering the min/max box.
+
+    `file_path` : overview image spanning the min/max box, or .csv polygon of tissue outline
+    vertices (x and y columns, same units as the box).
+    `min_x`, `max_x`, `min_y`, `max_y` : bounding box of the scan.
+    `pixel_size` : mask pixel size when rasterizing a polygon.
+    `threshold` : gray level splitting tissue from background in an overview image, the side
+    of the image border is background. Default = `None` (Otsu's threshold).
+    """
+    if file_path.lower().endswith(".csv"):
+        # rasterize the polygon at pixel centers
+        df = pd.read_csv(file_path)
+        columns = ["x", "y"] if {"x", "y"} <= set(df.columns) else list(df.columns[-2:])
+        outline = Path(df[columns].to_numpy(dtype=np.float64))
+        width = max(math.ceil(abs(max_x - min_x) / pixel_size), 1)
+        height = max(math.ceil(abs(max_y - min_y) / pixel_size), 1)
+        x = min_x + (np.arange(width) + 0.5) * abs(max_x - min_x) / width
+        y = max_y - (np.arange(height) + 0.5) * abs(max_y - min_y) / height
+        grid = np.stack(np.meshgrid(x, y), axis=-1).reshape(-1, 2)
+        return outline.contains_points(grid).reshape(height, width)
+    with Image.open(file_path) as img:
+        gray = np.asarray(img.convert('L'))
+    if threshold is None:
+        # otsu's threshold, maximize the between-class variance of the gray level histogram
+        histogram = np.bincount(gray.reshape(-1), minlength=256).astype(np.float64)
+        weight = np.cumsum(histogram)
+        mean = np.cumsum(histogram * np.arange(256))
+        total_weight, total_mean = weight[-1], mean[-1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = (total_mean * weight - mean * total_weight) ** 2 / \
+                (weight * (total_weight - weight))
+        threshold = int(np.nanargmax(variance))
+    tissue = gray > threshold
+    # most of the border is background (bright field: bright, fluorescence: dark)
+    border = np.concatenate([tissue[0], tissue[-1], tissue[:, 0], tissue[:, -1]])
+    return ~tissue if border.mean() > 0.5 else tissue
+
+
+def scheme_tissue_coverage(
+        mask: np.ndarray,
+        min_x: float,
+        max_x: float,
+        min_y: float,
+        max_y: float,
+        centers: np.ndarray,
+        size: float
+) -> np.ndarray:
+    """
+    Function: return the tissue fraction of [size x size] FOVs at [x, y] centers, all at once
+    from the summed-area table of a tissue mask spanning the min/max box.
+    """
+    height, width = mask.shape
+    table = np.zeros((height + 1, width + 1), dtype=np.int64)
+    table[1:, 1:] = mask.cumsum(axis=0).cumsum(axis=1)
+    scale_x = width / max(abs(max_x - min_x), 1e-9)
+    scale_y = height / max(abs(max_y - min_y), 1e-9)
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+    # fov boxes in (fractional) mask pixels, clipped to the mask
+    west = np.clip(np.rint((centers[:, 0] - size / 2 - min_x) * scale_x), 0, width).astype(int)
+    east = np.clip(np.rint((centers[:, 0] + size / 2 - min_x) * scale_x), 0, width).astype(int)
+    north = np.clip(np.rint((max_y - centers[:, 1] - size / 2) * scale_y), 0, height).astype(int)
+    south = np.clip(np.rint((max_y - centers[:, 1] + size / 2) * scale_y), 0, height).astype(int)
+    count = table[south, east] - table[north, east] - table[south, west] + table[north, west]
+    return count / max(size * scale_x * size * scale_y, 1e-9)
+
+
 def scheme_create_subgrp(
         cursor_x: float,        # cursor x coordinate for this subgroup             float / int
         cursor_y: float,        # cursor y coordinate for this subgroup             float / int
@@ -490,6 +618,7 @@ def scheme_create_subgrp(
     j = 0                       # number of times the append direction was changed
     k = 0                       # number of times the cursor moves before it turns
     rtn = []                    # return list
+    regions = []                # preview areas, drawn once the loop ends
     # if region_n is even, adjust cursor xy to the center of adjacent FOV at the lower-right corner
     if (region_n % 2) == 0:
         cursor_x += (0.5 * r)
@@ -518,8 +647,8 @@ def scheme_create_subgrp(
             i += 1
             # append the current cursor coordinates as a 1D list
             rtn.append([x, y])
-            # save a preview of the current FOV area into pyplot
-            pyplot_create_region(x, y, PARAMS_RES, PARAMS_RES, c="g", e="g", i=i)
+            # save a preview of the current FOV area for pyplot
+            regions.append(dict(x=x, y=y, w=PARAMS_RES, h=PARAMS_RES, c="g", e="g", i=i))
             # move to the next FOV depending on cursor direction
             if c == "left":     # move one FOV left
                 x -= r
@@ -531,6 +660,12 @@ def scheme_create_subgrp(
                 y -= r
         # increment the number of turns
         j += 1
+    # order FOVs (PARAMS_FOV), preview areas are numbered in the new order
+    order = scheme_order_fovs(rtn, r)
+    rtn = [rtn[k] for k in order]
+    regions = [dict(regions[k], i=n+1) for n, k in enumerate(order)]
+    # draw all preview areas in one batch
+    pyplot_create_regions(regions)
     # return rtn once the loop ends
     return rtn
 
@@ -632,6 +767,162 @@ def pyplot_create_region(
         plt.plot(corner_x, corner_y, '-', color=e, alpha=a)
 
 
+def pyplot_create_regions(
+        regions: list,  # keyword arguments of pyplot_create_region   list of dict
+        m = None,       # maximum side length of the image mosaic    None / int
+        k = True        # display region images (j) if True          bool
+):
+    """
+    ### Store a batch of regions, drawn the same way as `pyplot_create_region` with fewer artists.
+
+    `regions` : list of dicts, each holding the keyword arguments of `pyplot_create_region`.
+    -----------------------------------------------------------------------------------------------
+    #### Optional:
+    `m` : maximum side length of the image mosaic (in pixel). Default = `None` *(PARAMS_MSC)*.
+    `k` : display region images (j) if True. Default = `True`.
+    """
+    if len(regions) == 0:
+        return
+    ax = plt.gca()
+    # fill in default values from the single region function
+    regions = pyplot_region_fill(regions)
+    # one collection for all borders, dotted if the region displays an image
+    borders = []
+    for region in regions:
+        x, y, w, h = region['x'], region['y'], region['w'], region['h']
+        borders.append([
+            (x - 0.5*w, y - 0.5*h),
+            (x - 0.5*w, y + 0.5*h),
+            (x + 0.5*w, y + 0.5*h),
+            (x + 0.5*w, y - 0.5*h),
+            (x - 0.5*w, y - 0.5*h)
+        ])
+    ax.add_collection(LineCollection(
+        borders,
+        colors = [to_rgba(region['e'], region['a']) for region in regions],
+        linestyles = [':' if region['j'] != "" else '-' for region in regions],
+        linewidths = plt.rcParams['lines.linewidth']
+    ))
+    # one scatter for all centers, sized like the 'o' markers of plt.plot
+    ax.scatter(
+        [region['x'] for region in regions],
+        [region['y'] for region in regions],
+        s = plt.rcParams['lines.markersize'] ** 2,
+        c = [to_rgba(region['c'], region['a']) for region in regions],
+        edgecolors = 'face',
+        linewidths = plt.rcParams['lines.markeredgewidth'],
+        zorder = 2
+    )
+    # texts cannot be batched, but empty labels do not need an artist
+    for region in regions:
+        if str(region['i']) != "":
+            ax.text(
+                region['x'],
+                region['y'],
+                region['i'],
+                ha = region['f'],
+                va = region['v'],
+                alpha = region['g'],
+                rotation = region['t']
+            )
+    # one image for all regions with an image
+    tiles = [region for region in regions if region['j'] != ""]
+    if len(tiles) > 0 and k is True:
+        mosaic, extent = pyplot_region_mosaic(tiles, PARAMS_MSC if m is None else m)
+        ax.imshow(mosaic, extent=extent, origin='upper')
+    ax.autoscale_view()
+
+
+def pyplot_region_mosaic(tiles: list, max_size: int):
+    """
+    Function: composite region images into one RGBA mosaic, return (mosaic, extent).
+    """
+    west, east, south, north = pyplot_region_bounds(tiles)
+    # load every image the same way as pyplot_create_region, colormapped like imshow would
+    images = [pyplot_region_image(tile) for tile in tiles]
+    # keep the finest image resolution, limited by max_size on the longer side
+    unit = min(tile['w'] / image.shape[1] for tile, image in zip(tiles, images))
+    unit = max(unit, max(east - west, north - south) / max_size)
+    mosaic = np.zeros(
+        (max(round((north - south) / unit), 1), max(round((east - west) / unit), 1), 4),
+        dtype=np.uint8
+    )
+    for tile, image in zip(tiles, images):
+        pyplot_region_paste(mosaic, image, tile, west, north, unit)
+    return mosaic, (west, east, south, north)
+
+
+def pyplot_region_fill(regions: list):
+    """
+    Function: return regions with missing keyword arguments set to `pyplot_create_region` defaults.
+    """
+    defaults = {
+        key: value.default
+        for key, value in inspect.signature(pyplot_create_region).parameters.items()
+        if value.default is not inspect.Parameter.empty
+    }
+    return [{**defaults, **region} for region in regions]
+
+
+def pyplot_region_bounds(regions: list):
+    """
+    Function: return the (west, east, south, north) bounds of all regions.
+    """
+    west = min(region['x'] - 0.5*region['w'] for region in regions)
+    east = max(region['x'] + 0.5*region['w'] for region in regions)
+    south = min(region['y'] - 0.5*region['h'] for region in regions)
+    north = max(region['y'] + 0.5*region['h'] for region in regions)
+    return west, east, south, north
+
+
+def pyplot_region_image(tile: dict):
+    """
+    Function: load the image of a region as flipped/rotated RGBA uint8, like pyplot_create_region.
+    """
+    img = Image.open(tile['j'])
+    if tile['b'] is True:
+        img = img.transpose(method=Image.Transpose.FLIP_LEFT_RIGHT)
+    if tile['d'] is True:
+        img = img.transpose(method=Image.Transpose.FLIP_TOP_BOTTOM)
+    if tile['r'] != 0:
+        img = img.rotate(tile['r'])
+    return pyplot_region_rgba(np.asarray(img), tile['a'])
+
+
+def pyplot_region_paste(mosaic: np.ndarray, image: np.ndarray, tile: dict, west, north, unit):
+    """
+    Function: paste a region image into a mosaic with top-left corner (west, north), unit per pixel.
+    """
+    col_0 = round((tile['x'] - 0.5*tile['w'] - west) / unit)
+    col_1 = round((tile['x'] + 0.5*tile['w'] - west) / unit)
+    row_0 = round((north - tile['y'] - 0.5*tile['h']) / unit)
+    row_1 = round((north - tile['y'] + 0.5*tile['h']) / unit)
+    if col_1 <= col_0 or row_1 <= row_0:
+        return
+    mosaic[row_0:row_1, col_0:col_1] = np.asarray(
+        Image.fromarray(image).resize((col_1 - col_0, row_1 - row_0), Image.Resampling.BOX)
+    )
+
+
+def pyplot_region_rgba(array: np.ndarray, alpha: float):
+    """
+    Function: convert an image array to RGBA uint8, normalized per image like plt.imshow.
+    """
+    if array.ndim == 2:
+        array = array.astype(np.float64)
+        low, high = array.min(), array.max()
+        array = (array - low) / (high - low) if high > low else np.zeros_like(array)
+        rgba = plt.get_cmap()(array, bytes=True)
+    elif array.dtype == np.uint8:
+        rgba = np.full(array.shape[:2] + (4,), 255, dtype=np.uint8)
+        rgba[..., :min(array.shape[2], 4)] = array[..., :4]
+    else:
+        array = np.clip(array, 0, 1) * 255
+        rgba = pyplot_region_rgba(array.astype(np.uint8), 1)
+    rgba[..., 3] = np.round(rgba[..., 3] * alpha).astype(np.uint8)
+    return rgba
+
+
 def scheme_create_crnmap(
         row: int,
         col: int,
@@ -685,19 +976,33 @@ def csvset_modify_concat(
         for _ in range(end_level):
             file_path = os.path.dirname(file_path)
         file_path = os.path.join(file_path, file_name)
-    # write the updated dataframe back to the .csv file
-    df1 = pd.read_csv(file_path, usecols=[1,2,3])
-    df2 = pd.DataFrame({
-        "x": [new_value[0]],
-        "y": [new_value[1]],
-        "z": [new_value[2]]
-    })
-    # avoid concat empty dataframes (may cause empty rows)
-    if df1.empty:
-        df1 = df2
-    else:
-        df1 = pd.concat([df1, df2], ignore_index=True)
-    df1.to_csv(file_path, index=True)
+    # append the values to the journal of the .csv file, written into it automatically
+    coordinate_journal(file_path, PARAMS_CRC)(new_value[0], new_value[1], new_value[2])
+
+
+def csvset_modify_compact(
+        file_path,
+        file_name = PARAMS_CRD,
+        end_level = 0
+):
+    """
+    ### Write the values concatenated by `csvset_modify_concat` into the log file.
+
+    `file_path` : .csv file name with full path.
+    -----------------------------------------------------------------------------------------------
+    #### Optional:
+    `file_name` : name of the .csv file to edit = `"${PARAMS_LOG}"`.
+    `end_level` : strings to cut from file_path = `0`.
+
+    Optional, journals are also written into the file automatically (see
+    `mercury_core.CoordinateJournal`). Return the number of rows written.
+    """
+    # find target .csv file first if end_level is not 0
+    if end_level != 0:
+        for _ in range(end_level):
+            file_path = os.path.dirname(file_path)
+        file_path = os.path.join(file_path, file_name)
+    return compact_journal(file_path, PARAMS_CRC)
 
 
 def open_file_dialog(
@@ -726,6 +1031,268 @@ def open_file_dialog(
     return file_path.replace("/", "\\")
 
 
+# ====================================== route optimization =======================================
+
+def route_distance(points_a: np.ndarray, points_b: np.ndarray, metric = PARAMS_RTM):
+    """
+    Function: return stage travel between [x, y] points, euclidean or chebyshev (max of |dx| and
+    |dy|, the travel time of stages moving both axes at once).
+    """
+    delta = np.abs(points_a - points_b)
+    if metric == "chebyshev":
+        return np.maximum(delta[..., 0], delta[..., 1])
+    return np.sqrt(delta[..., 0] ** 2 + delta[..., 1] ** 2)
+
+
+def route_length(points, order = None, metric = PARAMS_RTM) -> float:
+    """
+    Function: return the stage travel of an open route through [x, y] points (in list order).
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if order is not None:
+        points = points[np.asarray(order, dtype=np.int64)]
+    return float(route_distance(points[:-1], points[1:], metric).sum())
+
+
+def route_neighbours(points: np.ndarray, k: int, chunk_size = 2**22):
+    """
+    Function: return the indices of the k nearest other points of every point, chunked.
+    """
+    k = min(k, len(points) - 1)
+    step = max(chunk_size // len(points), 1)
+    neighbours = np.empty((len(points), k), dtype=np.int64)
+    for start in range(0, len(points), step):
+        chunk = points[start:start+step, None, :]
+        distance = route_distance(chunk, points[None, :, :], "euclidean")
+        distance[np.arange(len(distance)), np.arange(start, start + len(distance))] = np.inf
+        neighbours[start:start+step] = np.argpartition(distance, k - 1, axis=1)[:, :k]
+    return neighbours
+
+
+def route_nearest_neighbour(points: np.ndarray, start = 0, metric = PARAMS_RTM) -> np.ndarray:
+    """
+    Function: return a greedy route from the start point, always moving to the closest unvisited.
+    """
+    visited = np.zeros(len(points), dtype=bool)
+    order = np.empty(len(points), dtype=np.int64)
+    current = start
+    for step in range(len(points)):
+        order[step] = current
+        visited[current] = True
+        if step == len(points) - 1:
+            break
+        distance = route_distance(points, points[current], metric)
+        distance[visited] = np.inf
+        current = int(np.argmin(distance))
+    return order
+
+
+def route_two_opt(
+        points: np.ndarray,
+        order: np.ndarray,
+        metric = PARAMS_RTM,
+        neighbours = 8,
+        max_passes = 1000
+    ) -> np.ndarray:
+    """
+    ### Improve an open route with 2-opt moves (segment reversals), the first point stays first.
+
+    `points` : [x, y] points of the route.
+    `order` : initial route, indices into points.
+    -----------------------------------------------------------------------------------------------
+    #### Optional:
+    `metric` : "euclidean" or "chebyshev" travel. Default = `PARAMS_RTM`.
+    `neighbours` : new edges are only tried towards this many nearest points. Default = `8`.
+    `max_passes` : maximum number of passes. Default = `1000`.
+
+    Every pass evaluates the gain of all candidate moves at once, then applies the best moves
+    that reverse non-overlapping segments.
+    """
+    order = np.array(order, dtype=np.int64)
+    n = len(order)
+    if n < 4:
+        return order
+    candidates = route_neighbours(points, neighbours)
+    for _ in range(max_passes):
+        position = np.empty(n, dtype=np.int64)
+        position[order] = np.arange(n)
+        # a move on edges (p, p+1) and (q, q+1) connects p to q and p+1 to q+1
+        here = np.repeat(np.arange(n), candidates.shape[1])
+        there = position[candidates[order].reshape(-1)]
+        low, high = np.minimum(here, there), np.maximum(here, there)
+        p = np.concatenate([low, low - 1])
+        q = np.concatenate([high, high - 1])
+        valid = (p >= 0) & (q >= p + 2)
+        p, q = p[valid], q[valid]
+        # the route is open, there is no edge after its last point
+        last = q == n - 1
+        q_next = np.where(last, q, q + 1)
+        before = (route_distance(points[order[p]], points[order[p + 1]], metric) +
+                  np.where(last, 0, route_distance(
+                      points[order[q]], points[order[q_next]], metric)))
+        after = (route_distance(points[order[p]], points[order[q]], metric) +
+                 np.where(last, 0, route_distance(
+                     points[order[p + 1]], points[order[q_next]], metric)))
+        gain = before - after
+        improving = np.nonzero(gain > 1e-9 * max(before.max(initial=0), 1))[0]
+        if len(improving) == 0:
+            break
+        # apply the best moves whose segments [p, q + 1] do not overlap
+        taken = np.zeros(n + 1, dtype=bool)
+        for move in improving[np.argsort(-gain[improving], kind='stable')]:
+            start, end = p[move], q[move] + 1
+            if taken[start:end+1].any():
+                continue
+            taken[start:end+1] = True
+            order[start+1:end] = order[start+1:end][::-1]
+    return order
+
+
+def optimize_route(points, metric = PARAMS_RTM, neighbours = 8):
+    """
+    ### Reorder [x, y] points to shorten the stage travel of an open route, keep the first point.
+
+    `points` : [x, y] points, in their current (e.g. serpentine) order.
+    -----------------------------------------------------------------------------------------------
+    #### Optional:
+    `metric` : "euclidean" or "chebyshev" travel. Default = `PARAMS_RTM`.
+    `neighbours` : 2-opt candidate neighbours of each point. Default = `8`.
+
+    Builds a nearest neighbour route, improves it with 2-opt, and falls back to the current order
+    if that is not shorter. Return (order, travel before, travel after).
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    serpentine = np.arange(len(points))
+    length_before = route_length(points, serpentine, metric)
+    if len(points) < 3:
+        return (serpentine, length_before, length_before)
+    order = route_nearest_neighbour(points, 0, metric)
+    order = route_two_opt(points, order, metric, neighbours)
+    length_after = route_length(points, order, metric)
+    if length_after >= length_before:
+        return (serpentine, length_before, length_before)
+    return (order, length_before, length_after)
+
+
+# ========================================= imaging order =========================================
+
+def stage_move_time(points_a: np.ndarray, points_b: np.ndarray, stage = None) -> np.ndarray:
+    """
+    Function: return stage move times (s) between [x, y] points, both axes moving at once with
+    trapezoidal (or triangular, for short moves) velocity profiles, plus settling time.
+    """
+    stage = PARAMS_STG if stage is None else stage
+    speed = np.asarray(stage["speed"], dtype=np.float64)
+    acceleration = np.asarray(stage["acceleration"], dtype=np.float64)
+    distance = np.abs(np.asarray(points_b, dtype=np.float64) - points_a)
+    # moves shorter than speed^2 / acceleration never reach full speed
+    ramp = speed ** 2 / acceleration
+    axis_time = np.where(
+        distance < ramp,
+        2 * np.sqrt(distance / acceleration),
+        distance / speed + speed / acceleration
+    )
+    moving = distance.max(axis=-1) > 0
+    return axis_time.max(axis=-1) + np.where(moving, stage["settle"], 0)
+
+
+def acquisition_time(points, order = None, stage = None) -> float:
+    """
+    Function: return the estimated acquisition time (s) of FOVs imaged in the given order.
+    """
+    stage = PARAMS_STG if stage is None else stage
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if order is not None:
+        points = points[np.asarray(order, dtype=np.int64)]
+    travel = stage_move_time(points[:-1], points[1:], stage).sum() if len(points) > 1 else 0
+    return float(travel + len(points) * stage["exposure"])
+
+
+def fov_order_native(points: np.ndarray, res: float) -> np.ndarray:
+    """
+    Function: keep the order FOVs were generated in.
+    """
+    return np.arange(len(points))
+
+
+def fov_order_serpentine(points: np.ndarray, res: float) -> np.ndarray:
+    """
+    Function: image row by row from the top, alternating left-right and right-left.
+    """
+    row = np.round((points[:, 1].max() - points[:, 1]) / res).astype(np.int64)
+    x = np.where(row % 2 == 0, points[:, 0], -points[:, 0])
+    return np.lexsort((x, row))
+
+
+def fov_order_column(points: np.ndarray, res: float) -> np.ndarray:
+    """
+    Function: image column by column from the left, alternating top-down and bottom-up.
+    """
+    col = np.round((points[:, 0] - points[:, 0].min()) / res).astype(np.int64)
+    y = np.where(col % 2 == 0, -points[:, 1], points[:, 1])
+    return np.lexsort((y, col))
+
+
+def fov_order_spiral(points: np.ndarray, res: float) -> np.ndarray:
+    """
+    Function: image ring by ring outward from the center, counter-clockwise within a ring.
+    """
+    delta = points - points.mean(axis=0)
+    ring = np.round(np.abs(delta).max(axis=1) / res).astype(np.int64)
+    angle = np.mod(np.arctan2(delta[:, 1], delta[:, 0]), 2 * np.pi)
+    return np.lexsort((angle, ring))
+
+
+def fov_order_route(points: np.ndarray, res: float) -> np.ndarray:
+    """
+    Function: shortest stage travel from the first generated FOV (see `optimize_route`).
+    """
+    return optimize_route(points)[0]
+
+
+FOV_ORDERS = {
+    "native": fov_order_native,
+    "serpentine": fov_order_serpentine,
+    "column": fov_order_column,
+    "spiral": fov_order_spiral,
+    "route": fov_order_route,
+}
+
+
+def scheme_order_fovs(coordinates: list, res: float, strategy = None, stage = None) -> list:
+    """
+    ### Return the order to image FOVs in, print the estimated acquisition time of every order.
+
+    `coordinates` : xy coordinates of the FOVs, in generated order.
+    `res` : distance between adjacent FOVs.
+    -----------------------------------------------------------------------------------------------
+    #### Optional:
+    `strategy` : a key of `FOV_ORDERS`, or "fastest" to compare all strategies and pick the one
+    with the shortest estimated acquisition time. Default = `PARAMS_FOV`.
+    `stage` : stage speed, acceleration, settling and exposure (see `PARAMS_STG`).
+    Default = `PARAMS_STG`.
+
+    "route" (2-opt) is only computed and estimated if it is selected or "fastest" is.
+    """
+    strategy = PARAMS_FOV if strategy is None else strategy
+    points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 2:
+        return list(range(len(points)))
+    # every order is estimated, except route (2-opt) unless it is asked for
+    names = [name for name in FOV_ORDERS if name != "route" or strategy in ("route", "fastest")]
+    orders = {name: FOV_ORDERS[name](points, abs(res)) for name in names}
+    times = {name: acquisition_time(points, order, stage) for name, order in orders.items()}
+    if strategy == "fastest":
+        strategy = min(times, key=times.get)
+    # imaging time is the same in every order, only stage travel differs
+    imaging = acquisition_time(points[:1], stage=stage) * len(points)
+    print(f"Estimated acquisition time of {len(points)} FOVs ({imaging / 60:.1f} min imaging):")
+    for name, seconds in times.items():
+        print(f"{'*' if name == strategy else ' '} {name:<12}{seconds / 60:8.1f} min, "
+              f"{seconds - imaging:8.1f} s stage travel")
+    return orders[strategy].tolist()
+
+
 # ========================================= main function =========================================
 
 def mercury_01(
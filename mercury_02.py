@@ -4,17 +4,33 @@ Mercury 02: laser scheme constructor, project version 1.24 (with python 3.9).
 
 import os
 import math
+import time
+import argparse
 import shutil
 import tkinter as tk
 from itertools import combinations
 from datetime import date
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import customtkinter
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from PIL import Image, ImageDraw
+from PIL import Image
 
-from mercury_01 import pyplot_create_region, open_file_dialog
+from mercury_01 import pyplot_create_regions, open_file_dialog
+from mercury_core import (  # pylint: disable=unused-import
+    PARAMS_CRC,
+    GlobalMask,
+    read_coordinates,
+    array_state,
+    array_from_state,
+    write_png_chunk,
+    pack_png_rows,
+    write_palette_png,
+    read_png_header
+)
 
 WINDOW_TXT = "Mercury II - Laser Scheme Constructor"
 WINDOW_RES = "800x190"
@@ -26,6 +42,14 @@ PARAMS_CFG = [
                 {"width": 144, "label": "  Pixel Count Threshold", "textvar": 100, "padx": (10,10)},
              ]
 PARAMS_TRL = "_MC_F001_Z001.png"
+PARAMS_WRK = 0  # processes used to encode cleave maps, 0 = save serially in this process
+PARAMS_LDR = 4  # threads used to decode mask tiles, 0 = decode tiles one at a time
+PARAMS_ZMD = "linear"  # focal surface model of cleave center z, see FocalSurface
+PARAMS_ZMS = ["polynomial", "linear", "spline", "nearest"]
+PARAMS_SEQ = "lexicographic"  # bit scheme engine, "balanced" = equal submasks in every round
+PARAMS_SQS = ["lexicographic", "balanced"]
+PARAMS_TRN = 3600  # estimated fluidic time of one round (s), for planning concatenations
+PARAMS_TSM = 0.5  # estimated laser time of one submask in one round (s), same
 
 PARAMS_DTP = os.path.join(os.path.expanduser("~"), "Desktop")
 PARAMS_EXP = os.path.join(PARAMS_DTP, f"latest_{date.today()}")
@@ -37,7 +61,10 @@ PARAMS_PLN = "coord_planned.csv"
 PARAMS_CRD = "coord_recorded.csv"
 PARAMS_GLB = "image_mask_global.png"
 PARAMS_SCT = "coord_scan_center.csv"
+PARAMS_SZM = "coord_scan_center (z model).csv"
 PARAMS_BIT = "config_bit_scheme.csv"
+PARAMS_BLD = "config_bit_scheme (round load).csv"
+PARAMS_BPL = "config_bit_scheme (plan).csv"
 PARAMS_TMP = "image_mask_tmp.png"
 
 
@@ -48,7 +75,14 @@ class App(customtkinter.CTk):
     Class: main application window and customtkinter main loop.
     """
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def __init__(self):
+    def __init__(
+            self,
+            pixel_per_micron = 1,
+            folder = PARAMS_EXP,
+            values = None,
+            z_model = PARAMS_ZMD,
+            bit_scheme_engine = PARAMS_SEQ
+        ):
         super().__init__()
         # ---------------------------------- application setting ----------------------------------
         self.title(WINDOW_TXT)
@@ -56,14 +90,17 @@ class App(customtkinter.CTk):
         self.grid_columnconfigure(0, weight=1)
         self.grid_rowconfigure(0, weight=1)
         # -------------------------------------- GUI setting --------------------------------------
-        self.frm_ctl = Exp(master=self)
+        self.frm_ctl = Exp(master=self, folder=folder)
         self.frm_ctl.grid(row=0, column=0, padx=10, pady=(10,5), sticky="nesw", columnspan=1)
-        self.frm_prm = Sub(master=self)
+        self.frm_prm = Sub(master=self, values=values)
         self.frm_prm.grid(row=1, column=0, padx=10, pady=(5,5), sticky="nesw", columnspan=1)
         self.btn_cmc = customtkinter.CTkButton(master=self, text="Commence", command=self.app_exp)
         self.btn_cmc.grid(row=2, column=0, padx=10, pady=(5,10), sticky="nesw", columnspan=1)
         # ----------------------------------- parameter setting -----------------------------------
-        self.pth_fld = PARAMS_EXP
+        self.pth_fld = folder
+        self.pixel_per_micron = pixel_per_micron
+        self.z_model = z_model
+        self.bit_scheme_engine = bit_scheme_engine
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def app_exp(self):
         """
@@ -74,173 +111,27 @@ class App(customtkinter.CTk):
             # read inputs from entry frames
             num_ports = int(self.frm_prm.frames_list[0].get_entry())
             scan_size = int(self.frm_prm.frames_list[1].get_entry())
-            num_conct = int(self.frm_prm.frames_list[2].get_entry())
+            num_conct = read_concatenations(self.frm_prm.frames_list[2].get_entry())
             num_subdv = int(self.frm_prm.frames_list[3].get_entry())
             num_count = int(self.frm_prm.frames_list[4].get_entry())
         except (ValueError, TypeError, RuntimeError) as e:
             print(f"Warning: {e}, check parameter input format.")
-        # construct global mask
-        try:
-            # read inputs from entry frames
-            self.pth_fld = self.frm_ctl.ent_pth.get()
-            exp_coord = os.path.join(self.pth_fld, PARAMS_PLN)
-            exp_gmask = os.path.join(self.pth_fld, PARAMS_GLB)
-            exp_rcrdz = os.path.join(self.pth_fld, PARAMS_CRD)
-            # process parameters, save results
-            (successful,
-            _cleave_size,
-            cleave_center_coord_um,
-            cleave_center_coord_px,
-            submask_coordinates_um,
-            submask_coordinates_px
-            ) = global_mask_stitching(
-                mask_folder = os.path.join(self.pth_fld, PARAMS_MSK),
-                multichannel_coordinate = exp_coord,
-                output_file = exp_gmask,
-                mask_affix = PARAMS_TRL,
-                laser_cleave_size_um = scan_size,
-                submask_division = num_subdv,
-                submask_minpixel = num_count
-            )
-            if not successful:
-                print("Error: global mask stitching failed.")
-                return
-        except (ValueError, TypeError, RuntimeError) as e:
-            print(f"Warning: {e}, check file path and mask/coordinate indexing.")
             return
-        # save a blank cleave mask for future uses
-        blank_mask = Image.new('P', [1024,1024], color = (255,255,255))
-        blank_mask.save(os.path.join(self.pth_fld, PARAMS_TMP), format='PNG')
-        # save generated cleave center coordinates
-        cleave_centers = []
-        plan_xy_value = read_xycoordinates(exp_coord)
-        record_z_value = read_zcoordinates(exp_rcrdz)
-        print(len(record_z_value))
-        for i, coord_pair in enumerate(cleave_center_coord_um):
-            temp = coord_pair
-            nearest_z = record_z_value[find_closest_coordinate(plan_xy_value, coord_pair)]
-            temp.append(nearest_z)
-            temp.extend(cleave_center_coord_px[i])
-            cleave_centers.append(temp)
-        dataframe = pd.DataFrame(cleave_centers, columns=['x','y','z','w','n','e','s'])
-        dataframe.to_csv(os.path.join(self.pth_fld, PARAMS_SCT), index=True)
-        # generate bit scheme for all subregions
-        bit_scheme, max_index = generate_digit_sequences(len(submask_coordinates_um), num_conct)
-        # convert bit scheme into port sequences
-        port_config = []
-        for sequence in bit_scheme:
-            temp = []
-            for i, bit in enumerate(sequence):
-                if bit == 1:
-                    temp.append(i)
-            port_config.append(temp)
-        # save generated submask laser/port scheme
-        fluidic_scheme = []
-        for i, coord_pair in enumerate(submask_coordinates_um):
-            temp = coord_pair
-            temp.extend(submask_coordinates_px[i][:])
-            temp.append(port_config[i])
-            temp.append(bit_scheme[i])
-            fluidic_scheme.append(temp)
-        # depending on bit string length, consider spliting the experiment into 2 parts
-        if max_index > num_ports:
-            print(f"Warning: bit string length ({max_index}) exceeds max {num_ports} ports.")
-            print(f"Experiment folder {self.pth_fld} will be separated into 2 parts.")
-            # copy and rename current experiment folder
-            folder1 = self.pth_fld + "_part1"
-            folder2 = self.pth_fld + "_part2"
-            os.rename(self.pth_fld, folder1)
-            shutil.copytree(folder1, folder2)
-            # save bit scheme and cleave maps into both folders separately
-            bit1 = []
-            bit2 = []
-            for row in fluidic_scheme:
-                row1 = row[:7]
-                row2 = row[:7]
-                bit_1st_half = row[7][0:num_ports]
-                bit_2nd_half = row[7][num_ports:]
-                # if the second half also exceeds the length of num ports, raise exception
-                if len(bit_2nd_half) > num_ports:
-                    raise ValueError(f"Error: bit length {len(row[7])} need > 2 cycles (48 hrs)")
-                # check if a row has valid bits in the first half and the second half
-                # if a row has valid bits (1s) in either halves, it'll be appended to that folder
-                row1.append(bit_1st_half)
-                row2.append(bit_2nd_half)
-                if not all(val == 0 for val in bit_1st_half):
-                    bit1.append(row1)
-                if not all(val == 0 for val in bit_2nd_half):
-                    bit2.append(row2)
-            # save stored bit schemes into corresponding folders
-            df1 = pd.DataFrame(bit1, columns=['x','y','w','n','e','s','index','bit'])
-            df1.to_csv(os.path.join(folder1, PARAMS_BIT), index=True)
-            df2 = pd.DataFrame(bit2, columns=['x','y','w','n','e','s','index','bit'])
-            df2.to_csv(os.path.join(folder2, PARAMS_BIT), index=True)
-            # generate new empty cleave map
-            global_mask = Image.open(os.path.join(folder1, PARAMS_GLB))
-            global_mask_w, global_mask_h = global_mask.size
-            tmp_map = Image.new('P',
-                                (global_mask_w, global_mask_h),
-                                color = (255,255,255))
-            # generate cleave maps for folder 1
-            for i in range(len(bit1[0][7])):
-                # clear previous cleave mask markings
-                ImageDraw.Draw(tmp_map).rectangle(
-                    (0, 0, global_mask_w, global_mask_h),
-                    fill = (255,255,255)
-                )
-                # append images for matching submasks
-                for k, indexes in enumerate(bit1):
-                    if indexes[7][i] == 1:
-                        this_region = global_mask.crop(submask_coordinates_px[k])
-                        tmp_map.paste(this_region, submask_coordinates_px[k])
-                # save cleave map if the port != -1
-                tmp_map.save(
-                    os.path.join(folder1, PARAMS_MAP,('Round ' + str(i) + '.png')),
-                    format = 'PNG'
-                )
-            # generate cleave maps for folder 2
-            for i in range(len(bit2[0][7])):
-                # clear previous cleave mask markings
-                ImageDraw.Draw(tmp_map).rectangle(
-                    (0, 0, global_mask_w, global_mask_h),
-                    fill = (255,255,255)
-                )
-                # append images for matching submasks
-                for k, indexes in enumerate(bit2):
-                    if indexes[7][i] == 1:
-                        this_region = global_mask.crop(submask_coordinates_px[k])
-                        tmp_map.paste(this_region, submask_coordinates_px[k])
-                # save cleave map if the port != -1
-                tmp_map.save(
-                    os.path.join(folder2, PARAMS_MAP,('Round ' + str(i) + '.png')),
-                    format = 'PNG'
-                )
-        # if there's only 1 cycle required
-        else:
-            dataframe = pd.DataFrame(
-                fluidic_scheme, columns=['x','y','w','n','e','s','index','bit'])
-            dataframe.to_csv(os.path.join(self.pth_fld, PARAMS_BIT), index=True)
-            # generate a new cleave map image
-            global_mask = Image.open(exp_gmask)
-            global_mask_w, global_mask_h = global_mask.size
-            tmp_map = Image.new('P',
-                                (global_mask_w, global_mask_h),
-                                color = (255,255,255))
-            # generate cleavage maps, save cleave image
-            for i in range(max_index):
-                # clear previous cleave mask markings
-                ImageDraw.Draw(tmp_map).rectangle(
-                    (0, 0, global_mask_w, global_mask_h),
-                    fill = (255,255,255)
-                )
-                # append images for matching submasks
-                for k, indexes in enumerate(fluidic_scheme):
-                    if indexes[7][i] == 1:
-                        this_region = global_mask.crop(submask_coordinates_px[k])
-                        tmp_map.paste(this_region, submask_coordinates_px[k])
-                # save cleave map if the port != -1
-                tmp_map.save(os.path.join(self.pth_fld, PARAMS_MAP, ('Round ' + str(i) + '.png')),
-                            format = 'PNG')
+        # construct global mask, cleave centers, bit scheme and cleave maps
+        self.pth_fld = self.frm_ctl.ent_pth.get()
+        preview_regions = construct_laser_scheme(
+            self.pth_fld,
+            num_ports,
+            scan_size,
+            num_conct,
+            num_subdv,
+            num_count,
+            pixel_per_micron = self.pixel_per_micron,
+            z_model = self.z_model,
+            bit_scheme_engine = self.bit_scheme_engine
+        )
+        if preview_regions is None:
+            return
         # preview saved submask areas in matplotlib
         plt.gca().set_aspect('equal')
         plt.gcf().set_figheight(10)
@@ -261,7 +152,7 @@ class Exp(customtkinter.CTkFrame):
     Class: ctk frame for specifying experiment folder.
     """
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def __init__(self, master, **kwargs):
+    def __init__(self, master, folder = PARAMS_EXP, **kwargs):
         super().__init__(master, **kwargs)
         self.grid_columnconfigure(0, weight=1)
         self.grid_rowconfigure(0, weight=1)
@@ -278,7 +169,7 @@ class Exp(customtkinter.CTkFrame):
             master = self,
             width = 575,
             height = 28,
-            textvariable = tk.StringVar(master=self, value=PARAMS_EXP)
+            textvariable = tk.StringVar(master=self, value=folder)
         )
         self.ent_pth.grid(row=0, column=1, padx=(0,5), pady=5, columnspan=1)
         self.btn_aof = customtkinter.CTkButton(
@@ -308,11 +199,13 @@ class Sub(customtkinter.CTkFrame):
     Class: ctk frame for adding individual instrument commands.
     """
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def __init__(self, master, **kwargs):
+    def __init__(self, master, values = None, **kwargs):
         super().__init__(master, **kwargs)
         # -------------------------------------- GUI setting --------------------------------------
-        # define configuration parameters for submasking
+        # define configuration parameters for submasking, values replace the default entries
         frames_config = PARAMS_CFG
+        if values is None:
+            values = [config["textvar"] for config in frames_config]
         self.frames_list = []
         # create frames to control submasking parameters
         for i, config in enumerate(frames_config):
@@ -320,7 +213,7 @@ class Sub(customtkinter.CTkFrame):
                 master = self,
                 width = config["width"],
                 label = config["label"],
-                textvar = config["textvar"],
+                textvar = values[i],
                 fg_color = "transparent"
             )
             entry.grid(row=0, column=i, padx=config["padx"], pady=(5,10))
@@ -363,6 +256,209 @@ class Entry(customtkinter.CTkFrame):
 
 # ===================================== independent functions =====================================
 
+def construct_laser_scheme(
+        exp_folder,
+        num_ports,
+        scan_size,
+        num_conct,
+        num_subdv,
+        num_count,
+        headless = False,
+        pixel_per_micron = 1,
+        z_model = PARAMS_ZMD,
+        bit_scheme_engine = PARAMS_SEQ
+    ):
+    """
+    ### Build the global mask, cleave centers, bit scheme and cleave maps of an experiment folder.
+
+    `exp_folder` : experiment folder, split into "_part1" and "_part2" if ports run out.
+    `num_ports` : number of ports.
+    `scan_size` : laser cleave (scan) size in um.
+    `num_conct` : number of concatenations, 0 = pick the one needing the fewest cycles and hours.
+    `num_subdv` : subdivision factor of each cleave area.
+    `num_count` : pixel count threshold of non-empty submasks.
+    -----------------------------------------------------------------------------------------------
+    #### Optional:
+    `headless` : do not draw into matplotlib, regions are only returned. Default = `False`.
+    `pixel_per_micron` : global mask pixels per um, 2 for 732px masks. Default = `1`.
+    `z_model` : focal surface method of cleave center z (see `FocalSurface`).
+    Default = `PARAMS_ZMD`.
+    `bit_scheme_engine` : "lexicographic" or "balanced" (see `generate_balanced_sequences`).
+    Default = `PARAMS_SEQ`.
+
+    Return the preview regions (see `global_mask_stitching`), or None if the construction failed.
+    """
+    # construct global mask
+    preview_regions = []
+    try:
+        exp_coord = os.path.join(exp_folder, PARAMS_PLN)
+        exp_gmask = os.path.join(exp_folder, PARAMS_GLB)
+        exp_rcrdz = os.path.join(exp_folder, PARAMS_CRD)
+        # process parameters, save results
+        (successful,
+        _cleave_size,
+        cleave_center_coord_um,
+        cleave_center_coord_px,
+        submask_coordinates_um,
+        submask_coordinates_px
+        ) = global_mask_stitching(
+            mask_folder = os.path.join(exp_folder, PARAMS_MSK),
+            multichannel_coordinate = exp_coord,
+            output_file = exp_gmask,
+            mask_affix = PARAMS_TRL,
+            laser_cleave_size_um = scan_size,
+            submask_division = num_subdv,
+            submask_minpixel = num_count,
+            pixel_per_micron = pixel_per_micron,
+            headless = headless,
+            preview_regions = preview_regions
+        )
+        if not successful:
+            print("Error: global mask stitching failed.")
+            return None
+    except (ValueError, TypeError, RuntimeError) as e:
+        print(f"Warning: {e}, check file path and mask/coordinate indexing.")
+        return None
+    # save a blank cleave mask for future uses
+    blank_mask = Image.new('P', [1024,1024], color = (255,255,255))
+    blank_mask.save(os.path.join(exp_folder, PARAMS_TMP), format='PNG')
+    # save generated cleave center coordinates
+    cleave_centers = []
+    try:
+        # fit the focal surface once to recorded xyz, evaluate it for all cleave centers
+        surface = FocalSurface.from_csv(exp_rcrdz, method = z_model)
+    except ValueError as e:
+        print(f"Warning: {e}, check recorded coordinates in {PARAMS_CRD}.")
+        return None
+    cleave_center_z = surface.predict(cleave_center_coord_um)
+    for i, coord_pair in enumerate(cleave_center_coord_um):
+        temp = coord_pair
+        temp.append(float(cleave_center_z[i]))
+        temp.extend(cleave_center_coord_px[i])
+        cleave_centers.append(temp)
+    dataframe = pd.DataFrame(cleave_centers, columns=['x','y','z','w','n','e','s'])
+    dataframe.to_csv(os.path.join(exp_folder, PARAMS_SCT), index=True)
+    # save residual statistics of the focal surface next to the cleave centers
+    statistics = surface.statistics()
+    pd.DataFrame([statistics]).to_csv(os.path.join(exp_folder, PARAMS_SZM), index=False)
+    print(f"Focal surface ({statistics['method']}) fitted to {statistics['fovs']} FOVs, "
+          f"residual rms {statistics['rms']:.3f} um, "
+          f"cross validated rms {statistics['cv_rms']:.3f} um.")
+    # evaluate all numbers of concatenations, pick one if asked to
+    best_plan, plan_table = plan_concatenations(len(submask_coordinates_um), num_ports)
+    pd.DataFrame(plan_table).to_csv(os.path.join(exp_folder, PARAMS_BPL), index=False)
+    if best_plan is None:
+        print(f"Warning: no number of concatenations fits in 2 cycles of {num_ports} ports.")
+    elif num_conct <= 0:
+        num_conct = best_plan["concatenations"]
+        print(f"Concatenations: {num_conct} ({best_plan['rounds']} rounds, "
+              f"{best_plan['cycles']} cycle(s), about {best_plan['hours']:.1f} hrs).")
+    elif num_conct <= len(plan_table) and plan_table[num_conct - 1]["cycles"] > best_plan["cycles"]:
+        print(f"Warning: {num_conct} concatenations need {plan_table[num_conct - 1]['cycles']} "
+              f"cycles, {best_plan['concatenations']} would need {best_plan['cycles']}.")
+    if num_conct <= 0:
+        print("Warning: number of concatenations must be positive.")
+        return None
+    # generate bit scheme for all subregions
+    if bit_scheme_engine == "balanced":
+        bit_scheme, max_index = generate_balanced_sequences(len(submask_coordinates_um), num_conct)
+    else:
+        bit_scheme, max_index = generate_digit_sequences(len(submask_coordinates_um), num_conct)
+    save_round_loads(
+        os.path.join(exp_folder, PARAMS_BLD),
+        bit_scheme,
+        max_index,
+        cleave_center_coord_px,
+        submask_coordinates_px,
+        num_conct
+    )
+    # convert bit scheme into port sequences
+    port_config = []
+    for sequence in bit_scheme:
+        temp = []
+        for i, bit in enumerate(sequence):
+            if bit == 1:
+                temp.append(i)
+        port_config.append(temp)
+    # save generated submask laser/port scheme
+    fluidic_scheme = []
+    for i, coord_pair in enumerate(submask_coordinates_um):
+        temp = coord_pair
+        temp.extend(submask_coordinates_px[i][:])
+        temp.append(port_config[i])
+        temp.append(bit_scheme[i])
+        fluidic_scheme.append(temp)
+    # depending on bit string length, consider spliting the experiment into 2 parts
+    if max_index > num_ports:
+        print(f"Warning: bit string length ({max_index}) exceeds max {num_ports} ports.")
+        print(f"Experiment folder {exp_folder} will be separated into 2 parts.")
+        # copy and rename current experiment folder
+        folder1 = exp_folder + "_part1"
+        folder2 = exp_folder + "_part2"
+        os.rename(exp_folder, folder1)
+        shutil.copytree(folder1, folder2)
+        # mask tiles of the preview regions now live in the renamed folder
+        for region in preview_regions:
+            if "j" in region:
+                region["j"] = os.path.join(folder1, os.path.relpath(region["j"], exp_folder))
+        # save bit scheme and cleave maps into both folders separately
+        bit1 = []
+        bit2 = []
+        for row in fluidic_scheme:
+            row1 = row[:7]
+            row2 = row[:7]
+            bit_1st_half = row[7][0:num_ports]
+            bit_2nd_half = row[7][num_ports:]
+            # if the second half also exceeds the length of num ports, raise exception
+            if len(bit_2nd_half) > num_ports:
+                raise ValueError(f"Error: bit length {len(row[7])} need > 2 cycles (48 hrs)")
+            # check if a row has valid bits in the first half and the second half
+            # if a row has valid bits (1s) in either halves, it'll be appended to that folder
+            row1.append(bit_1st_half)
+            row2.append(bit_2nd_half)
+            if not all(val == 0 for val in bit_1st_half):
+                bit1.append(row1)
+            if not all(val == 0 for val in bit_2nd_half):
+                bit2.append(row2)
+        # save stored bit schemes into corresponding folders
+        df1 = pd.DataFrame(bit1, columns=['x','y','w','n','e','s','index','bit'])
+        df1.to_csv(os.path.join(folder1, PARAMS_BIT), index=True)
+        df2 = pd.DataFrame(bit2, columns=['x','y','w','n','e','s','index','bit'])
+        df2.to_csv(os.path.join(folder2, PARAMS_BIT), index=True)
+        # render cleave maps for both folders, rounds are split at num_ports
+        cleave_map_parts = [
+            (folder1, bit1, num_ports),
+            (folder2, bit2, max_index - num_ports)
+        ]
+    # if there's only 1 cycle required
+    else:
+        dataframe = pd.DataFrame(
+            fluidic_scheme, columns=['x','y','w','n','e','s','index','bit'])
+        dataframe.to_csv(os.path.join(exp_folder, PARAMS_BIT), index=True)
+        cleave_map_parts = [(exp_folder, fluidic_scheme, max_index)]
+    # generate cleavage maps from the global mask, save cleave images
+    # the global mask is read from its memory-mapped pixels, one row band at a time
+    global_mask = GlobalMask.open(os.path.join(cleave_map_parts[0][0], PARAMS_GLB))
+    executor = ProcessPoolExecutor(PARAMS_WRK) if PARAMS_WRK > 0 else None
+    for folder, rows, num_rounds in cleave_map_parts:
+        if executor is None:
+            writer = CleaveMapWriter(os.path.join(folder, PARAMS_MAP))
+        else:
+            writer = ParallelCleaveMapWriter(
+                os.path.join(folder, PARAMS_MAP), max_workers=PARAMS_WRK, executor=executor)
+        render_cleave_maps(
+            global_mask,
+            [row[2:6] for row in rows],
+            [row[7] for row in rows],
+            writer,
+            num_rounds = num_rounds
+        )
+        writer.close()
+    if executor is not None:
+        executor.shutdown()
+    return preview_regions
+
+
 def generate_digit_sequences(num_fov, num_concat):
     """
     ### Function: generate unique bit sequences for a given number of images.
@@ -371,9 +467,7 @@ def generate_digit_sequences(num_fov, num_concat):
     `num_concat` : Number of ones in each sequence.
     """
     # calculate minimum columns needed
-    columns = num_concat
-    while math.comb(columns, num_concat) < num_fov:
-        columns += 1
+    columns = minimum_columns(num_fov, num_concat)
     # generate combinations of positions where 1s should be placed
     # combinations() generates them in lexicographic order
     one_positions = combinations(range(columns), num_concat)
@@ -390,6 +484,189 @@ def generate_digit_sequences(num_fov, num_concat):
     return (sequences, columns)
 
 
+def minimum_columns(num_fov, num_concat):
+    """
+    Function: return the shortest bit sequence length with >= num_fov sequences of num_concat 1s.
+    """
+    # math.comb(columns, num_concat) grows with columns, binary search the first one large enough
+    low, high = num_concat, num_concat + max(num_fov, 1)
+    while low < high:
+        middle = (low + high) // 2
+        if math.comb(middle, num_concat) >= num_fov:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def plan_concatenations(
+        num_fov,
+        num_ports,
+        max_cycles = 2,
+        round_time = PARAMS_TRN,
+        submask_time = PARAMS_TSM
+    ):
+    """
+    ### Evaluate every number of concatenations for a submask count, return (best, table).
+
+    `num_fov` : number of submasks (bit sequences).
+    `num_ports` : number of ports, rounds of one fluidic cycle.
+    -----------------------------------------------------------------------------------------------
+    #### Optional:
+    `max_cycles` : fluidic cycles an experiment can be split into. Default = `2`.
+    `round_time` : estimated fluidic time of one round (s). Default = `PARAMS_TRN`.
+    `submask_time` : estimated laser time of one submask in one round (s). Default = `PARAMS_TSM`.
+
+    More concatenations need fewer rounds, but every submask is cleaved in more of them. Each
+    table row has the concatenations, rounds, cycles, submasks of the busiest round (balanced
+    scheme), and the estimated hours (rounds x estimated time per round). The best row needs the
+    fewest cycles, then the fewest hours; None if no number of concatenations fits in max_cycles.
+    """
+    table = []
+    for num_concat in range(1, max(num_ports, 1) * max_cycles + 1):
+        rounds = minimum_columns(num_fov, num_concat)
+        per_round = num_fov * num_concat / rounds
+        table.append({
+            "concatenations": num_concat,
+            "rounds": rounds,
+            "cycles": math.ceil(rounds / max(num_ports, 1)),
+            "busiest round": math.ceil(per_round),
+            "hours": rounds * (round_time + per_round * submask_time) / 3600,
+        })
+    feasible = [row for row in table if row["cycles"] <= max_cycles]
+    best = min(feasible, key=lambda row: (row["cycles"], row["hours"]), default=None)
+    return (best, table)
+
+
+def read_concatenations(text):
+    """
+    Function: read a number of concatenations, "auto" (or 0) lets `plan_concatenations` pick one.
+    """
+    text = str(text).strip()
+    return 0 if text.lower() == "auto" else int(text)
+
+
+def generate_balanced_sequences(num_fov, num_concat, pool_size = 64):
+    """
+    ### Function: generate unique bit sequences with (near) equal numbers of 1s per bit (round).
+
+    `num_fov` : Number of sequences to return.
+    `num_concat` : Number of ones in each sequence.
+    `pool_size` : Number of spare cyclic orbits the last sequences are picked from.
+
+    Same length and weight as `generate_digit_sequences`, which fills low bits first. Sequences
+    are taken by whole cyclic orbits (a sequence and all of its rotations), each orbit has the
+    same number of 1s in every bit. The remaining (< length) sequences are picked greedily from
+    spare orbits, keeping the most loaded bit as low as possible. Selected sequences are returned
+    in lexicographic order, like `generate_digit_sequences`.
+    """
+    # calculate minimum columns needed
+    columns = minimum_columns(num_fov, num_concat)
+    loads = [0] * columns
+    selected = []
+    pool = []
+    seen = set()
+    for positions in combinations(range(columns), num_concat):
+        if len(selected) >= num_fov or len(pool) >= pool_size:
+            break
+        if positions in seen:
+            continue
+        # collect the cyclic orbit of the sequence, periodic sequences have shorter orbits
+        orbit = []
+        for shift in range(columns):
+            rotated = tuple(sorted((pos + shift) % columns for pos in positions))
+            if rotated in seen:
+                break
+            seen.add(rotated)
+            orbit.append(rotated)
+        if len(orbit) <= num_fov - len(selected):
+            selected.extend(orbit)
+            for rotated in orbit:
+                for pos in rotated:
+                    loads[pos] += 1
+        else:
+            pool.append(orbit)
+    # fill the remaining sequences from the spare orbits, least loaded bits first
+    candidates = [rotated for orbit in pool for rotated in orbit]
+    while len(selected) < num_fov:
+        best = min(range(len(candidates)), key=lambda k: (
+            max(loads[pos] for pos in candidates[k]), sum(loads[pos] for pos in candidates[k])))
+        rotated = candidates.pop(best)
+        selected.append(rotated)
+        for pos in rotated:
+            loads[pos] += 1
+    # hand out in lexicographic order, neighbouring submasks (same cleave center) share bits
+    sequences = []
+    for positions in sorted(selected):
+        sequence = [0] * columns
+        for pos in positions:
+            sequence[pos] = 1
+        sequences.append(sequence)
+    return (sequences, columns)
+
+
+def bit_scheme_round_loads(sequences, columns, groups = None):
+    """
+    ### Function: count submasks (and cleave centers) cleaved in every round of a bit scheme.
+
+    `sequences` : bit sequences, one per submask.
+    `columns` : bit sequence length (number of rounds).
+    `groups` : cleave center index of every submask, optional.
+
+    Return (submasks per round, cleave centers per round), centers are None without groups.
+    """
+    bits = np.zeros((len(sequences), columns), dtype=bool)
+    if len(sequences) > 0:
+        bits[:] = np.asarray(sequences, dtype=bool)
+    submask_loads = bits.sum(axis=0).tolist()
+    if groups is None:
+        return (submask_loads, None)
+    # a cleave center is visited in a round if any of its submasks is cleaved
+    groups = np.asarray(groups, dtype=np.int64)
+    visited = np.zeros((int(groups.max(initial=-1)) + 1, columns), dtype=bool)
+    np.logical_or.at(visited, groups, bits)
+    return (submask_loads, visited.sum(axis=0).tolist())
+
+
+def save_round_loads(
+        file_path,
+        sequences,
+        columns,
+        cleave_center_coord_px,
+        submask_coordinates_px,
+        num_concat
+    ):
+    """
+    ### Save submasks and cleave centers per round of a bit scheme, next to the lexicographic one.
+
+    `file_path` : .csv file name with full path.
+    `sequences` : bit sequences of the submasks, `columns` : their length.
+    `cleave_center_coord_px` : [w, n, e, s] boxes of all cleave centers.
+    `submask_coordinates_px` : [w, n, e, s] boxes of all submasks.
+    `num_concat` : number of ones in each sequence.
+    """
+    # a submask belongs to the cleave center closest to its own center
+    groups = None
+    if len(cleave_center_coord_px) > 0 and len(submask_coordinates_px) > 0:
+        centers = np.asarray(cleave_center_coord_px, dtype=np.float64)
+        submasks = np.asarray(submask_coordinates_px, dtype=np.float64)
+        index = CoordinateIndex((centers[:, :2] + centers[:, 2:]) / 2)
+        groups = index.nearest((submasks[:, :2] + submasks[:, 2:]) / 2)
+    # compare with the lexicographic scheme (former default) of the same submasks
+    reference, _ = generate_digit_sequences(len(sequences), num_concat)
+    loads = {}
+    for name, bits in (("lexicographic", reference), ("scheme", sequences)):
+        submask_loads, center_loads = bit_scheme_round_loads(bits, columns, groups)
+        loads[f"submasks ({name})"] = submask_loads
+        loads[f"centers ({name})"] = center_loads if groups is not None else [0] * columns
+    dataframe = pd.DataFrame(loads)
+    dataframe.index.name = "round"
+    dataframe.to_csv(file_path, index=True)
+    if columns > 0:
+        print(f"Busiest round: {max(loads['submasks (lexicographic)'])} submasks lexicographic, "
+              f"{max(loads['submasks (scheme)'])} submasks in this scheme.")
+
+
 def read_xycoordinates(csv_file):
     """
     Function: read row 1 and 2 as x and y coordinates (ignore row 0)
@@ -435,6 +712,387 @@ def count_non_white_pixel(img: Image.Image) -> int:
     return sum(1 for p in pixels if p != white_index)
 
 
+def find_white_index(img: Image.Image):
+    """
+    Function: return the first palette index that maps to white, or None if there is none.
+    """
+    palette = img.getpalette()
+    for i in range(256):
+        if palette[i*3:i*3+3] == [255, 255, 255]:
+            return i
+    return None
+
+
+def clip_regions(regions: list, size: tuple, pad_counted: bool):
+    """
+    ### Return [w, n, e, s] regions clipped to an image, and the padded pixel count of each region.
+
+    `regions` : list of [w, n, e, s] boxes, in pixels.
+    `size` : (width, height) of the image.
+    `pad_counted` : count pixels outside of the image as non-white (crop() pads them with index 0).
+    """
+    # crop() rounds box coordinates, and pads areas outside of the image with index 0
+    boxes = np.rint(np.asarray(regions, dtype=np.float64)).astype(np.int64).reshape(-1, 4)
+    img_w, img_h = size
+    clip_w = np.clip(boxes[:,0], 0, img_w)
+    clip_n = np.clip(boxes[:,1], 0, img_h)
+    clip_e = np.clip(boxes[:,2], clip_w, img_w)
+    clip_s = np.clip(boxes[:,3], clip_n, img_h)
+    padding = np.zeros(len(boxes), dtype=np.int64)
+    if pad_counted:
+        full_area = (np.maximum(boxes[:,2] - boxes[:,0], 0)
+                     * np.maximum(boxes[:,3] - boxes[:,1], 0))
+        padding += full_area - (clip_e - clip_w) * (clip_s - clip_n)
+    return (clip_w, clip_n, clip_e, clip_s, padding)
+
+
+def count_non_white_regions(img: Image.Image, regions: list, engine = "numpy") -> list:
+    """
+    ### Count non-white pixels for every [w, n, e, s] region of a palette image.
+
+    `img` : palette ('P') image, e.g. the stitched global mask.
+    `regions` : list of [w, n, e, s] boxes, in pixels.
+    -----------------------------------------------------------------------------------------------
+    #### Optional:
+    `engine` : `"numpy"` converts the image once and reduces all regions band by band,
+    `"index"` builds a `MaskIndex` (summed-area table) and looks every region up in O(1),
+    `"pillow"` crops every region and calls `count_non_white_pixel` (reference).
+    Default = `"numpy"`.
+    """
+    # reference mode, one crop and one python-level pixel scan per region
+    if engine == "pillow":
+        return [count_non_white_pixel(img.crop(region)) for region in regions]
+    if engine == "index":
+        return MaskIndex.from_image(img).count_regions(regions)
+    if engine != "numpy":
+        raise ValueError(f"unknown pixel count engine '{engine}'")
+    white_index = find_white_index(img)
+    pixels = np.asarray(img)
+    # clip boxes to the image, the remaining area is padding
+    clip_w, clip_n, clip_e, clip_s, counts = clip_regions(regions, img.size, white_index != 0)
+    # regions sharing the same rows are reduced from one column-wise cumulative sum
+    bands = {}
+    for k in range(len(counts)):
+        bands.setdefault((int(clip_n[k]), int(clip_s[k])), []).append(k)
+    for (north, south), members in bands.items():
+        if south <= north:
+            continue
+        band = pixels[north:south]
+        if white_index is None:
+            column_sum = np.full(img.size[0], south - north, dtype=np.int64)
+        else:
+            column_sum = np.count_nonzero(band != white_index, axis=0)
+        cumulative = np.concatenate(([0], np.cumsum(column_sum, dtype=np.int64)))
+        members = np.asarray(members)
+        counts[members] += cumulative[clip_e[members]] - cumulative[clip_w[members]]
+    return counts.tolist()
+
+
+class MaskIndex:
+    """
+    Class: summed-area table (integral image) of the non-white pixels of a palette mask.
+
+    Built once per mask image, it answers "how many non-white pixels are in this rectangle" in
+    constant time. The table has one extra leading row and column, and is stored as int32 when
+    the mask has fewer than 2**31 pixels (int64 otherwise). In the .npy cache, the unused origin
+    cell [0, 0] stores whether pixels outside of the mask count as non-white, so that a cached
+    table is self-contained.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, table: np.ndarray):
+        self.table = table
+        self.size = (table.shape[1] - 1, table.shape[0] - 1)
+        self.pad_counted = bool(table[0, 0])
+        self.table[0, 0] = 0
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ constructors ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def from_image(cls, img: Image.Image, band_height = 1024):
+        """
+        Function: build the summed-area table of a palette image, band by band.
+        """
+        img_w, img_h = img.size
+        dtype = np.int32 if img_w * img_h < 2**31 else np.int64
+        white_index = find_white_index(img)
+        pixels = np.asarray(img)
+        table = np.zeros((img_h + 1, img_w + 1), dtype=dtype)
+        for north in range(0, img_h, band_height):
+            south = min(north + band_height, img_h)
+            if white_index is None:
+                band = np.ones((south - north, img_w), dtype=dtype)
+            else:
+                band = (pixels[north:south] != white_index).astype(dtype)
+            # cumulate along rows, then along columns on top of the previous band
+            np.cumsum(band, axis=1, out=band)
+            np.cumsum(band, axis=0, out=band)
+            table[north+1:south+1, 1:] = band + table[north, 1:]
+        table[0, 0] = white_index != 0
+        return cls(table)
+    # ---------------------------------------------------------------------------------------------
+    @classmethod
+    def from_file(cls, file_path, use_cache = True):
+        """
+        Function: load the index of a mask file, from its .npy cache if the cache is up to date.
+        """
+        cache_path = MaskIndex.cache_path(file_path)
+        if (use_cache and os.path.exists(cache_path)
+                and os.path.getmtime(cache_path) >= os.path.getmtime(file_path)):
+            return cls(np.load(cache_path))
+        with Image.open(file_path) as img:
+            index = cls.from_image(img)
+        if use_cache:
+            index.save(cache_path)
+        return index
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    @staticmethod
+    def cache_path(file_path):
+        """
+        Function: return the .npy cache path stored next to a mask file.
+        """
+        return os.path.splitext(file_path)[0] + ".npy"
+    # ---------------------------------------------------------------------------------------------
+    def save(self, cache_path):
+        """
+        Function: save the summed-area table as .npy.
+        """
+        self.table[0, 0] = self.pad_counted
+        np.save(cache_path, self.table)
+        self.table[0, 0] = 0
+    # ---------------------------------------------------------------------------------------------
+    def count_regions(self, regions: list) -> list:
+        """
+        Function: return the number of non-white pixels in every [w, n, e, s] region.
+        """
+        clip_w, clip_n, clip_e, clip_s, counts = clip_regions(regions, self.size, self.pad_counted)
+        table = self.table
+        counts += (table[clip_s, clip_e] - table[clip_n, clip_e]
+                   - table[clip_s, clip_w] + table[clip_n, clip_w])
+        return counts.tolist()
+    # ---------------------------------------------------------------------------------------------
+    def count(self, region) -> int:
+        """
+        Function: return the number of non-white pixels in one [w, n, e, s] region.
+        """
+        return self.count_regions([region])[0]
+
+
+class CleaveMap(GlobalMask):
+    """
+    Class: cleave map of one round, the global mask shown only on the active submasks.
+
+    Pixels are rendered band by band when the map is saved: the active submask boxes crossing a
+    band are painted into a boolean mask, so neither a full-size round image nor a per-pixel label
+    map is kept in RAM. Like pasting the active submasks, a pixel is shown if any active box
+    covers it, inactive boxes never hide an overlapping active one.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, mask: GlobalMask, boxes: np.ndarray, active: np.ndarray, blank_index,
+                 palette):
+        # pylint: disable=super-init-not-called
+        self.mask = mask
+        self.boxes = boxes
+        self.active = active
+        self.blank_index = np.uint8(blank_index)
+        self.palette = list(palette)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    @property
+    def size(self):
+        return self.mask.size
+    # ---------------------------------------------------------------------------------------------
+    def __array__(self, dtype = None, copy = None):
+        pixels = np.concatenate(list(self.bands()), axis=0)
+        return pixels if dtype is None else pixels.astype(dtype)
+    # ---------------------------------------------------------------------------------------------
+    def __getstate__(self):
+        return {
+            "mask": self.mask,
+            "boxes": self.boxes,
+            "active": self.active,
+            "blank_index": self.blank_index,
+            "palette": self.palette
+        }
+    # ---------------------------------------------------------------------------------------------
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+    # ---------------------------------------------------------------------------------------------
+    def bands(self, band_height = 1024):
+        img_w, img_h = self.size
+        for north in range(0, img_h, band_height):
+            south = min(north + band_height, img_h)
+            pixels = self.mask.pixels[north:south]
+            # paint the active boxes crossing the band
+            shown = np.zeros((south - north, img_w), dtype=bool)
+            crossing = np.nonzero(
+                self.active & (self.boxes[:,1] < south) & (self.boxes[:,3] > north))[0]
+            for k in crossing:
+                west, box_n, east, box_s = self.boxes[k]
+                shown[max(box_n-north, 0):box_s-north, west:east] = True
+            if self.blank_index == 0:
+                yield pixels * shown
+            else:
+                yield np.where(shown, pixels, self.blank_index)
+
+
+class CleaveMapWriter:
+    """
+    Class: cleave map writer, saves each rendered round as "Round N.png" into a map folder.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, map_folder):
+        self.map_folder = map_folder
+        self.timings = {}
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __call__(self, num_round, img: Image.Image):
+        self.timings[num_round] = save_cleave_map(img, self.file_path(num_round))
+    # ---------------------------------------------------------------------------------------------
+    def file_path(self, num_round):
+        """
+        Function: return the file path of a round's cleave map.
+        """
+        return os.path.join(self.map_folder, f"Round {num_round}.png")
+    # ---------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Function: finish writing, print the time spent saving each round.
+        """
+        for num_round in sorted(self.timings):
+            print(f"Round {num_round}.png saved in {self.timings[num_round]:.2f} s.")
+        print(f"Cleave maps saved in {sum(self.timings.values()):.2f} s (encoding time).")
+
+
+class ParallelCleaveMapWriter(CleaveMapWriter):
+    """
+    Class: cleave map writer that encodes and saves rounds concurrently in a process pool.
+
+    Every round is still encoded by `save_cleave_map` from the same image, so the saved files are
+    byte-identical to the ones of the serial `CleaveMapWriter`. At most `2 * max_workers` rounds
+    are kept in memory while waiting for a worker.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, map_folder, max_workers = None, executor = None):
+        super().__init__(map_folder)
+        # an executor can be shared by several writers, it is only shut down by its owner
+        self.own_executor = executor is None
+        self.executor = executor if executor is not None else ProcessPoolExecutor(max_workers)
+        self.max_pending = 2 * (max_workers or os.cpu_count() or 1)
+        self.pending = {}
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __call__(self, num_round, img: Image.Image):
+        # wait for the oldest round if too many rounds are queued
+        if len(self.pending) >= self.max_pending:
+            self.collect(next(iter(self.pending)))
+        self.pending[num_round] = self.executor.submit(
+            save_cleave_map, img, self.file_path(num_round))
+    # ---------------------------------------------------------------------------------------------
+    def collect(self, num_round):
+        """
+        Function: wait for one queued round, store its encoding time.
+        """
+        self.timings[num_round] = self.pending.pop(num_round).result()
+    # ---------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Function: wait for all queued rounds, print timings, shut down the pool if owned.
+        """
+        start = time.perf_counter()
+        for num_round in list(self.pending):
+            self.collect(num_round)
+        if self.own_executor:
+            self.executor.shutdown()
+        super().close()
+        print(f"Waited {time.perf_counter() - start:.2f} s for the remaining rounds.")
+
+
+def save_cleave_map(img: Image.Image, file_path):
+    """
+    Function: save one cleave map as PNG, return the time spent (also used by pool workers).
+    """
+    start = time.perf_counter()
+    img.save(file_path, format='PNG')
+    return time.perf_counter() - start
+
+
+def render_cleave_maps(
+        global_mask,
+        regions: list,
+        bits: list,
+        writer,
+        num_rounds = None
+    ):
+    """
+    ### Render the cleave map of every round from the global mask and a submask bit matrix.
+
+    `global_mask` : `GlobalMask` (or palette image) of the stitched global mask.
+    `regions` : list of [w, n, e, s] boxes, one per submask.
+    `bits` : bit matrix (submasks x rounds), 1 if the submask is cleaved in that round.
+    `writer` : callable as `writer(num_round, img)`, e.g. a `CleaveMapWriter`, where `img` is a
+    `CleaveMap` rendered band by band when it is saved.
+    -----------------------------------------------------------------------------------------------
+    #### Optional:
+    `num_rounds` : number of rounds to render. Default = `None` (length of the bit strings).
+    """
+    # a cleave map is a blank white palette image showing the global mask on active submasks
+    if not isinstance(global_mask, GlobalMask):
+        global_mask = GlobalMask.from_image(global_mask)
+    blank_map = Image.new('P', (1, 1), color = (255,255,255))
+    if len(regions) == 0:
+        bits = np.zeros((0, num_rounds or 0))
+    bit_matrix = np.asarray(bits, dtype=bool).reshape(len(regions), -1)
+    if num_rounds is None:
+        num_rounds = bit_matrix.shape[1]
+    # round boxes to pixels, boxes starting outside of the mask are cut at its edges
+    img_w, img_h = global_mask.size
+    boxes = np.rint(np.asarray(regions, dtype=np.float64)).astype(np.int64).reshape(-1, 4)
+    boxes[:,[0,2]] = np.clip(boxes[:,[0,2]], 0, img_w)
+    boxes[:,[1,3]] = np.clip(boxes[:,[1,3]], 0, img_h)
+    for num_round in range(num_rounds):
+        writer(num_round, CleaveMap(
+            global_mask,
+            boxes,
+            np.ascontiguousarray(bit_matrix[:, num_round]),
+            blank_map.getpixel((0, 0)),
+            blank_map.getpalette()
+        ))
+
+
+def load_mask_tile(img_path, tile_size):
+    """
+    Function: open one mask tile, resize it, convert it to palette and rotate it by 180 degrees.
+    """
+    with Image.open(img_path) as img:
+        img = img.resize([tile_size, tile_size]).convert('P')
+    img = img.transpose(method=Image.Transpose.FLIP_LEFT_RIGHT)
+    img = img.transpose(method=Image.Transpose.FLIP_TOP_BOTTOM)
+    return img
+
+
+def load_mask_tiles(image_paths: list, tile_size, max_workers = PARAMS_LDR, prefetch = None):
+    """
+    ### Yield transformed mask tiles (see `load_mask_tile`) in the order of `image_paths`.
+
+    `image_paths` : list of mask file paths.
+    `tile_size` : width/height of the tiles after resizing, in pixels.
+    -----------------------------------------------------------------------------------------------
+    #### Optional:
+    `max_workers` : threads decoding tiles, 0 loads tiles on demand. Default = `PARAMS_LDR`.
+    `prefetch` : max number of tiles decoded ahead. Default = `None` (`2 * max_workers`).
+    """
+    if max_workers <= 0:
+        for img_path in image_paths:
+            yield load_mask_tile(img_path, tile_size)
+        return
+    if prefetch is None:
+        prefetch = 2 * max_workers
+    with ThreadPoolExecutor(max_workers) as executor:
+        queued = deque()
+        for img_path in image_paths:
+            # keep at most `prefetch` tiles in flight, hand them over in submission order
+            queued.append(executor.submit(load_mask_tile, img_path, tile_size))
+            if len(queued) >= prefetch:
+                yield queued.popleft().result()
+        while queued:
+            yield queued.popleft().result()
+
+
 def global_mask_stitching(
         mask_folder,
         multichannel_coordinate,
@@ -444,11 +1102,24 @@ def global_mask_stitching(
         multichannel_size_um = 366,
         pixel_per_micron = 1,
         submask_division = 10,
-        submask_minpixel = 100
+        submask_minpixel = 100,
+        submask_engine = "numpy",
+        tile_workers = PARAMS_LDR,
+        headless = False,
+        preview_regions = None
     ):
     """
     Function: create global mask from mask folder, return coordinates for cleave areas and submasks
+
+    Note: the global mask is built as a memory-mapped `GlobalMask`, its pixels are kept next to
+    `output_file` (see `GlobalMask.pixels_path`) for the cleave maps.
+    `submask_engine` selects how submask pixels are counted, see `count_non_white_regions`,
+    `tile_workers` sets the number of threads decoding mask tiles, see `load_mask_tiles`.
+    Tiles, cleave areas and submasks are collected as `pyplot_create_region` keyword arguments
+    into `preview_regions` (if given), and only drawn into matplotlib if `headless` is False.
     """
+    if preview_regions is None:
+        preview_regions = []
     # get PNG files sorted by name
     image_files = sorted([f for f in os.listdir(mask_folder) if f.endswith(mask_affix)])
     print("Number of images: ", len(image_files))
@@ -478,10 +1149,11 @@ def global_mask_stitching(
     dim_y_cleaves = math.ceil((range_y_um + multichannel_size_um) / laser_cleave_size_um)
     global_mask_width = dim_x_cleaves * laser_cleave_size_um * pixel_per_micron
     global_mask_height = dim_y_cleaves * laser_cleave_size_um * pixel_per_micron
-    output_image = Image.new(
-        'P',
+    # the global mask is memory-mapped next to the output file, tiles are written into it
+    output_image = GlobalMask.create(
         (global_mask_width, global_mask_height),
-        color = (255,255,255)
+        color = (255,255,255),
+        file_path = GlobalMask.pixels_path(output_file)
     )
     # calculate the starting xy coordinates (top-left center)
     starting_x_px = (global_mask_width - (range_x_um + multichannel_size_um)*pixel_per_micron) / 2
@@ -495,12 +1167,20 @@ def global_mask_stitching(
                       + (multichannel_size_um - laser_cleave_size_um)/2 # adjust for cleavage size
                     )
     # stitch global mask using multichannel coordinates
+    # tiles are decoded and transformed ahead of time by a thread pool, pasted here in order
+    image_paths = [os.path.join(mask_folder, image_file) for image_file in image_files]
+    tiles = load_mask_tiles(
+        image_paths,
+        multichannel_size_um * pixel_per_micron,
+        max_workers = tile_workers
+    )
+    start = time.perf_counter()
     for i, xy_pair in enumerate(coordinates):
         x_px = int(starting_x_px + (xy_pair[0] - min_x_um) * pixel_per_micron)
         y_px = int(starting_y_px + (max_y_um - xy_pair[1]) * pixel_per_micron)
-        img_path = os.path.join(mask_folder, image_files[i])
-        img = Image.open(img_path).resize([multichannel_size_um, multichannel_size_um]).convert('P')
-        pyplot_create_region(
+        img_path = image_paths[i]
+        img = next(tiles)
+        preview_regions.append(dict(
             x = xy_pair[0],
             y = xy_pair[1],
             w = multichannel_size_um,
@@ -511,10 +1191,11 @@ def global_mask_stitching(
             a = 0.5,
             g = 0.25,
             r = 180
-        )
-        img = img.transpose(method=Image.Transpose.FLIP_LEFT_RIGHT)
-        img = img.transpose(method=Image.Transpose.FLIP_TOP_BOTTOM)
+        ))
         output_image.paste(img, (x_px, y_px))
+    elapsed = time.perf_counter() - start
+    print(f"Stitched {len(image_paths)} tiles in {elapsed:.2f} s "
+          f"({len(image_paths) / max(elapsed, 1e-9):.1f} tiles/s).")
     # calculate submask dimension in um and px
     submask_dimension_um = int(laser_cleave_size_um / submask_division)
     submask_dimension_px = int(submask_dimension_um * pixel_per_micron)
@@ -527,6 +1208,8 @@ def global_mask_stitching(
     cleave_center_coord_px = []
     submask_coordinates_px = []
     submask_coordinates_um = []
+    submask_candidates_px = []
+    submask_candidates_um = []
     current_x = starting_x_um
     current_y = starting_y_um
     current_i = 0
@@ -534,17 +1217,17 @@ def global_mask_stitching(
         for col in range(dim_x_cleaves):
             # append xy cleave coordinates in um
             cleave_center_coord_um.append([current_x, current_y])
-            pyplot_create_region(
-                current_x,
-                current_y,
-                laser_cleave_size_um,
-                laser_cleave_size_um,
+            preview_regions.append(dict(
+                x = current_x,
+                y = current_y,
+                w = laser_cleave_size_um,
+                h = laser_cleave_size_um,
                 c = 'r',
                 e = 'r',
                 i = current_i,
                 a = 0.5,
                 g = 0.75
-            )
+            ))
             # produce xy coordinates for non-empty submasks (px)
             xy_displacement = ((submask_dimension_px*(submask_division-1))/2)/pixel_per_micron
             f0_submask_x_um = current_x - xy_displacement
@@ -558,7 +1241,7 @@ def global_mask_stitching(
                                           ])
             for i in range(submask_division):
                 for j in range(submask_division):
-                    # check if the submask area is empty (below minimum pixel count threshold)
+                    # collect the submask area, emptiness is checked after the scan
                     location_x_um = int(f0_submask_x_um + j*submask_dimension_um)
                     location_y_um = int(f0_submask_y_um - i*submask_dimension_um)
                     location_x_px = int(f0_submask_x_px + j*submask_dimension_px)
@@ -567,19 +1250,8 @@ def global_mask_stitching(
                                      location_y_px,
                                      location_x_px + submask_dimension_px,
                                      location_y_px + submask_dimension_px]
-                    submask_section = output_image.crop(submask_locus)
-                    if count_non_white_pixel(submask_section) > submask_minpixel:
-                        submask_coordinates_um.append([location_x_um, location_y_um])
-                        submask_coordinates_px.append(submask_locus)
-                        pyplot_create_region(
-                            location_x_um,
-                            location_y_um,
-                            submask_dimension_um,
-                            submask_dimension_um,
-                            c = 'r',
-                            e = 'r',
-                            a = 0.1
-                        )
+                    submask_candidates_um.append([location_x_um, location_y_um])
+                    submask_candidates_px.append(submask_locus)
             # update coordinates and index
             current_i += 1
             if col != (dim_x_cleaves - 1):
@@ -594,8 +1266,36 @@ def global_mask_stitching(
                 # then instead of moving the x coordinate, move the y coordinate
                 # this will move the current xy coordinates to the next row
                 current_y -= laser_cleave_size_um
-    # save the constructed global laser image, return
+    # count pixels of all candidate submasks at once, keep the non-empty ones
+    if submask_engine == "index":
+        mask_index = MaskIndex.from_image(output_image)
+        submask_pixel_counts = mask_index.count_regions(submask_candidates_px)
+    else:
+        submask_pixel_counts = count_non_white_regions(
+            output_image, submask_candidates_px, engine=submask_engine)
+    for k, pixel_count in enumerate(submask_pixel_counts):
+        if pixel_count > submask_minpixel:
+            location_x_um, location_y_um = submask_candidates_um[k]
+            submask_coordinates_um.append([location_x_um, location_y_um])
+            submask_coordinates_px.append(submask_candidates_px[k])
+            preview_regions.append(dict(
+                x = location_x_um,
+                y = location_y_um,
+                w = submask_dimension_um,
+                h = submask_dimension_um,
+                c = 'r',
+                e = 'r',
+                a = 0.1
+            ))
+    # draw preview regions into matplotlib unless running headless
+    if not headless:
+        pyplot_create_regions(preview_regions)
+    # save the constructed global laser image, keep its memory-mapped pixels as the cache
     output_image.save(output_file, format='PNG')
+    output_image.flush()
+    # keep the summed-area table next to the global mask for later threshold sweeps
+    if submask_engine == "index":
+        mask_index.save(MaskIndex.cache_path(output_file))
     return (
         True,   # global mask construction successful
         laser_cleave_size_um,
@@ -606,6 +1306,17 @@ def global_mask_stitching(
     )
 
 
+def save_region_preview(preview_regions: list, file_path, figure_size = 10):
+    """
+    Function: draw collected preview regions into a new figure, save it as an image file.
+    """
+    figure = plt.figure(figsize=(figure_size, figure_size))
+    pyplot_create_regions(preview_regions)
+    plt.gca().set_aspect('equal')
+    figure.savefig(file_path)
+    plt.close(figure)
+
+
 def find_closest_coordinate(coordinates, point):
     """
     Function: ind the index of the coordinate pair that is closest to the given point.
@@ -635,20 +1346,407 @@ def find_closest_coordinate(coordinates, point):
     return closest_index
 
 
+class CoordinateIndex:
+    """
+    Class: spatial index over xy coordinates (e.g. FOV centers), for batched nearest neighbours.
+
+    Coordinates on a (near) regular lattice, like planned and recorded FOV centers, are hashed
+    into a uniform grid with about one point per cell, and a query only compares the points of
+    the cells around it. Irregular coordinates use a KD-tree (scipy) instead, or a chunked
+    brute-force search if scipy is not installed. Results are exact and equal to
+    `find_closest_coordinate`: ties go to the lowest index.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, coordinates, cell_size = None, backend = "auto", max_per_cell = 8):
+        self.points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        if len(self.points) == 0:
+            raise ValueError("cannot index an empty coordinate list")
+        self.origin = self.points.min(axis=0)
+        span = self.points.max(axis=0) - self.origin
+        # about one point per cell, the lattice pitch for regular FOV scans (at most n cells wide)
+        if cell_size is None:
+            cell_size = max(math.sqrt(span[0] * span[1] / len(self.points)),
+                            span.max() / len(self.points), 1e-6)
+        self.cell_size = float(cell_size)
+        self.tree = None
+        self.cells = None
+        self.shape = np.floor(span / self.cell_size).astype(np.int64) + 1
+        cell_xy = self.cell_of(self.points)
+        cell_id = cell_xy[:,0] * self.shape[1] + cell_xy[:,1]
+        occupancy = np.bincount(cell_id, minlength=int(np.prod(self.shape)))
+        if backend == "auto":
+            backend = "grid" if occupancy.max() <= max_per_cell else "kdtree"
+        if backend == "grid":
+            # dense (cols x rows x max occupancy) table of point indices, -1 for empty slots
+            order = np.argsort(cell_id, kind='stable')
+            slot = np.arange(len(order)) - np.searchsorted(cell_id[order], cell_id[order])
+            self.cells = np.full((*self.shape, occupancy.max()), -1, dtype=np.int64)
+            self.cells[cell_xy[order,0], cell_xy[order,1], slot] = order
+        elif backend == "kdtree":
+            try:
+                from scipy.spatial import cKDTree     # optional, brute force without scipy
+                self.tree = cKDTree(self.points)
+            except ImportError:
+                backend = "brute"
+        elif backend != "brute":
+            raise ValueError(f"unknown coordinate index backend '{backend}'")
+        self.backend = backend
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ constructors ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def from_csv(cls, csv_file, **kwargs):
+        """
+        Function: index the xy coordinates of a coordinate file (e.g. coord_planned.csv).
+        """
+        return cls(read_xycoordinates(csv_file), **kwargs)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def cell_of(self, points: np.ndarray):
+        """
+        Function: return the (col, row) grid cell of every point, unclipped.
+        """
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+    # ---------------------------------------------------------------------------------------------
+    def nearest(self, points) -> np.ndarray:
+        """
+        Function: return the index of the closest coordinate for every [x, y] point.
+        """
+        return self.query(points, k=1)[1][:,0]
+    # ---------------------------------------------------------------------------------------------
+    def query(self, points, k = 1, max_ring = 3):
+        """
+        ### Return (distances, indices) of the k closest coordinates of every [x, y] point.
+
+        `points` : list of [x, y] query points.
+        -------------------------------------------------------------------------------------------
+        #### Optional:
+        `k` : number of neighbours. Default = `1`.
+        `max_ring` : grid cells searched around a point before falling back. Default = `3`.
+
+        Both arrays have shape (points, k), sorted by distance, then by index.
+        """
+        queries = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        k = min(k, len(self.points))
+        distances = np.full((len(queries), k), np.inf)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        pending = np.arange(len(queries))
+        if self.backend == "grid":
+            for ring in range(1, max_ring + 1):
+                if len(pending) == 0:
+                    break
+                pending = self.query_grid(queries, pending, k, ring, distances, indices)
+        elif self.backend == "kdtree":
+            pending = self.query_tree(queries, pending, k, distances, indices)
+        if len(pending) > 0:
+            self.query_brute(queries, pending, k, distances, indices)
+        return distances, indices
+    # ---------------------------------------------------------------------------------------------
+    def candidates(self, queries: np.ndarray, candidate_index: np.ndarray, k: int):
+        """
+        Function: return the k closest (distances, indices) among candidate indices (-1 = none).
+        """
+        valid = candidate_index >= 0
+        delta = self.points[np.where(valid, candidate_index, 0)] - queries[:, None, :]
+        # same arithmetic as find_closest_coordinate, so ties are detected the same way
+        distance = np.sqrt(delta[..., 0] ** 2 + delta[..., 1] ** 2)
+        distance[~valid] = np.inf
+        candidate_index = np.where(valid, candidate_index, np.iinfo(np.int64).max)
+        # sort by index first, a stable sort by distance then keeps the lowest index on ties
+        order = np.argsort(candidate_index, axis=1, kind='stable')
+        distance = np.take_along_axis(distance, order, axis=1)
+        candidate_index = np.take_along_axis(candidate_index, order, axis=1)
+        order = np.argsort(distance, axis=1, kind='stable')[:, :k]
+        return (np.take_along_axis(distance, order, axis=1),
+                np.take_along_axis(candidate_index, order, axis=1))
+    # ---------------------------------------------------------------------------------------------
+    def query_grid(self, queries, pending, k, ring, distances, indices):
+        """
+        Function: search the (2 ring + 1)^2 cells around pending queries, return unresolved ones.
+        """
+        cell_xy = self.cell_of(queries[pending])
+        offsets = np.arange(-ring, ring + 1)
+        cols = cell_xy[:, 0, None, None] + offsets[None, :, None]
+        rows = cell_xy[:, 1, None, None] + offsets[None, None, :]
+        inside = (cols >= 0) & (cols < self.shape[0]) & (rows >= 0) & (rows < self.shape[1])
+        block = self.cells[np.clip(cols, 0, self.shape[0] - 1), np.clip(rows, 0, self.shape[1] - 1)]
+        block[~inside] = -1
+        best_d, best_i = self.candidates(queries[pending], block.reshape(len(pending), -1), k)
+        # points outside of the block are at least ring * cell_size away from the query
+        resolved = best_d[:, -1] < ring * self.cell_size
+        distances[pending[resolved]] = best_d[resolved]
+        indices[pending[resolved]] = best_i[resolved]
+        return pending[~resolved]
+    # ---------------------------------------------------------------------------------------------
+    def query_tree(self, queries, pending, k, distances, indices, spare = 4):
+        """
+        Function: query the KD-tree with spare neighbours to resolve ties, return unresolved ones.
+        """
+        width = min(k + spare, len(self.points))
+        _, tree_i = self.tree.query(queries[pending], k=width)
+        tree_i = np.asarray(tree_i).reshape(len(pending), width)
+        best_d, best_i = self.candidates(queries[pending], tree_i, width)
+        # a tie may continue past the searched neighbours unless the last one is strictly farther
+        resolved = (best_d[:, -1] > best_d[:, k-1]) | (width == len(self.points))
+        distances[pending[resolved]] = best_d[resolved, :k]
+        indices[pending[resolved]] = best_i[resolved, :k]
+        return pending[~resolved]
+    # ---------------------------------------------------------------------------------------------
+    def query_brute(self, queries, pending, k, distances, indices, chunk_size = 2**22):
+        """
+        Function: compare pending queries with all coordinates, in chunks of bounded size.
+        """
+        step = max(chunk_size // len(self.points), 1)
+        everything = np.arange(len(self.points))
+        for start in range(0, len(pending), step):
+            chunk = pending[start:start+step]
+            candidate_index = np.broadcast_to(everything, (len(chunk), len(self.points)))
+            best_d, best_i = self.candidates(queries[chunk], candidate_index, k)
+            distances[chunk] = best_d
+            indices[chunk] = best_i
+
+
+class FocalSurface:
+    """
+    Class: focal surface z(x, y) fitted once to recorded FOV xyz, evaluated for all cleave centers.
+
+    Methods:
+    - "linear": piecewise linear over the triangulated FOVs (exact at every FOV), the polynomial
+      is only used outside of them (needs scipy, the default).
+    - "polynomial": robust (Huber) least squares polynomial over the whole slide, tolerant to
+      failed autofocus FOVs but may miss warped tissue by more than the depth of field.
+    - "spline": smoothed local thin plate spline (needs scipy).
+    - "nearest": z of the nearest FOV, the former behavior. Used if scipy is not installed, or the
+      FOVs cannot be triangulated (e.g. a single row).
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(
+            self,
+            coordinates,
+            z_values,
+            method = PARAMS_ZMD,
+            degree = 2,
+            smoothing = 1.0,
+            neighbors = 64
+        ):
+        self.points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        self.z = np.asarray(z_values, dtype=np.float64).reshape(-1)
+        if len(self.points) != len(self.z) or len(self.z) == 0:
+            raise ValueError(f"cannot fit {len(self.z)} z values to {len(self.points)} FOVs")
+        if method not in PARAMS_ZMS:
+            raise ValueError(f"unknown focal surface method '{method}'")
+        self.method = method
+        self.degree = degree
+        self.smoothing = smoothing
+        self.neighbors = neighbors
+        # normalize xy for a well-conditioned polynomial fit
+        self.center = self.points.mean(axis=0)
+        self.scale = max(float(np.abs(self.points - self.center).max()), 1.0)
+        self.outliers = 0
+        self.coefficients = None
+        self.model = None
+        self.fit()
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ constructors ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def from_csv(cls, csv_file, **kwargs):
+        """
+        Function: fit the recorded xyz of a coordinate file (e.g. coord_recorded.csv).
+        """
+        # rows still in the journal of the file (see csvset_modify_concat) are read as well, the
+        # journal is left to its writer
+        data = read_coordinates(csv_file, PARAMS_CRC)
+        return cls(data[["x", "y"]].values.tolist(), data["z"].tolist(), **kwargs)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def fit(self):
+        """
+        Function: fit the surface of the selected method.
+        """
+        if self.method in ("polynomial", "linear"):
+            # the linear interpolator extrapolates outside of the FOVs with the polynomial
+            self.fit_polynomial()
+        if self.method == "nearest":
+            self.model = CoordinateIndex(self.points)
+        elif self.method in ("linear", "spline"):
+            try:
+                from scipy.interpolate import LinearNDInterpolator, RBFInterpolator
+            except ImportError:
+                print(f"Warning: {self.method} focal surface needs scipy, using nearest FOV z.")
+                self.method = "nearest"
+                self.model = CoordinateIndex(self.points)
+                return
+            if self.method == "linear":
+                try:
+                    if len(self.z) < 3:
+                        raise ValueError("less than 3 FOVs")
+                    self.model = LinearNDInterpolator(self.points, self.z)
+                except (ValueError, RuntimeError) as e:    # collinear FOVs (QhullError)
+                    print(f"Warning: FOVs cannot be triangulated ({type(e).__name__}), using "
+                          "nearest FOV z.")
+                    self.method = "nearest"
+                    self.model = CoordinateIndex(self.points)
+            elif self.method == "spline":
+                self.model = RBFInterpolator(
+                    self.points, self.z,
+                    kernel = "thin_plate_spline",
+                    smoothing = self.smoothing,
+                    neighbors = min(self.neighbors, len(self.z)),
+                    degree = 1 if len(self.z) >= 3 else 0
+                )
+    # ---------------------------------------------------------------------------------------------
+    def design(self, points: np.ndarray, degree: int) -> np.ndarray:
+        """
+        Function: return the polynomial terms x^i * y^j (i + j <= degree) of normalized points.
+        """
+        u, v = ((points - self.center) / self.scale).T
+        return np.stack([u**i * v**(d-i) for d in range(degree + 1) for i in range(d + 1)], 1)
+    # ---------------------------------------------------------------------------------------------
+    def fit_polynomial(self, iterations = 20, huber = 1.345):
+        """
+        Function: iteratively reweighted least squares with Huber weights.
+        """
+        # lower the degree until there are enough FOVs for all terms
+        degree = self.degree
+        while degree > 0 and (degree + 1) * (degree + 2) // 2 > len(self.z):
+            degree -= 1
+        self.degree = degree
+        terms = self.design(self.points, degree)
+        weights = np.ones(len(self.z))
+        for _ in range(iterations):
+            root = np.sqrt(weights)[:, None]
+            # terms the FOVs hardly determine (e.g. y terms of a single FOV row) are left out
+            coefficients = np.linalg.lstsq(terms * root, self.z * root[:, 0], rcond=1e-2)[0]
+            residuals = self.z - terms @ coefficients
+            # robust residual scale from the median absolute deviation
+            sigma = 1.4826 * np.median(np.abs(residuals - np.median(residuals)))
+            if sigma <= 1e-12:
+                break
+            scaled = np.abs(residuals) / (huber * sigma)
+            weights = np.where(scaled > 1, 1 / np.maximum(scaled, 1e-12), 1.0)
+        self.coefficients = coefficients
+        self.outliers = int(np.count_nonzero(np.abs(residuals) > 3 * sigma)) if sigma > 1e-12 else 0
+    # ---------------------------------------------------------------------------------------------
+    def predict(self, points) -> np.ndarray:
+        """
+        Function: return the z values of the surface at all [x, y] points.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            return np.zeros(0)
+        if self.method == "nearest":
+            return self.z[self.model.nearest(points)]
+        if self.method == "spline":
+            return self.model(points)
+        z = self.design(points, self.degree) @ self.coefficients
+        if self.method == "linear":
+            inside = self.model(points)
+            z = np.where(np.isnan(inside), z, inside)
+        return z
+    # ---------------------------------------------------------------------------------------------
+    def statistics(self, folds = 5, seed = 0) -> dict:
+        """
+        ### Return residual statistics of the surface at the recorded FOVs.
+
+        `folds` : k-fold cross validation, each FOV is predicted by a surface fitted without it.
+        Default = `5`.
+        `seed` : random seed of the fold assignment. Default = `0`.
+
+        Fitted residuals of interpolating methods are ~0, cross validated residuals estimate the
+        z error at cleave centers between FOVs.
+        """
+        residuals = self.z - self.predict(self.points)
+        holdout = np.full(len(self.z), np.nan)
+        if len(self.z) >= 2 * folds:
+            fold = np.random.default_rng(seed).permutation(len(self.z)) % folds
+            for k in range(folds):
+                surface = FocalSurface(
+                    self.points[fold != k], self.z[fold != k], self.method, self.degree,
+                    self.smoothing, self.neighbors)
+                holdout[fold == k] = self.z[fold == k] - surface.predict(self.points[fold == k])
+        return {
+            "method": self.method,
+            "fovs": len(self.z),
+            "degree": self.degree if self.coefficients is not None else None,
+            "outliers": self.outliers,
+            "rms": float(np.sqrt(np.mean(residuals ** 2))),
+            "max_abs": float(np.abs(residuals).max()),
+            "cv_rms": float(np.sqrt(np.mean(holdout ** 2))),
+            "cv_max_abs": float(np.abs(holdout).max()),
+        }
+
+
 # ========================================= main function =========================================
 
-def mercury_02():
+def mercury_02(
+        pixel_per_micron = 1,
+        folder = PARAMS_EXP,
+        values = None,
+        z_model = PARAMS_ZMD,
+        bit_scheme_engine = PARAMS_SEQ
+    ):
     """
     Main application loop of mercury 02, display constructed pyplot preview.
+
+    `values` : initial entries [ports, scan size, concatenations, subdivision, threshold].
     """
     # set customtkinter appearance mode and color theme
     customtkinter.set_appearance_mode("dark")
     customtkinter.set_default_color_theme("blue")
     # enter main loop and return user inputs when ended
     try:
-        app = App()
+        app = App(pixel_per_micron, folder, values, z_model, bit_scheme_engine)
         app.resizable(False, False)
         app.protocol("WM_DELETE_WINDOW", app.on_closing)
         app.mainloop()
     except AttributeError:
         return None
+
+
+def mercury_02_main(argv = None, pixel_per_micron = 1):
+    """
+    Function: parse command line arguments, construct the scheme headless or start the GUI.
+    """
+    parser = argparse.ArgumentParser(description=WINDOW_TXT)
+    parser.add_argument("--headless", action="store_true",
+                        help="construct the laser scheme without GUI or matplotlib windows")
+    parser.add_argument("--folder", default=PARAMS_EXP, help="experiment folder")
+    parser.add_argument("--preview", default=None,
+                        help="save a preview image of the scheme to this file (headless only)")
+    parser.add_argument("--ports", type=int, default=PARAMS_CFG[0]["textvar"])
+    parser.add_argument("--scan-size", type=int, default=PARAMS_CFG[1]["textvar"])
+    parser.add_argument("--concatenations", type=read_concatenations,
+                        default=PARAMS_CFG[2]["textvar"], help="number, or auto")
+    parser.add_argument("--subdivision", type=int, default=PARAMS_CFG[3]["textvar"])
+    parser.add_argument("--threshold", type=int, default=PARAMS_CFG[4]["textvar"])
+    parser.add_argument("--pixel-per-micron", type=int, default=pixel_per_micron,
+                        help="global mask pixels per um (1 for 366px masks, 2 for 732px masks)")
+    parser.add_argument("--z-model", default=PARAMS_ZMD, choices=PARAMS_ZMS,
+                        help="focal surface model of cleave center z")
+    parser.add_argument("--bit-scheme", default=PARAMS_SEQ, choices=PARAMS_SQS,
+                        help="bit scheme engine, balanced = equal submasks in every round")
+    args = parser.parse_args(argv)
+    if args.preview is not None and not args.headless:
+        parser.error("--preview requires --headless")
+    if args.headless:
+        plt.switch_backend("Agg")
+        regions = construct_laser_scheme(
+            args.folder,
+            args.ports,
+            args.scan_size,
+            args.concatenations,
+            args.subdivision,
+            args.threshold,
+            headless = True,
+            pixel_per_micron = args.pixel_per_micron,
+            z_model = args.z_model,
+            bit_scheme_engine = args.bit_scheme
+        )
+        if regions is not None and args.preview is not None:
+            save_region_preview(regions, args.preview)
+    else:
+        mercury_02(
+            args.pixel_per_micron,
+            args.folder,
+            [args.ports, args.scan_size, args.concatenations, args.subdivision, args.threshold],
+            args.z_model,
+            args.bit_scheme
+        )
+
+if __name__ == "__main__":
+    mercury_02_main()
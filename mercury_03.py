@@ -8,11 +8,23 @@ from datetime import date
 
 import pandas as pd
 import customtkinter
-from PIL import Image, ImageOps
 
-from mercury_00 import load_mask_preset
-from mercury_01 import open_file_dialog
-from mercury_02 import count_non_white_pixel
+from mercury_01 import open_file_dialog, optimize_route
+from mercury_02 import MaskIndex
+from mercury_core import (  # pylint: disable=unused-import
+    MaskPrerenderer,
+    PngMaskSink,
+    SharedMaskSink,
+    round_context,
+    mask_bundle,
+    mask_sink,
+    close_mask_sinks,
+    read_shared_mask,
+    update_mask,
+    record_laser_coord,
+    finish_round
+)
+from mercury_db import experiment_database
 
 WINDOW_TXT = "Mercury III - Fluid Scheme Constructor"
 WINDOW_RES = "800x100"
@@ -29,6 +41,8 @@ PARAMS_GLB = "image_mask_global.png"
 PARAMS_SCT = "coord_scan_center.csv"
 PARAMS_BIT = "config_bit_scheme.csv"
 PARAMS_TMP = "image_mask_tmp.png"
+PARAMS_RTE = "coord_scan_center (route).csv"
+PARAMS_UDB = True  # read csv files through the experiment database (mercury_db), else pandas
 
 
 # ===================================== customtkinter classes =====================================
@@ -48,8 +62,9 @@ class App(customtkinter.CTk, Moa):
     Class: main application window and customtkinter main loop.
     """
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def __init__(self):
+    def __init__(self, pixel_per_micron = 1):
         super().__init__()
+        self.pixel_per_micron = pixel_per_micron
         # ---------------------------------- application setting ----------------------------------
         self.title(WINDOW_TXT)
         self.geometry(WINDOW_RES)
@@ -74,28 +89,48 @@ class App(customtkinter.CTk, Moa):
         path_scanct = os.path.join(path_folder, PARAMS_SCT)
         # arrange parameters into labview clusters (tuples)
         port_list = []
-        port_length = len(pd.read_csv(
-            path_bitsch, keep_default_na = False).values.tolist()[0][8].split(', '))
+        if PARAMS_UDB:
+            database = experiment_database(path_folder)
+            port_length = database.bit_length()
+            center_coordinates = database.scan_centers()
+        else:
+            port_length = len(pd.read_csv(
+                path_bitsch, keep_default_na = False).values.tolist()[0][8].split(', '))
+            center_coordinates = pd.read_csv(
+                path_scanct, keep_default_na = False, usecols=[1,2,3,4,5,6,7]).values.tolist()
         for i in range(port_length):
             port_list.append(i+1)
-        center_coordinates = pd.read_csv(
-            path_scanct, keep_default_na = False, usecols=[1,2,3,4,5,6,7]).values.tolist()
         # # read cleave maps to create fov coordinate files
         # # so that empty areas are not included in the experiment construction
+        # pixel counts come from a summed-area table, cached next to each cleave map
         fov = []
+        route = []
+        # temp masks of every round are rendered in the background once its csv is saved
+        prerenderer = MaskPrerenderer(path_folder, self.pixel_per_micron)
+        center_regions = [coords[3:7] for coords in center_coordinates]
         for i in range(len(port_list)):
-            mask = Image.open(os.path.join(path_folder, PARAMS_MAP, f"Round {i}.png"))
-            cnt = 0
+            mask_file = os.path.join(path_folder, PARAMS_MAP, f"Round {i}.png")
+            mask_index = MaskIndex.from_file(mask_file)
+            px_threshold = 10
             df = []
-            for j, coords in enumerate(center_coordinates):
-                temp = mask.crop(coords[3:7])
-                px_threshold = 10
-                if count_non_white_pixel(temp) > px_threshold:
-                    cnt += 1
+            for j, pixel_count in enumerate(mask_index.count_regions(center_regions)):
+                if pixel_count > px_threshold:
                     df.append(center_coordinates[j])
-            fov.append(cnt)
+            # visit active cleave centers in the order of shortest stage travel
+            order, travel_before, travel_after = optimize_route([coords[0:2] for coords in df])
+            df = [df[k] for k in order]
+            route.append([i, len(df), travel_before, travel_after])
+            fov.append(len(df))
             dataframe = pd.DataFrame(df, columns=['x','y','z','w','n','e','s'])
             dataframe.to_csv(os.path.join(path_folder, PARAMS_MAP, f"Round {i}.csv"), index=True)
+            prerenderer(i, len(df))
+        # save stage travel of every round, in serpentine and in optimized order
+        dataframe = pd.DataFrame(route, columns=['round','centers','serpentine','optimized'])
+        dataframe.to_csv(os.path.join(path_folder, PARAMS_RTE), index=False)
+        prerenderer.close()
+        if PARAMS_UDB:
+            # index the new round csv files
+            database.sync()
         # return saved data
         self.rtn = (port_list, path_lsrimg, path_tmpmsk, fov)
         self.quit()
@@ -154,127 +189,9 @@ class Exp(customtkinter.CTkFrame):
             self.ent_pth.configure(textvariable=tk.StringVar(master=self, value=file_path))
 
 
-# ===================================== independent functions =====================================
-
-def update_mask(img_folder, num_round, area):
-    """
-    Function: update and stretch temp cleave mask based on round/area number.
-    return false if the update is unsuccessful.
-    """
-    # check for valid input
-    if num_round < 0 or area < 0:
-        print(f"Warning: invalid round/area combination: round {num_round} area {area}.")
-        print(f"Warning: round {num_round} area {area} not executed.")
-        return [[],[],[]]
-    # try constructing the mask
-    try:
-        # access cleave center coordinates
-        exp_folder = os.path.dirname(img_folder)
-        center_coord = pd.read_csv(os.path.join(exp_folder, PARAMS_MAP, f"Round {num_round}.csv"),
-            keep_default_na = False, usecols=[1,2,3,4,5,6,7]).values.tolist()[area]
-        # access cleave mask area
-        tgt_mask = Image.open(os.path.join(exp_folder, PARAMS_MAP, f"Round {num_round}.png"))
-        tgt_mask = tgt_mask.crop(center_coord[3:7])
-        # # if the designated area is (nearly) blank, drop this area and return
-        # px_threshold = 10
-        # if count_non_white_pixel(tgt_mask) < px_threshold:
-        #     print(f"Warning: designated area's pixel count is lower than {px_threshold}.")
-        #     print(f"Warning: round {num_round} area {area} not executed.")
-        #     return False
-        # modify cleave mask
-        # first create a [366, 366] empty mask
-        mod_mask = Image.new('P', [366,366], color = (255,255,255))
-        # then paste the [300, 300] cleave mask to the center
-        bg_width, bg_height = mod_mask.size
-        overlay_width, overlay_height = tgt_mask.size
-        x_center = round((bg_width - overlay_width) / 2)
-        y_center = round((bg_height - overlay_height) / 2)
-        mod_mask.paste(tgt_mask, (x_center, y_center))
-        ###########################################################################################
-        # # stretch the modified mask to [2304, 2304]
-        # mod_mask = mod_mask.resize([2304, 2304]).rotate(180)
-        # # crop out laser area
-        # mod_mask = mod_mask.crop((208, 32, 208+1906, 32+2272))
-        # # resize laser area to [1024, 1024]
-        # mod_mask = mod_mask.resize([1024, 1024])
-        # # flip vertically, then rotate 90 degrees to the left
-        # mod_mask = mod_mask.transpose(Image.Transpose.FLIP_TOP_BOTTOM).rotate(90)
-        ###########################################################################################
-        # create new mask with 2304x2304 px and 200 px margin
-        tmp_mask = Image.new('P', [2304+200,2304+200], color = (255,255,255))
-        # stretch the modified mask to [2304, 2304]
-        mod_mask = mod_mask.resize([2304, 2304])
-        # paste modified mask onto the temporary mask (with 100 px margin)
-        tmp_mask.paste(mod_mask, (100,100))
-        # apply cropping, but from the perspective of bottom-right corner
-        rota, vert, hori, x, y, w, h = load_mask_preset(
-            os.path.join(os.path.dirname(os.path.realpath(__file__)), "default_calibration.yaml"), 1
-        )
-        mod_mask = tmp_mask.crop((
-            2304 + 100 - h - y,
-            2304 + 100 - w - x,
-            2304 + 100 - y,
-            2304 + 100 - x
-        ))
-        # rotate and flip based on mask calibration preset
-        mod_mask = mod_mask.rotate(rota+180)
-        if vert:
-            mod_mask = mod_mask.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
-        if hori:
-            mod_mask = mod_mask.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
-        # resize laser area to [1024, 1024]
-        mod_mask = mod_mask.resize([1024, 1024])
-        ###########################################################################################
-        # save the modified image as the new temp mask
-        rtn_mask = mod_mask.convert('L')
-        rtn_mask = ImageOps.invert(rtn_mask)
-        rtn_mask.save(os.path.join(exp_folder, PARAMS_TMP), format='PNG')
-        return center_coord[0:3]
-    except FileNotFoundError as e:
-        print(f"Warning: {e}")
-        print(f"Warning: round {num_round} area {area} not executed.")
-        return [[],[],[]]
-
-
-def record_laser_coord(laser_img_folder_path, coords, num_round, execute_status):
-    """
-    Function: create/append (laser imaging) coordinates into a given csv file.
-    if the file name/path does not exist, a file will be created.
-    if the file name/path already exists, coordinates will be appended at the end of the file.
-    """
-    # find csv file name
-    file = os.path.join(laser_img_folder_path, f"Round {num_round} (recorded).csv")
-    # if the file already exists, append new coordinates at the end of the file
-    if os.path.exists(file):
-        # read existing csv data as dataframe 1
-        df1 = pd.read_csv(file, usecols=[1,2,3,4])
-        # create new coordinates as dataframe 2
-        df2 = pd.DataFrame({
-            "x": [coords[0]],
-            "y": [coords[1]],
-            "z": [coords[2]],
-            "exec": execute_status
-        })
-        # avoid concat empty dataframes (may cause empty rows)
-        if df1.empty:
-            df = df2
-        else:
-            df = pd.concat([df1, df2], ignore_index=True)
-        df.to_csv(file, index=True)
-    # if the file does not exist, create the file and store coordinates
-    else:
-        df = pd.DataFrame({
-            "x": [coords[0]],
-            "y": [coords[1]],
-            "z": [coords[2]],
-            "exec": execute_status
-        })
-        df.to_csv(file, index=True)
-
-
 # ========================================= main function =========================================
 
-def mercury_03():
+def mercury_03(pixel_per_micron = 1):
     """
     Main application loop of mercury 01, return user inputs when loop ended.
     """
@@ -282,7 +199,7 @@ def mercury_03():
     customtkinter.set_appearance_mode("dark")
     customtkinter.set_default_color_theme("blue")
     # enter main loop and return user inputs when ended
-    app = App()
+    app = App(pixel_per_micron)
     app.resizable(False, False)
     app.protocol("WM_DELETE_WINDOW", app.on_closing)
     app.mainloop()
@@ -3,16 +3,29 @@ Mercury 04: image stitching previews, project version 1.24 (with python 3.9).
 """
 
 import os
+import math
+import json
+import time
+import tempfile
 import tkinter as tk
 from datetime import date
 
+import numpy as np
 import pandas as pd
 import customtkinter
 import matplotlib.pyplot as plt
 from PIL import Image
 
-from mercury_01 import pyplot_create_region, open_file_dialog
+from mercury_01 import (
+    pyplot_create_regions,
+    pyplot_region_fill,
+    pyplot_region_bounds,
+    pyplot_region_image,
+    pyplot_region_paste,
+    open_file_dialog
+)
 from mercury_02 import read_xycoordinates
+from mercury_db import experiment_database
 
 WINDOW_TXT = "Mercury IV - Image Stitching Preview"
 WINDOW_RES = "800x100"
@@ -29,6 +42,11 @@ PARAMS_GLB = "image_mask_global.png"
 PARAMS_SCT = "coord_scan_center.csv"
 PARAMS_BIT = "config_bit_scheme.csv"
 PARAMS_TMP = "image_mask_tmp.png"
+PARAMS_PRV = "image_preview"
+PARAMS_PYR = [16, 4, 1]
+PARAMS_PYS = 16384
+PARAMS_TLS = [256, 256]
+PARAMS_UDB = True  # read csv files through the experiment database (mercury_db), else pandas
 
 
 # ===================================== customtkinter classes =====================================
@@ -88,12 +106,19 @@ class App(customtkinter.CTk):
                     images.append(os.path.join(file_location, file))
             # acquire multichannel coordinates
             file_location = os.path.join(self.frm_ctl.ent_pth.get(), PARAMS_PLN)    # or PARAMS_CRD
-            coords = read_xycoordinates(file_location)
+            if PARAMS_UDB:
+                coords = experiment_database(self.frm_ctl.ent_pth.get()).planned_coordinates()
+            else:
+                coords = read_xycoordinates(file_location)
             # check list lengths, initiate preview
             if len(images) != len(coords):
                 print(f"Warning: found {len(images)} images, {len(coords)} coordinate pairs.")
                 return
-            preview_stitching(images, coords, 366, 366, 180, center_index=True)
+            preview_stitching(
+                images, coords, 366, 366, 180, center_index=True,
+                cache_folder = os.path.join(self.frm_ctl.ent_pth.get(), PARAMS_PRV),
+                cache_name = PARAMS_MCI
+            )
             # show plot preview window
             plt.gca().set_aspect('equal')
             plt.gcf().set_figheight(10)
@@ -118,12 +143,19 @@ class App(customtkinter.CTk):
                     images.append(os.path.join(file_location, file))
             # acquire multichannel coordinates
             file_location = os.path.join(self.frm_ctl.ent_pth.get(), PARAMS_PLN)    # or PARAMS_CRD
-            coords = read_xycoordinates(file_location)
+            if PARAMS_UDB:
+                coords = experiment_database(self.frm_ctl.ent_pth.get()).planned_coordinates()
+            else:
+                coords = read_xycoordinates(file_location)
             # check list lengths, initiate preview
             if len(images) != len(coords):
                 print(f"Warning: found {len(images)} images, {len(coords)} coordinate pairs.")
                 return
-            preview_stitching(images, coords, 366, 366, 180, center_index=True)
+            preview_stitching(
+                images, coords, 366, 366, 180, center_index=True,
+                cache_folder = os.path.join(self.frm_ctl.ent_pth.get(), PARAMS_PRV),
+                cache_name = PARAMS_MSK
+            )
             # show plot preview window
             if show_preview:
                 plt.gca().set_aspect('equal')
@@ -151,10 +183,15 @@ class App(customtkinter.CTk):
                 # center = pd.read_csv(
                 #     list_location, keep_default_na = False, usecols=[1,2,4,5,6,7]).values.tolist()
                 # coords = []
-                coords = pd.read_csv(
-                    os.path.join(self.frm_ctl.ent_pth.get(), PARAMS_MAP, f"Round {num_round}.csv"),
-                    keep_default_na = False, usecols = [1,2,4,5,6,7]
-                ).values.tolist()
+                if PARAMS_UDB:
+                    coords = experiment_database(self.frm_ctl.ent_pth.get()).round_centers(
+                        num_round, ("x", "y", "w", "n", "e", "s"))
+                else:
+                    coords = pd.read_csv(
+                        os.path.join(
+                            self.frm_ctl.ent_pth.get(), PARAMS_MAP, f"Round {num_round}.csv"),
+                        keep_default_na = False, usecols = [1,2,4,5,6,7]
+                    ).values.tolist()
                 images = []
                 for file in os.listdir(file_location):
                     if file[-len(file_endswith):] == file_endswith and file[0:5] != "Round":
@@ -173,7 +210,11 @@ class App(customtkinter.CTk):
             if len(images) != len(coords):
                 print(f"Warning: found {len(images)} images, {len(coords)} coordinate pairs.")
                 return
-            preview_stitching(images, coords, 366, 366, 180, export_result=True)
+            preview_stitching(
+                images, coords, 366, 366, 180, export_result=True,
+                cache_folder = os.path.join(self.frm_ctl.ent_pth.get(), PARAMS_PRV),
+                cache_name = f"{PARAMS_LSR} (Round {num_round})"
+            )
             # show plot preview window
             plt.gca().set_aspect('equal')
             plt.gcf().set_figheight(10)
@@ -238,6 +279,219 @@ class Exp(customtkinter.CTkFrame):
 
 # ===================================== independent functions =====================================
 
+class PreviewPyramid:
+    """
+    Class: multi-resolution RGBA mosaics of region images, cached on disk.
+
+    Levels are downsampled from the finest tile resolution by PARAMS_PYR (coarse to fine), each
+    level is limited to PARAMS_PYS pixels per side. Levels are saved as .npy files in the cache
+    folder next to a .json manifest holding the tile paths, modification times and placements;
+    the cache is rebuilt when any of them changes. Once shown, the level matching the zoom of
+    the axes is read lazily (memory-mapped) and cropped to the visible area.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, regions: list, cache_folder, cache_name, factors = None):
+        self.tiles = [region for region in pyplot_region_fill(regions) if region['j'] != ""]
+        self.bounds = pyplot_region_bounds(self.tiles)
+        self.manifest_path = os.path.join(cache_folder, f"{cache_name}.json")
+        self.level_path = os.path.join(cache_folder, f"{cache_name} (level {{}}).npy")
+        self.factors = PARAMS_PYR if factors is None else factors
+        self.key = [
+            [
+                tile['j'], os.stat(tile['j']).st_mtime_ns, tile['x'], tile['y'], tile['w'],
+                tile['h'], tile['a'], tile['b'], tile['d'], tile['r']
+            ]
+            for tile in self.tiles
+        ]
+        self.units = None
+        self.levels = {}
+        self.artist = None
+        self.current = None
+        self.updating = False
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def load(self):
+        """
+        Function: read the cache manifest, build all levels if the cache is missing or stale.
+        """
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+            fresh = manifest["key"] == self.key and all(
+                os.path.exists(self.level_path.format(k)) for k in range(len(manifest["units"]))
+            )
+        except (OSError, ValueError, KeyError):
+            fresh = False
+        if fresh:
+            self.units = manifest["units"]
+        else:
+            self.build()
+        return self
+    # ---------------------------------------------------------------------------------------------
+    def build(self):
+        """
+        Function: decode every tile once, paste it into all levels, save levels and manifest.
+        """
+        start = time.perf_counter()
+        west, east, south, north = self.bounds
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        # level units (coarse to fine), finest unit taken from the first tile
+        with Image.open(self.tiles[0]['j']) as img:
+            native = self.tiles[0]['w'] / img.size[0]
+        span = max(east - west, north - south)
+        self.units = []
+        for factor in sorted(self.factors, reverse=True):
+            unit = max(native * factor, span / PARAMS_PYS)
+            if len(self.units) == 0 or unit < self.units[-1]:
+                self.units.append(unit)
+        levels = []
+        for k, unit in enumerate(self.units):
+            rows = max(round((north - south) / unit), 1)
+            cols = max(round((east - west) / unit), 1)
+            levels.append(np.lib.format.open_memmap(
+                self.level_path.format(k), mode='w+', dtype=np.uint8, shape=(rows, cols, 4)
+            ))
+        for tile in self.tiles:
+            image = pyplot_region_image(tile)
+            for level, unit in zip(levels, self.units):
+                pyplot_region_paste(level, image, tile, west, north, unit)
+        for level in levels:
+            level.flush()
+        self.levels = {}
+        # write the manifest last, an interrupted build is rebuilt on the next call
+        with open(self.manifest_path, 'w', encoding='utf-8') as file:
+            json.dump({"key": self.key, "units": self.units}, file)
+        print(f"Preview pyramid built in {time.perf_counter() - start:.2f} s: "
+              f"{[level.shape[:2] for level in levels]}")
+    # ---------------------------------------------------------------------------------------------
+    def level(self, k: int):
+        """
+        Function: return level k as a read-only memory map, opened on first use.
+        """
+        if k not in self.levels:
+            self.levels[k] = np.load(self.level_path.format(k), mmap_mode='r')
+        return self.levels[k]
+    # ---------------------------------------------------------------------------------------------
+    def show(self, ax = None):
+        """
+        Function: draw the coarsest level into the axes, refine lazily when the view changes.
+        """
+        ax = plt.gca() if ax is None else ax
+        if self.units is None:
+            self.load()
+        west, east, south, north = self.bounds
+        self.artist = ax.imshow(self.level(0), extent=(west, east, south, north), origin='upper')
+        self.current = (0, None)
+        # callbacks keep bound methods as weak references, a closure keeps the pyramid alive
+        ax.callbacks.connect('xlim_changed', lambda changed_ax: self.update(changed_ax))
+        ax.callbacks.connect('ylim_changed', lambda changed_ax: self.update(changed_ax))
+        return self.artist
+    # ---------------------------------------------------------------------------------------------
+    def update(self, ax):
+        """
+        Function: swap in the coarsest level that is still sharp at the current zoom, cropped.
+        """
+        if self.updating or self.artist is None:
+            return
+        west, east, south, north = self.bounds
+        x_0, x_1 = sorted(ax.get_xlim())
+        y_0, y_1 = sorted(ax.get_ylim())
+        screen_unit = (x_1 - x_0) / max(ax.bbox.width, 1)
+        k = len(self.units) - 1
+        for i, unit in enumerate(self.units):
+            if unit <= screen_unit:
+                k = i
+                break
+        # crop the level to the visible area (plus one pixel), in level pixels
+        unit = self.units[k]
+        level = self.level(k)
+        col_0 = min(max(math.floor((x_0 - west) / unit) - 1, 0), level.shape[1] - 1)
+        col_1 = min(max(math.ceil((x_1 - west) / unit) + 1, col_0 + 1), level.shape[1])
+        row_0 = min(max(math.floor((north - y_1) / unit) - 1, 0), level.shape[0] - 1)
+        row_1 = min(max(math.ceil((north - y_0) / unit) + 1, row_0 + 1), level.shape[0])
+        crop = (col_0, col_1, row_0, row_1)
+        if self.current == (k, crop):
+            return
+        self.updating = True
+        try:
+            xlim, ylim = ax.get_xlim(), ax.get_ylim()
+            self.artist.set_data(level[row_0:row_1, col_0:col_1])
+            self.artist.set_extent((
+                west + col_0 * unit,
+                west + col_1 * unit,
+                north - row_1 * unit,
+                north - row_0 * unit
+            ))
+            # set_extent may autoscale, keep the view chosen by the user
+            ax.set_xlim(xlim)
+            ax.set_ylim(ylim)
+            self.current = (k, crop)
+        finally:
+            self.updating = False
+
+
+def load_laser_tile(img_path, tile_size = 366, crop_px = 33):
+    """
+    Function: return a laser image resized to the mask tile size, cropped and rotated by 180.
+    """
+    with Image.open(img_path) as img:
+        tmp = img.resize([tile_size, tile_size])
+    tmp = tmp.crop((crop_px, crop_px, tile_size-crop_px, tile_size-crop_px)).rotate(180)
+    return np.asarray(tmp)
+
+
+def stitch_laser_round(
+        images: list,
+        coords: list,
+        size,
+        file_path,
+        tile_size = 366,
+        crop_px = 33,
+        tiled = False,
+        use_memmap = False
+    ):
+    """
+    ### Stitch laser images of one round into one 16-bit buffer, save it once as a TIFF.
+
+    `images` : laser image paths.
+    `coords` : rows of the round CSV, [w, n, e, s] bounds (in mask pixels) in columns 2 to 5.
+    `size` : (width, height) of the stitched image, same as the cleave map.
+    `file_path` : path of the stitched TIFF.
+    -----------------------------------------------------------------------------------------------
+    #### Optional:
+    `tile_size` : size (in pixel) of the mask tile that a laser image covers. Default = `366`.
+    `crop_px` : pixels cropped from each side of the resized laser image. Default = `33`.
+    `tiled` : write a tiled TIFF (PARAMS_TLS tiles) with tifffile. Default = `False`.
+    `use_memmap` : stitch into a memory-mapped temporary file instead of RAM. Default = `False`.
+
+    Return the number of bytes written. BigTIFF is used when the image exceeds 4 GB.
+    """
+    width, height = size
+    if use_memmap:
+        buffer = np.memmap(
+            tempfile.TemporaryFile(), dtype=np.uint16, mode='w+', shape=(height, width)
+        )
+    else:
+        buffer = np.zeros((height, width), dtype=np.uint16)
+    for img_path, coord in zip(images, coords):
+        tile = load_laser_tile(img_path, tile_size, crop_px)
+        west, north = int(coord[2]), int(coord[3])
+        # clip the tile to the stitched image, the same way PIL.Image.paste does
+        col_0, row_0 = max(west, 0), max(north, 0)
+        col_1 = min(west + tile.shape[1], width)
+        row_1 = min(north + tile.shape[0], height)
+        if col_1 > col_0 and row_1 > row_0:
+            buffer[row_0:row_1, col_0:col_1] = tile[row_0-north:row_1-north, col_0-west:col_1-west]
+    bigtiff = buffer.nbytes >= 2**32 - 2**25
+    if tiled:
+        import tifffile     # only needed for tiled output
+        tifffile.imwrite(file_path, buffer, tile=PARAMS_TLS, bigtiff=bigtiff)
+    else:
+        Image.fromarray(np.ascontiguousarray(buffer)).save(file_path, big_tiff=bigtiff)
+    return os.path.getsize(file_path)
+
+
 def preview_stitching(
         images: list,
         coords: list,
@@ -247,28 +501,39 @@ def preview_stitching(
         center_index = False,
         export_result = False,
         flip_top_bottom = False,
-        flip_left_right = False
+        flip_left_right = False,
+        cache_folder = None,
+        cache_name = None,
+        export_tiled = False
     ):
     """
     Function: construct pyplot preview for listed images and coordinates.
+
+    Note: if `cache_folder` and `cache_name` are given, images are drawn from a `PreviewPyramid`
+    cached in `cache_folder` instead of being composited from full resolution every time.
+    If `export_result` is True, laser images are stitched with `stitch_laser_round` into the
+    `Round N.tif` next to the cleave map (tiled with tifffile if `export_tiled` is True).
     """
     try:
         # determine round number
         round_num = int(os.path.basename(images[0])[0:4]) - 1000
-        img_name = ""
-        # create a new image to save stitched laser images
+        # stitch laser images into one image, written once next to the cleave map
         if export_result:
             map_fld = os.path.join(os.path.dirname(os.path.dirname(images[0])), PARAMS_MAP)
             mask = Image.open(os.path.join(map_fld, f"Round {round_num}.png"))
-            img = Image.new('I;16', mask.size, 'black')
             img_name = os.path.join(map_fld, f"Round {round_num}.tif")
+            start = time.perf_counter()
+            written = stitch_laser_round(images, coords, mask.size, img_name, tiled=export_tiled)
+            print(f"Stitched {len(images)} laser images into {img_name} "
+                  f"({written / 2**20:.1f} MB) in {time.perf_counter() - start:.2f} s.")
         # initialize pyplot regions
+        regions = []
         for i, coord in enumerate(coords):
-            pyplot_create_region(
-                coord[0],
-                coord[1],
-                width,
-                height,
+            regions.append(dict(
+                x = coord[0],
+                y = coord[1],
+                w = width,
+                h = height,
                 i = i if center_index else os.path.basename(images[i]),
                 j = images[i],
                 a = 0.75,
@@ -279,17 +544,13 @@ def preview_stitching(
                 f = 'center',
                 v = 'center',
                 t = 45
-            )
-            if export_result:
-                # area_num = int(os.path.basename(images[i])[5:9]) - 1000
-                tmp = Image.open(images[i]).resize([366, 366])
-                tmp = tmp.crop((33, 33, 366-33, 366-33)).rotate(180)
-                nesw = []
-                for j in range(2, 6):
-                    nesw.append(int(coords[i][j]))
-                img.paste(tmp.resize([300, 300]), nesw)
-                # if needed, save stitched image as a new file
-                img.save(img_name)
+            ))
+        # draw all regions in one batch, images from the cached pyramid if possible
+        if cache_folder is not None and cache_name is not None and len(regions) > 0:
+            pyplot_create_regions(regions, k=False)
+            PreviewPyramid(regions, cache_folder, cache_name).show()
+        else:
+            pyplot_create_regions(regions)
     except (AttributeError, IndexError, FileNotFoundError) as e:
         print(f"Warning: error occured during stitching preview: {e}")
 
@@ -0,0 +1,484 @@
+"""
+Mercury Benchmark: performance benchmarks, project version 1.24 (with python 3.9).
+"""
+
+import os
+import sys
+import math
+import time
+import tempfile
+import contextlib
+import subprocess
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from mercury_02 import (
+    count_non_white_regions,
+    render_cleave_maps,
+    CleaveMapWriter,
+    ParallelCleaveMapWriter,
+    GlobalMask,
+    CoordinateIndex,
+    find_closest_coordinate
+)
+from mercury_core import (
+    PARAMS_MAP,
+    PARAMS_TMP,
+    PARAMS_RCD,
+    MaskPrerenderer,
+    PngMaskSink,
+    SharedMaskSink,
+    read_shared_mask,
+    update_mask,
+    coordinate_journal,
+    compact_journal
+)
+from mercury_04 import load_laser_tile, stitch_laser_round
+from mercury_db import ExperimentDatabase
+from mercury_client import WorkerClient
+
+PARAMS_SEED = 1024
+
+
+# ===================================== independent functions =====================================
+
+def synthetic_palette_mask(size_px, fill_ratio = 0.3, seed = PARAMS_SEED):
+    """
+    Function: return a synthetic [size_px, size_px] palette mask (index 0 = white, 1 = black).
+    """
+    rng = np.random.default_rng(seed)
+    pixels = np.zeros((size_px, size_px), dtype=np.uint8)
+    # fill the mask with square blobs, row band by row band to limit memory use
+    blob = 24
+    for north in range(0, size_px, blob):
+        band = rng.random((1, math.ceil(size_px / blob))) < fill_ratio
+        pixels[north:north+blob] = np.repeat(band, blob, axis=1)[:, :size_px]
+    img = Image.fromarray(pixels).convert('P')
+    img.putpalette([255, 255, 255, 0, 0, 0])
+    return img
+
+
+def submask_grid(size_px, submask_px):
+    """
+    Function: return [w, n, e, s] boxes tiling a [size_px, size_px] image.
+    """
+    regions = []
+    for north in range(0, size_px - submask_px + 1, submask_px):
+        for west in range(0, size_px - submask_px + 1, submask_px):
+            regions.append([west, north, west + submask_px, north + submask_px])
+    return regions
+
+
+# ===================================== benchmark functions =======================================
+
+def benchmark_submask_scan(size_px = 20000, submask_px = 30, reference_limit = 2000):
+    """
+    ### Compare the numpy and pillow engines of `count_non_white_regions`.
+
+    `size_px` : width/height of the synthetic global mask. Default = `20000`.
+    `submask_px` : width/height of one submask. Default = `30` (300 um, subdivision 10).
+    `reference_limit` : regions timed with the pillow engine, the rest is extrapolated.
+    """
+    print(f"Building synthetic {size_px}x{size_px} px mask...")
+    img = synthetic_palette_mask(size_px)
+    regions = submask_grid(size_px, submask_px)
+    print(f"Number of submasks: {len(regions)}")
+    # numpy engine on all regions
+    start = time.perf_counter()
+    counts = count_non_white_regions(img, regions, engine="numpy")
+    numpy_time = time.perf_counter() - start
+    # pillow engine on a sample of regions, extrapolated to all regions
+    sample = regions[:reference_limit]
+    start = time.perf_counter()
+    reference = count_non_white_regions(img, sample, engine="pillow")
+    pillow_time = (time.perf_counter() - start) * len(regions) / max(len(sample), 1)
+    if reference != counts[:len(sample)]:
+        print("Error: numpy and pillow engines disagree.")
+    print(f"numpy engine:  {numpy_time:10.2f} s")
+    print(f"pillow engine: {pillow_time:10.2f} s (extrapolated from {len(sample)} submasks)")
+    print(f"speedup:       {pillow_time / max(numpy_time, 1e-9):10.1f} x")
+    return numpy_time, pillow_time
+
+
+def benchmark_cleave_map_writers(size_px = 8000, num_rounds = 20, max_workers = 4):
+    """
+    ### Compare serial and process pool cleave map writers, check that outputs are identical.
+
+    `size_px` : width/height of the synthetic global mask. Default = `8000`.
+    `num_rounds` : number of rounds (bit string length). Default = `20`.
+    `max_workers` : number of processes of the parallel writer. Default = `4`.
+    """
+    regions = submask_grid(size_px, 100)
+    rng = np.random.default_rng(PARAMS_SEED)
+    bits = (rng.random((len(regions), num_rounds)) < 0.25).astype(np.uint8)
+    with tempfile.TemporaryDirectory() as folder:
+        # memory-mapped global mask, pool workers only receive its file name
+        img = GlobalMask.create(
+            (size_px, size_px), file_path=os.path.join(folder, "global (pixels).npy"))
+        img.pixels[:] = np.asarray(synthetic_palette_mask(size_px))
+        img.flush()
+        elapsed = {}
+        for name in ("serial", "parallel"):
+            os.makedirs(os.path.join(folder, name))
+            if name == "serial":
+                writer = CleaveMapWriter(os.path.join(folder, name))
+            else:
+                writer = ParallelCleaveMapWriter(os.path.join(folder, name), max_workers)
+            print(f"---------- {name} writer ----------")
+            start = time.perf_counter()
+            render_cleave_maps(img, regions, bits, writer)
+            writer.close()
+            elapsed[name] = time.perf_counter() - start
+        # deterministic output guarantee, parallel files must match serial files byte by byte
+        identical = True
+        for num_round in range(num_rounds):
+            file_name = f"Round {num_round}.png"
+            with open(os.path.join(folder, "serial", file_name), 'rb') as file_1, \
+                 open(os.path.join(folder, "parallel", file_name), 'rb') as file_2:
+                identical = identical and file_1.read() == file_2.read()
+    print(f"serial writer:   {elapsed['serial']:10.2f} s")
+    print(f"parallel writer: {elapsed['parallel']:10.2f} s ({max_workers} processes)")
+    print(f"byte-identical:  {identical}")
+    return elapsed, identical
+
+
+def benchmark_laser_stitching(grid_size = 10, laser_px = 512):
+    """
+    ### Compare write volume of per-tile TIFF saving (former mercury_04) and `stitch_laser_round`.
+
+    `grid_size` : laser images per side of the square scan. Default = `10`.
+    `laser_px` : width/height of one synthetic 16-bit laser image. Default = `512`.
+    """
+    rng = np.random.default_rng(PARAMS_SEED)
+    size = (grid_size * 300, grid_size * 300)
+    with tempfile.TemporaryDirectory() as folder:
+        images, coords = [], []
+        for k in range(grid_size * grid_size):
+            img_path = os.path.join(folder, f"{1000 + k}.tif")
+            pixels = rng.integers(0, 4096, (laser_px, laser_px), dtype=np.uint16)
+            Image.fromarray(pixels).save(img_path)
+            west, north = (k % grid_size) * 300, (k // grid_size) * 300
+            images.append(img_path)
+            coords.append([0, 0, west, north, west + 300, north + 300])
+        # former behavior: paste one tile, then re-encode and rewrite the whole image
+        file_before = os.path.join(folder, "Round 0 (before).tif")
+        start = time.perf_counter()
+        img = Image.new('I;16', size, 'black')
+        written_before = 0
+        for img_path, coord in zip(images, coords):
+            img.paste(Image.fromarray(load_laser_tile(img_path)), [int(c) for c in coord[2:6]])
+            img.save(file_before)
+            written_before += os.path.getsize(file_before)
+        time_before = time.perf_counter() - start
+        # stitch in memory, write once
+        file_after = os.path.join(folder, "Round 0 (after).tif")
+        start = time.perf_counter()
+        written_after = stitch_laser_round(images, coords, size, file_after)
+        time_after = time.perf_counter() - start
+        with Image.open(file_before) as img_1, Image.open(file_after) as img_2:
+            identical = np.array_equal(np.asarray(img_1), np.asarray(img_2))
+    print(f"per-tile saving: {written_before / 2**20:10.1f} MB written in {time_before:8.2f} s")
+    print(f"stitch once:     {written_after / 2**20:10.1f} MB written in {time_after:8.2f} s")
+    print(f"identical:       {identical}")
+    return (written_before, time_before), (written_after, time_after), identical
+
+
+def benchmark_nearest_fov(num_fovs = 10000, num_centers = 50000, reference_limit = 500):
+    """
+    ### Compare `find_closest_coordinate` and `CoordinateIndex` on a jittered FOV lattice.
+
+    `num_fovs` : number of FOV centers (square lattice, 300 um pitch). Default = `10000`.
+    `num_centers` : number of cleave centers to match. Default = `50000`.
+    `reference_limit` : centers timed with the linear scan, the rest is extrapolated.
+    """
+    rng = np.random.default_rng(PARAMS_SEED)
+    side = math.ceil(math.sqrt(num_fovs))
+    lattice = np.stack(np.meshgrid(np.arange(side), np.arange(side)), axis=-1).reshape(-1, 2)
+    fovs = lattice[:num_fovs] * 300.0 + rng.normal(0, 2, (num_fovs, 2))
+    centers = rng.uniform(-150, side * 300 - 150, (num_centers, 2))
+    # spatial index on all centers, including the index build
+    start = time.perf_counter()
+    nearest = CoordinateIndex(fovs).nearest(centers)
+    index_time = time.perf_counter() - start
+    # linear scan on a sample of centers, extrapolated to all centers
+    fov_list = fovs.tolist()
+    sample = centers[:reference_limit].tolist()
+    start = time.perf_counter()
+    reference = [find_closest_coordinate(fov_list, center) for center in sample]
+    scan_time = (time.perf_counter() - start) * num_centers / max(len(sample), 1)
+    if reference != nearest[:len(sample)].tolist():
+        print("Error: spatial index and linear scan disagree.")
+    print(f"spatial index: {index_time:10.2f} s")
+    print(f"linear scan:   {scan_time:10.2f} s (extrapolated from {len(sample)} centers)")
+    print(f"speedup:       {scan_time / max(index_time, 1e-9):10.1f} x")
+    return index_time, scan_time
+
+
+def benchmark_mask_prerender(size_px = 3000, area_px = 300, max_workers = 4):
+    """
+    ### Compare per-area latency of `update_mask` with on-demand and pre-rendered temp masks.
+
+    `size_px` : width/height of the synthetic cleave map. Default = `3000`.
+    `area_px` : width/height of one cleave area. Default = `300` (366 px masks).
+    `max_workers` : number of processes of the `MaskPrerenderer`. Default = `4`.
+    """
+    regions = submask_grid(size_px, area_px)
+    with tempfile.TemporaryDirectory() as folder:
+        # synthetic experiment folder with one round
+        os.makedirs(os.path.join(folder, PARAMS_MAP))
+        synthetic_palette_mask(size_px).save(os.path.join(folder, PARAMS_MAP, "Round 0.png"))
+        centers = [[(w + e) / 2, (n + s) / 2, 0.0, w, n, e, s] for w, n, e, s in regions]
+        pd.DataFrame(centers, columns=['x','y','z','w','n','e','s']).to_csv(
+            os.path.join(folder, PARAMS_MAP, "Round 0.csv"), index=True)
+        img_folder = os.path.join(folder, "image_laser")
+        elapsed = {}
+        outputs = {}
+        for name in ("on demand", "pre-rendered"):
+            if name == "pre-rendered":
+                start = time.perf_counter()
+                prerenderer = MaskPrerenderer(folder, max_workers=max_workers)
+                prerenderer(0, len(centers))
+                prerenderer.close()
+                elapsed["pre-rendering"] = time.perf_counter() - start
+            outputs[name] = []
+            start = time.perf_counter()
+            for area in range(len(centers)):
+                with contextlib.redirect_stdout(None):
+                    update_mask(img_folder, 0, area)
+                with open(os.path.join(folder, PARAMS_TMP), 'rb') as file:
+                    outputs[name].append(file.read())
+            elapsed[name] = (time.perf_counter() - start) / max(len(centers), 1)
+        identical = outputs["on demand"] == outputs["pre-rendered"]
+    print(f"on demand:     {elapsed['on demand'] * 1000:10.2f} ms per area")
+    print(f"pre-rendered:  {elapsed['pre-rendered'] * 1000:10.2f} ms per area "
+          f"(pre-rendering {elapsed['pre-rendering']:.2f} s, {max_workers} processes)")
+    print(f"byte-identical: {identical}")
+    return elapsed, identical
+
+
+def benchmark_mask_sinks(num_masks = 200, name = "mercury_benchmark_mask"):
+    """
+    ### Compare handover latency of the PNG file and shared memory temp mask sinks.
+
+    `num_masks` : number of synthetic [1024, 1024] temp masks. Default = `200`.
+    `name` : name of the shared memory segment used for the benchmark.
+
+    Latency is measured from publishing a mask to the reader holding its pixels (PNG: save, open
+    and decode the file, shared memory: write, then copy and verify the segment).
+    """
+    rng = np.random.default_rng(PARAMS_SEED)
+    masks = [Image.fromarray(((rng.random((32, 32)) < 0.3) * 255).astype(np.uint8)).resize(
+        (1024, 1024), Image.Resampling.NEAREST) for _ in range(num_masks)]
+    elapsed = {}
+    identical = True
+    with tempfile.TemporaryDirectory() as folder:
+        sink = PngMaskSink(folder)
+        start = time.perf_counter()
+        for area, mask in enumerate(masks):
+            sink(0, area, mask)
+            with Image.open(os.path.join(folder, PARAMS_TMP)) as img:
+                pixels = np.asarray(img)
+            identical = identical and np.array_equal(pixels, np.asarray(mask))
+        elapsed["png"] = (time.perf_counter() - start) / num_masks
+    sink = SharedMaskSink(name)
+    sequence = None
+    start = time.perf_counter()
+    for area, mask in enumerate(masks):
+        sink(0, area, mask)
+        sequence, _num_round, _area, pixels = read_shared_mask(name, sequence)
+        identical = identical and np.array_equal(pixels, np.asarray(mask))
+    elapsed["shared_memory"] = (time.perf_counter() - start) / num_masks
+    sink.close()
+    print(f"png file:       {elapsed['png'] * 1000:10.2f} ms per mask")
+    print(f"shared memory:  {elapsed['shared_memory'] * 1000:10.2f} ms per mask")
+    print(f"identical:      {identical}")
+    return elapsed, identical
+
+
+def benchmark_worker_calls(num_calls = 50, port = 50504):
+    """
+    ### Compare a fresh interpreter per call with calls to a warm `mercury_worker`.
+
+    `num_calls` : number of timed worker calls. Default = `50`.
+    `port` : port of the benchmark worker (not the default one, a running worker is untouched).
+    """
+    # former behavior: every call starts python and imports mercury_03 (and its dependencies)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import mercury_03"], check=True,
+                   cwd=os.path.dirname(os.path.realpath(__file__)))
+    cold_time = time.perf_counter() - start
+    # warm worker: started once, then every call is one request on an open connection
+    client = WorkerClient(port=port)
+    start = time.perf_counter()
+    client("ping")
+    startup_time = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        for k in range(num_calls):
+            client("record_laser_coord", folder, [k, k, 0.0], 0, 1)
+        call_time = (time.perf_counter() - start) / num_calls
+        client("finish_round", folder, 0)
+        recorded = len(pd.read_csv(os.path.join(folder, "Round 0 (recorded).csv")))
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        client("ping")
+    ping_time = (time.perf_counter() - start) / num_calls
+    client("shutdown")
+    client.close()
+    print(f"fresh interpreter: {cold_time * 1000:10.1f} ms per call (start and imports only)")
+    print(f"worker startup:    {startup_time * 1000:10.1f} ms (once)")
+    print(f"worker round trip: {ping_time * 1000:10.2f} ms per call")
+    print(f"record_laser_coord:{call_time * 1000:10.2f} ms per call ({recorded} rows recorded)")
+    return cold_time, startup_time, ping_time, call_time
+
+
+def benchmark_import_time(modules = ("mercury_core", "mercury_03"), repeats = 3):
+    """
+    ### Compare cold import time of the laser mask functions (`python -X importtime`).
+
+    `modules` : modules imported in a fresh interpreter. Default = `mercury_core` and `mercury_03`.
+    `repeats` : fresh interpreters per module, the fastest one is reported. Default = `3`.
+    """
+    heavy = ("pandas", "yaml", "matplotlib", "customtkinter", "scipy")
+    results = {}
+    for module in modules:
+        cumulative = []
+        for _ in range(repeats):
+            run = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c",
+                 f"import sys, {module}; print(','.join(m for m in {heavy} if m in sys.modules))"],
+                check=True, capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.realpath(__file__)))
+            # last importtime line is the module itself: "import time: self | cumulative | name"
+            lines = [line for line in run.stderr.splitlines() if line.startswith("import time:")]
+            cumulative.append(int(lines[-1].split("|")[1]) / 1e6)
+        results[module] = (min(cumulative), run.stdout.strip())
+    for module, (seconds, loaded) in results.items():
+        print(f"{module + ':':18}{seconds * 1000:10.1f} ms (heavy imports: {loaded or 'none'})")
+    return results
+
+
+def benchmark_coordinate_log(num_rows = 2000):
+    """
+    ### Compare per-row cost of rewriting a coordinate csv (former behavior) and of a journal.
+
+    `num_rows` : number of recorded coordinates. Default = `2000`.
+    """
+    rng = np.random.default_rng(PARAMS_SEED)
+    rows = [[*rng.normal(0, 3000, 3).tolist(), int(k % 2)] for k in range(num_rows)]
+    with tempfile.TemporaryDirectory() as folder:
+        # former behavior: read the whole csv, concat one row, rewrite the whole csv
+        file_before = os.path.join(folder, "Round 0 (recorded).csv")
+        start = time.perf_counter()
+        for row in rows:
+            df = pd.DataFrame([row], columns=list(PARAMS_RCD))
+            if os.path.exists(file_before):
+                df = pd.concat([pd.read_csv(file_before, usecols=[1,2,3,4]), df],
+                               ignore_index=True)
+            df.to_csv(file_before, index=True)
+        time_before = (time.perf_counter() - start) / num_rows
+        # append to the journal (written into the csv every PARAMS_JCR rows), compact the rest
+        file_after = os.path.join(folder, "Round 1 (recorded).csv")
+        start = time.perf_counter()
+        journal = coordinate_journal(file_after, PARAMS_RCD)
+        for row in rows:
+            journal(*row)
+        time_after = (time.perf_counter() - start) / num_rows
+        start = time.perf_counter()
+        compact_journal(file_after, PARAMS_RCD)
+        time_compact = time.perf_counter() - start
+        recorded = pd.read_csv(file_after, usecols=[1,2,3,4], float_precision="round_trip")
+        exact = recorded.values.tolist() == rows
+    print(f"rewrite csv:    {time_before * 1000:10.3f} ms per row")
+    print(f"journal:        {time_after * 1000:10.3f} ms per row (compaction {time_compact:.2f} s)")
+    print(f"exact values:   {exact}")
+    return time_before, time_after, time_compact, exact
+
+
+def benchmark_experiment_db(num_submasks = 5000, num_rounds = 15, num_lookups = 50):
+    """
+    ### Compare repeated lookups by parsing csv files (former behavior) and by database queries.
+
+    `num_submasks` : number of submasks (and of cleave centers per round). Default = `5000`.
+    `num_rounds` : number of rounds (bits). Default = `15`.
+    `num_lookups` : lookups of round centers and active submasks near a point. Default = `50`.
+    """
+    rng = np.random.default_rng(PARAMS_SEED)
+    columns = ['x','y','z','w','n','e','s']
+    with tempfile.TemporaryDirectory() as folder:
+        os.makedirs(os.path.join(folder, PARAMS_MAP))
+        xy = rng.uniform(0, 20000, (num_submasks, 2))
+        bits = rng.integers(0, 2, (num_submasks, num_rounds))
+        centers = [[x, y, 0.0, x - 15, y - 15, x + 15, y + 15] for x, y in xy.tolist()]
+        pd.DataFrame(centers, columns=columns).to_csv(
+            os.path.join(folder, "coord_scan_center.csv"), index=True)
+        pd.DataFrame(
+            [[*c[0:2], *c[3:7], str([0] * num_rounds), str(b)]
+             for c, b in zip(centers, bits.tolist())],
+            columns=['x','y','w','n','e','s','index','bit']
+        ).to_csv(os.path.join(folder, "config_bit_scheme.csv"), index=True)
+        for i in range(num_rounds):
+            pd.DataFrame(centers, columns=columns).to_csv(
+                os.path.join(folder, PARAMS_MAP, f"Round {i}.csv"), index=True)
+        points = rng.uniform(0, 20000, (num_lookups, 2)).tolist()
+        # former behavior: parse the csv files for every lookup
+        start = time.perf_counter()
+        found_before = []
+        for k, (x, y) in enumerate(points):
+            i = k % num_rounds
+            df = pd.read_csv(os.path.join(folder, PARAMS_MAP, f"Round {i}.csv"),
+                             keep_default_na = False, usecols=[1,2,4,5,6,7]).values.tolist()
+            sub = pd.read_csv(os.path.join(folder, "config_bit_scheme.csv"),
+                              keep_default_na = False).values.tolist()
+            found_before.append((len(df), [
+                row[0] for row in sub if int(row[8][1:-1].split(', ')[i])
+                and (row[1] - x) ** 2 + (row[2] - y) ** 2 <= 300 ** 2]))
+        time_before = (time.perf_counter() - start) / num_lookups
+        # import once, then query
+        start = time.perf_counter()
+        database = ExperimentDatabase(folder)
+        database.sync()
+        time_sync = time.perf_counter() - start
+        start = time.perf_counter()
+        found_after = []
+        for k, (x, y) in enumerate(points):
+            i = k % num_rounds
+            database.sync()
+            found_after.append((len(database.round_centers(i, ('x','y','w','n','e','s'))), [
+                row[0] for row in database.active_submasks(i, x, y, 300)]))
+        time_after = (time.perf_counter() - start) / num_lookups
+        database.close()
+    print(f"parse csv:      {time_before * 1000:10.3f} ms per lookup")
+    print(f"database:       {time_after * 1000:10.3f} ms per lookup (import {time_sync:.2f} s)")
+    print(f"same results:   {found_before == found_after}")
+    return time_before, time_after, time_sync, found_before == found_after
+
+
+# ========================================= main function =========================================
+
+PARAMS_BMK = {
+    "submask_scan": benchmark_submask_scan,
+    "cleave_map_writers": benchmark_cleave_map_writers,
+    "laser_stitching": benchmark_laser_stitching,
+    "nearest_fov": benchmark_nearest_fov,
+    "mask_prerender": benchmark_mask_prerender,
+    "mask_sinks": benchmark_mask_sinks,
+    "worker_calls": benchmark_worker_calls,
+    "import_time": benchmark_import_time,
+    "coordinate_log": benchmark_coordinate_log,
+    "experiment_db": benchmark_experiment_db,
+}
+
+
+def mercury_benchmark(names = None):
+    """
+    Function: run the named benchmarks (all benchmarks if none are given).
+    """
+    for name in (names or list(PARAMS_BMK)):
+        print(f"========== {name} ==========")
+        PARAMS_BMK[name]()
+
+if __name__ == "__main__":
+    mercury_benchmark(sys.argv[1:])
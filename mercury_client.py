@@ -0,0 +1,240 @@
+"""
+Mercury Client: LabVIEW entry points of the warm worker, project version 1.24 (with python 3.9).
+
+Drop-in replacements of `mercury_core.update_mask`, `mercury_core.record_laser_coord`,
+`mercury_core.finish_round`, `mercury_03_copy.update_mask` and `ShearValve_Module.set_shear_valve`
+with identical signatures.
+Only the standard library is imported here, every call is forwarded to a warm `mercury_worker`
+process (started on first use if it is not running). If no worker can be reached, the function
+is imported and called in this process instead. A request that was sent but not answered is never
+sent again (it may have run, e.g. recorded a row), `WorkerNoReply` is raised instead.
+"""
+
+import os
+import sys
+import json
+import time
+import select
+import socket
+import tempfile
+import subprocess
+import importlib
+
+from mercury_worker import PARAMS_HST, PARAMS_PRT, PARAMS_MOD, raise_remote_error
+
+PARAMS_WST = 30  # seconds to wait for a newly started worker
+PARAMS_WTO = 60  # seconds to wait for the reply of a call
+PARAMS_PYX = None  # python interpreter of the worker, none = the python of this process
+PARAMS_WLG = os.path.join(tempfile.gettempdir(), "mercury_worker.log")
+
+
+# ======================================== client classes =========================================
+
+class WorkerUnavailable(ConnectionError):
+    """
+    Class: no worker could be reached (errors of the called functions are raised as they are).
+    """
+
+
+class WorkerNoReply(ConnectionError):
+    """
+    Class: a request was sent but the worker did not answer, it may have run (not sent again).
+    """
+
+
+class WorkerClient:
+    """
+    Class: connection to a `mercury_worker`, kept open across calls.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, host = PARAMS_HST, port = PARAMS_PRT, start_worker = True):
+        self.address = (host, port)
+        self.start_worker = start_worker
+        self.connection = None
+        self.stream = None
+        self.request_id = 0
+        # a worker is started once per client, calls after a failed start fall back right away
+        self.launch_failed = False
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __call__(self, method, *params):
+        """
+        Function: call a worker method, return its result or raise its error.
+        raise WorkerUnavailable if no worker can be reached (the request was not sent), and
+        WorkerNoReply if the request was sent but not answered in `PARAMS_WTO` seconds.
+        """
+        self.request_id += 1
+        request = json.dumps({
+            "jsonrpc": "2.0", "id": self.request_id, "method": method, "params": list(params)})
+        # send again on a new connection only if the request could not be sent
+        for attempt in range(2):
+            try:
+                stream = self.connect()
+                stream.write(request.encode() + b"\n")
+                stream.flush()
+                break
+            except WorkerUnavailable:
+                self.close()
+                raise
+            except OSError as e:
+                self.close()
+                if attempt:
+                    raise WorkerUnavailable(str(e)) from e
+        try:
+            line = stream.readline()
+        except OSError as e:
+            self.close()
+            raise WorkerNoReply(f"no reply to {method}: {e}.") from e
+        if not line:
+            self.close()
+            raise WorkerNoReply(f"no reply to {method}: worker closed the connection.")
+        response = json.loads(line)
+        if "error" in response:
+            raise_remote_error(response["error"])
+        return response["result"]
+    # ---------------------------------------------------------------------------------------------
+    def connect(self):
+        """
+        Function: return the open connection stream, connect (and start the worker) if needed.
+        """
+        if self.stream is not None:
+            # the worker sends nothing between calls, a readable connection was closed by it
+            if not select.select([self.connection], [], [], 0)[0]:
+                return self.stream
+            self.close()
+        try:
+            connection = socket.create_connection(self.address)
+        except ConnectionRefusedError:
+            if not self.start_worker or self.launch_failed:
+                raise
+            connection = self.launch()
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection.settimeout(PARAMS_WTO)
+        self.connection = connection
+        self.stream = connection.makefile('rwb')
+        return self.stream
+    # ---------------------------------------------------------------------------------------------
+    def launch(self):
+        """
+        Function: start a worker process in the background, return a connection once it serves.
+        raise WorkerUnavailable if the worker cannot be started or does not serve in time.
+        """
+        worker = os.path.join(os.path.dirname(os.path.realpath(__file__)), "mercury_worker.py")
+        try:
+            with open(PARAMS_WLG, 'ab') as log:
+                subprocess.Popen(
+                    [worker_interpreter(), worker,
+                     "--host", self.address[0], "--port", str(self.address[1])],
+                    stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                    creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+        except OSError as e:
+            self.launch_failed = True
+            raise WorkerUnavailable(f"unable to start the worker: {e}") from e
+        deadline = time.perf_counter() + PARAMS_WST
+        while True:
+            try:
+                return socket.create_connection(self.address)
+            except ConnectionRefusedError as e:
+                if time.perf_counter() > deadline:
+                    self.launch_failed = True
+                    raise WorkerUnavailable(
+                        f"worker did not start in {PARAMS_WST} s, see {PARAMS_WLG}.") from e
+                time.sleep(0.1)
+    # ---------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Function: close the connection, the worker keeps running.
+        """
+        if self.stream is not None:
+            self.stream.close()
+            self.connection.close()
+            self.stream = None
+            self.connection = None
+
+
+CLIENT = WorkerClient()
+
+
+# ===================================== independent functions =====================================
+
+def worker_interpreter():
+    """
+    Function: return the python interpreter the worker is started with. In an embedded python
+    (e.g. the LabVIEW Python node) `sys.executable` is the host program, the interpreter is then
+    looked up in `sys.exec_prefix`. Set `PARAMS_PYX` if it is installed elsewhere.
+    """
+    if PARAMS_PYX is not None:
+        return PARAMS_PYX
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    if os.name == "nt":
+        candidates = [os.path.join(sys.exec_prefix, "python.exe"),
+                      os.path.join(sys.exec_prefix, "Scripts", "python.exe")]
+    else:
+        candidates = [os.path.join(sys.exec_prefix, "bin", f"python{version}")
+                      for version in (f"{sys.version_info[0]}.{sys.version_info[1]}", "3", "")]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    raise FileNotFoundError(f"no python interpreter found in {sys.exec_prefix}, set PARAMS_PYX.")
+
+
+def call_worker(method, *params):
+    """
+    Function: call a method of the worker, or import and call it here if no worker is reachable.
+    """
+    try:
+        return CLIENT(method, *params)
+    except WorkerUnavailable as e:
+        print(f"Warning: mercury worker not reachable ({e}), calling {method} in this process.")
+        module_name, function_name = PARAMS_MOD[method]
+        return getattr(importlib.import_module(module_name), function_name)(*params)
+
+
+def update_mask(img_folder, num_round, area):
+    """
+    Function: update and stretch temp cleave mask based on round/area number (mercury_core).
+    """
+    return call_worker("update_mask", img_folder, num_round, area)
+
+
+def update_mask_732(img_folder, num_round, area):
+    """
+    Function: update and stretch temp cleave mask based on round/area number (mercury_03_copy).
+    """
+    return call_worker("update_mask_732", img_folder, num_round, area)
+
+
+def record_laser_coord(laser_img_folder_path, coords, num_round, execute_status):
+    """
+    Function: create/append (laser imaging) coordinates into a given csv file (mercury_core).
+    """
+    return call_worker(
+        "record_laser_coord", laser_img_folder_path, coords, num_round, execute_status)
+
+
+def finish_round(laser_img_folder_path, num_round):
+    """
+    Function: write the recorded coordinates of a round into its csv (mercury_core).
+    """
+    return call_worker("finish_round", laser_img_folder_path, num_round)
+
+
+def set_shear_valve(position, com_port='COM7', move_direction="CW"):
+    """
+    Function: move shear valve to a given position, return once the move is finished.
+    """
+    return call_worker("set_shear_valve", position, com_port, move_direction)
+
+
+def stop_worker():
+    """
+    Function: shut the worker down (e.g. at the end of an experiment).
+    """
+    CLIENT.start_worker = False
+    try:
+        return CLIENT("shutdown")
+    except WorkerUnavailable:
+        return False
+    finally:
+        CLIENT.close()
+        CLIENT.start_worker = True
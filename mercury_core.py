@@ -0,0 +1,1207 @@
+"""
+Mercury Core: laser mask functions without GUI imports, project version 1.24 (with python 3.9).
+
+The functions called for every laser area (`update_mask`, `record_laser_coord`) and the temp mask
+pre-rendering, split from mercury_03.py so that importing them only loads numpy and PIL. pandas
+and yaml are imported on first use, and not at all when a round has pre-rendered temp masks.
+Cleave maps are decoded by `GlobalMask` (with the PNG functions it needs, also used by mercury_02),
+so mercury_02 (matplotlib, customtkinter) is never imported. mercury_03.py re-exports everything
+for the GUI.
+"""
+
+import io
+import os
+import csv
+import time
+import atexit
+import threading
+import zlib
+import struct
+from functools import lru_cache
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+PARAMS_MAP = "image_cleave_map"
+PARAMS_TMP = "image_mask_tmp.png"
+PARAMS_MKB = " (masks).npz"  # suffix of the pre-rendered temp masks of a round, see MaskPrerenderer
+PARAMS_PRW = 0  # processes pre-rendering temp masks, 0 = render in this process
+PARAMS_SNK = "png"  # temp mask sink, see mask_sink
+PARAMS_SNS = ["png", "shared_memory", "shared_memory+png"]
+PARAMS_SHM = "mercury_laser_mask"  # name of the shared memory segment of the temp mask
+PARAMS_SHH = "<4sIIIIII"  # segment header: magic, sequence, round, area, width, height, crc32
+PARAMS_SHO = 64  # bytes reserved for the segment header, pixels start at this offset
+PARAMS_RCC = 2  # rounds kept in memory by update_mask (coordinates and decoded cleave map)
+PARAMS_RES = 366  # laser FOV (um), cleave areas are centered on a canvas of this size
+PARAMS_STR = 2304  # px the canvas is stretched to before the mask calibration is applied
+PARAMS_LMS = 1024  # px of the temp (laser) mask
+PARAMS_JNL = " (journal).csv"  # suffix of the append-only journal of a coordinate csv
+PARAMS_FSY = False  # fsync coordinate journals after every row (survives power loss, slower)
+PARAMS_JCR = 100  # rows appended to a journal before it is written into its csv, 0 = no limit
+PARAMS_JCI = 2.0  # seconds without a new row before a journal is written into its csv, 0 = never
+PARAMS_RCD = ("x", "y", "z", "exec")  # columns of Round N (recorded).csv
+PARAMS_CRC = ("x", "y", "z")  # columns of coord_recorded.csv
+PARAMS_NUM = ("x", "y", "z")  # journal columns that must be numbers, others are kept as recorded
+PARAMS_BAD = ".bad"  # suffix a journal with rejected rows is renamed to, instead of removed
+PARAMS_PNG = 65536  # bytes of compressed pixels per IDAT chunk of streamed PNG files
+
+
+# ======================================== compute classes ========================================
+
+class MaskPrerenderer:
+    """
+    Class: render the temp masks of all areas of a round ahead of time, in this process or in a
+    process pool (`max_workers` > 0, rendered in this process if the pool cannot start).
+
+    Every round is saved as one bundle next to its cleave map (`Round N (masks).npz`), holding the
+    PNG bytes of every area, the cleave center coordinates and the canvas size, mask preset and
+    file stamps the masks were rendered with. `update_mask` hands over the masks of an up-to-date
+    bundle as they are, see `mask_bundle`.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, exp_folder, pixel_per_micron = 1, max_workers = PARAMS_PRW):
+        self.exp_folder = exp_folder
+        self.pixel_per_micron = pixel_per_micron
+        self.executor = ProcessPoolExecutor(max_workers) if max_workers > 0 else None
+        self.num_chunks = max(max_workers, 1)
+        self.pending = {}
+        self.timings = {}
+        self.start = time.perf_counter()
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __call__(self, num_round, num_areas):
+        """
+        Function: queue the temp masks of a round, once its cleave center coordinates are saved.
+        """
+        stamps = round_stamps(self.exp_folder, num_round)
+        parts = None
+        if self.executor is not None:
+            # split the areas of the round evenly between the workers
+            chunks = np.array_split(np.arange(num_areas), self.num_chunks)
+            try:
+                parts = [self.executor.submit(render_round_masks, self.exp_folder, num_round,
+                                              chunk.tolist(), self.pixel_per_micron)
+                         for chunk in chunks if len(chunk) > 0]
+            except (OSError, RuntimeError) as e:
+                self.stop_pool(e)
+        if parts is None:
+            parts = self.render(num_round, num_areas)
+        self.pending[num_round] = (stamps, num_areas, parts)
+    # ---------------------------------------------------------------------------------------------
+    def collect(self, num_round):
+        """
+        Function: wait for the temp masks of one queued round, save them as the round's bundle.
+        """
+        stamps, num_areas, parts = self.pending.pop(num_round)
+        try:
+            parts = [part.result() if isinstance(part, Future) else part for part in parts]
+        except (OSError, BrokenProcessPool) as e:
+            self.stop_pool(e)
+            parts = self.render(num_round, num_areas)
+        masks = [mask for part in parts for mask in part]
+        file_path = mask_bundle_path(self.exp_folder, num_round)
+        np.savez(
+            file_path,
+            key = mask_key(self.pixel_per_micron),
+            stamps = np.array(stamps, dtype=np.int64),
+            centers = np.asarray(read_center_coords(self.exp_folder, num_round)),
+            **{f"area_{area}": np.frombuffer(mask, dtype=np.uint8)
+               for area, mask in enumerate(masks)}
+        )
+        self.timings[num_round] = (len(masks), os.path.getsize(file_path))
+    # ---------------------------------------------------------------------------------------------
+    def render(self, num_round, num_areas):
+        """
+        Function: render the temp masks of a round in this process, return them as one part.
+        """
+        return [render_round_masks(
+            self.exp_folder, num_round, range(num_areas), self.pixel_per_micron)]
+    # ---------------------------------------------------------------------------------------------
+    def stop_pool(self, error):
+        """
+        Function: shut down a pool that failed, the remaining rounds are rendered in this process.
+        """
+        print(f"Warning: temp mask pre-rendering pool failed ({error}), rendering in this process.")
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+    # ---------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Function: wait for all queued rounds, print bundle sizes and timings, shut down the pool.
+        """
+        for num_round in list(self.pending):
+            self.collect(num_round)
+        if self.executor is not None:
+            self.executor.shutdown()
+        elapsed = time.perf_counter() - self.start
+        num_masks = sum(count for count, _size in self.timings.values())
+        for num_round, (count, size) in sorted(self.timings.items()):
+            print(f"Round {num_round}: {count} temp masks pre-rendered ({size / 2**20:.1f} MB).")
+        print(f"Pre-rendered {num_masks} temp masks in {elapsed:.2f} s "
+              f"({elapsed / max(num_masks, 1) * 1000:.1f} ms per area).")
+
+
+class PngMaskSink:
+    """
+    Class: temp mask sink writing `image_mask_tmp.png`, read back by the control software.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, exp_folder):
+        self.file_path = os.path.join(exp_folder, PARAMS_TMP)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __call__(self, num_round, area, mask):
+        """
+        Function: save a temp mask, given as PIL image or as PNG bytes (pre-rendered).
+        """
+        if isinstance(mask, bytes):
+            with open(self.file_path, 'wb') as file:
+                file.write(mask)
+        else:
+            mask.save(self.file_path, format='PNG')
+    # ---------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Function: nothing to release, the temp mask stays on disk.
+        """
+
+
+class SharedMaskSink:
+    """
+    Class: temp mask sink publishing the 8-bit pixels into a named shared memory segment.
+
+    The segment starts with a `PARAMS_SHH` header (magic, sequence, round, area, width, height,
+    crc32 of the pixels) followed by the pixels at `PARAMS_SHO`. The sequence is odd while a mask
+    is being written and even once it is complete, see `read_shared_mask` for the reader side.
+    `png_sink` also saves every mask as PNG, for control software still reading the file.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, name = PARAMS_SHM, size = (PARAMS_LMS, PARAMS_LMS), png_sink = None):
+        self.size = size
+        self.png_sink = png_sink
+        num_bytes = PARAMS_SHO + size[0] * size[1]
+        try:
+            self.segment = shared_memory.SharedMemory(name=name, create=True, size=num_bytes)
+            self.segment.buf[:PARAMS_SHO] = bytes(PARAMS_SHO)
+        except FileExistsError:
+            # attach to the segment left by a previous sink of the same name
+            self.segment = shared_memory.SharedMemory(name=name)
+            if self.segment.size < num_bytes:
+                self.segment.close()
+                raise ValueError(f"shared memory segment {name} is smaller than a temp mask.")
+        self.pixels = np.ndarray(
+            (size[1], size[0]), dtype=np.uint8, buffer=self.segment.buf, offset=PARAMS_SHO)
+        self.sequence = struct.unpack_from(PARAMS_SHH, self.segment.buf)[1] & ~1
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __call__(self, num_round, area, mask):
+        """
+        Function: publish a temp mask, given as PIL image or as PNG bytes (pre-rendered).
+        """
+        if self.png_sink is not None:
+            self.png_sink(num_round, area, mask)
+        if isinstance(mask, bytes):
+            mask = Image.open(io.BytesIO(mask))
+        pixels = np.asarray(mask)
+        if pixels.shape != self.pixels.shape:
+            raise ValueError(f"temp mask of {pixels.shape} px does not fit {self.pixels.shape}.")
+        # odd sequence while writing, readers retry until it is even again
+        self.write_header(self.sequence + 1, num_round, area, 0)
+        self.pixels[:] = pixels
+        self.sequence += 2
+        self.write_header(self.sequence, num_round, area, zlib.crc32(pixels))
+    # ---------------------------------------------------------------------------------------------
+    def write_header(self, sequence, num_round, area, checksum):
+        """
+        Function: write the segment header.
+        """
+        struct.pack_into(PARAMS_SHH, self.segment.buf, 0, b"MRCY", sequence & 0xffffffff,
+                         num_round, area, self.size[0], self.size[1], checksum)
+    # ---------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Function: detach from the segment, and remove it (the control software must be done).
+        """
+        del self.pixels
+        self.segment.close()
+        try:
+            self.segment.unlink()
+        except FileNotFoundError:
+            # already removed (e.g. by the control software)
+            pass
+
+
+class GlobalMask:
+    """
+    Class: palette mask stored as a 2d uint8 index array, in RAM or memory-mapped from a .npy file.
+
+    The stitched global mask of large experiments (e.g. 732 px masks, 2 pixels per um) does not
+    fit in a single PIL image, so it is written tile by tile into a memory map kept next to the
+    PNG as "<name> (pixels).npy", and read back in row bands. Like PIL palette images, it exposes
+    `size`, `getpalette()` and `np.asarray()`, so the pixel count functions accept both. When
+    pickled (e.g. to a process pool), a memory-mapped mask only sends its file name.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, pixels: np.ndarray, palette: list):
+        self.pixels = pixels
+        self.palette = list(palette)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ constructors ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def create(cls, size, color = (255,255,255), file_path = None):
+        """
+        Function: return a new mask filled with color, memory-mapped to file_path if given.
+        """
+        blank = Image.new('P', (1, 1), color = color)
+        width, height = size
+        if file_path is None:
+            pixels = np.full((height, width), blank.getpixel((0, 0)), dtype=np.uint8)
+        else:
+            pixels = np.lib.format.open_memmap(
+                file_path, mode='w+', dtype=np.uint8, shape=(height, width))
+            if blank.getpixel((0, 0)) != 0:
+                pixels[:] = blank.getpixel((0, 0))
+        return cls(pixels, blank.getpalette())
+    # ---------------------------------------------------------------------------------------------
+    @classmethod
+    def from_image(cls, img: Image.Image):
+        """
+        Function: wrap the pixels and palette of a PIL palette image.
+        """
+        return cls(np.asarray(img), img.getpalette())
+    # ---------------------------------------------------------------------------------------------
+    @classmethod
+    def open(cls, file_path, use_cache = True):
+        """
+        Function: open a mask PNG, memory-mapped from its .npy pixel cache if it is up to date.
+        """
+        cache_path = GlobalMask.pixels_path(file_path)
+        if (use_cache and os.path.exists(cache_path)
+                and os.path.getmtime(cache_path) >= os.path.getmtime(file_path)):
+            _size, palette = read_png_header(file_path)
+            return cls(np.load(cache_path, mmap_mode='r'), palette)
+        # masks without an up-to-date cache are decoded once by PIL, which may exceed its
+        # decompression bomb limit for large masks
+        max_image_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            with Image.open(file_path) as img:
+                mask = cls.from_image(img)
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_image_pixels
+        if use_cache:
+            np.save(cache_path, mask.pixels)
+            mask.pixels = np.load(cache_path, mmap_mode='r')
+        return mask
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    @staticmethod
+    def pixels_path(file_path):
+        """
+        Function: return the .npy pixel cache path stored next to a mask file.
+        """
+        return os.path.splitext(file_path)[0] + " (pixels).npy"
+    # ---------------------------------------------------------------------------------------------
+    @property
+    def size(self):
+        """
+        Function: return (width, height) of the mask, like PIL.Image.size.
+        """
+        return (self.pixels.shape[1], self.pixels.shape[0])
+    # ---------------------------------------------------------------------------------------------
+    def getpalette(self):
+        """
+        Function: return the palette as a flat RGB list, like PIL.Image.getpalette.
+        """
+        return list(self.palette)
+    # ---------------------------------------------------------------------------------------------
+    def __array__(self, dtype = None, copy = None):
+        if dtype is not None and dtype != self.pixels.dtype:
+            return self.pixels.astype(dtype)
+        return np.array(self.pixels) if copy else self.pixels
+    # ---------------------------------------------------------------------------------------------
+    def __getstate__(self):
+        return {"pixels": array_state(self.pixels), "palette": self.palette}
+    # ---------------------------------------------------------------------------------------------
+    def __setstate__(self, state):
+        self.pixels = array_from_state(state["pixels"])
+        self.palette = state["palette"]
+    # ---------------------------------------------------------------------------------------------
+    def paste(self, img: Image.Image, xy):
+        """
+        Function: paste the palette indices of an image at top-left (x, y), clipped like PIL.
+        """
+        tile = np.asarray(img)
+        x_px, y_px = xy
+        img_w, img_h = self.size
+        col_0, row_0 = max(x_px, 0), max(y_px, 0)
+        col_1 = min(x_px + tile.shape[1], img_w)
+        row_1 = min(y_px + tile.shape[0], img_h)
+        if col_1 > col_0 and row_1 > row_0:
+            self.pixels[row_0:row_1, col_0:col_1] = \
+                tile[row_0-y_px:row_1-y_px, col_0-x_px:col_1-x_px]
+    # ---------------------------------------------------------------------------------------------
+    def crop(self, box):
+        """
+        Function: return a [w, n, e, s] region as a PIL palette image, padded with index 0 like PIL.
+        """
+        west, north, east, south = (int(round(value)) for value in box)
+        region = np.zeros((max(south - north, 0), max(east - west, 0)), dtype=np.uint8)
+        img_w, img_h = self.size
+        col_0, row_0 = min(max(west, 0), img_w), min(max(north, 0), img_h)
+        col_1, row_1 = max(min(east, img_w), col_0), max(min(south, img_h), row_0)
+        region[row_0-north:row_1-north, col_0-west:col_1-west] = \
+            self.pixels[row_0:row_1, col_0:col_1]
+        img = Image.fromarray(region).convert('P')
+        img.putpalette(self.palette)
+        return img
+    # ---------------------------------------------------------------------------------------------
+    def bands(self, band_height = 1024):
+        """
+        Function: yield the mask pixels in row bands, top to bottom.
+        """
+        for north in range(0, self.size[1], band_height):
+            yield self.pixels[north:north+band_height]
+    # ---------------------------------------------------------------------------------------------
+    def to_image(self):
+        """
+        Function: return the mask as one PIL palette image (loads all pixels into RAM).
+        """
+        img = Image.fromarray(np.concatenate(list(self.bands()), axis=0)).convert('P')
+        img.putpalette(self.palette)
+        return img
+    # ---------------------------------------------------------------------------------------------
+    def save(self, file_path, format = 'PNG'):     # pylint: disable=redefined-builtin
+        """
+        Function: write the mask as a palette PNG band by band (see `write_palette_png`).
+        """
+        if format != 'PNG':
+            raise ValueError(f"unsupported mask format '{format}'")
+        write_palette_png(file_path, self.size, self.palette, self.bands())
+    # ---------------------------------------------------------------------------------------------
+    def flush(self):
+        """
+        Function: flush memory-mapped pixels to disk, marking the file newer than the saved PNG.
+        """
+        if isinstance(self.pixels, np.memmap) and self.pixels.filename is not None:
+            self.pixels.flush()
+            os.utime(self.pixels.filename)
+
+
+class CoordinateJournal:
+    """
+    Class: append-only journal of a coordinate csv, one row per call with the csv's columns.
+
+    Rows are appended to `<csv name> (journal).csv` next to the csv, so every call costs the same
+    and a crash can at most lose the row being written. The journal is written into the csv by
+    `compact_journal` once `max_rows` rows are appended, once no row was appended for `idle`
+    seconds, when the next round starts and when the journal is closed, so the csv stays current
+    without explicit calls. The first journal line holds the number of csv rows when the journal
+    was started, so an interrupted compaction is not applied twice.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, file_path, columns, fsync = PARAMS_FSY, max_rows = PARAMS_JCR,
+                 idle = PARAMS_JCI):
+        self.file_path = file_path
+        self.columns = tuple(columns)
+        self.fsync = fsync
+        self.max_rows = max_rows
+        self.idle = idle
+        self.journal_path = journal_path(file_path)
+        # the journal file is opened by the first row after every compaction
+        self.file = None
+        self.rows = 0
+        self.last = 0.0
+        self.watcher = None
+        self.lock = threading.RLock()
+        self.wakeup = threading.Condition(self.lock)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __call__(self, *values):
+        """
+        Function: append one row (one value per column).
+        """
+        if len(values) != len(self.columns):
+            raise ValueError(f"{len(values)} values given for columns {self.columns}.")
+        fields = [str(value) for value in values]
+        if any("\n" in field or "\r" in field for field in fields):
+            raise ValueError(f"{fields} has line breaks, a journal row must fit on one line.")
+        with self.lock:
+            if self.file is None:
+                self.open()
+            # quoted like pandas, so values with commas are kept as recorded
+            self.file.write(csv_line(fields))
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            self.rows += 1
+            self.last = time.monotonic()
+            if self.max_rows and self.rows >= self.max_rows:
+                self.compact()
+    # ---------------------------------------------------------------------------------------------
+    def open(self):
+        """
+        Function: open the journal file for appending, start it with a header if it is new.
+        """
+        complete = journal_complete(self.journal_path)
+        # line buffered, every row reaches the OS when the call returns
+        self.file = open(self.journal_path, 'a', encoding="utf-8", newline='', buffering=1)
+        self.rows = 0
+        if complete is None:
+            self.file.write(f"#base,{count_csv_rows(self.file_path)}\n")
+        elif not complete:
+            # a row was cut short (the last writer stopped), start the next row on a new line
+            self.file.write("\n")
+        if self.idle:
+            self.watcher = threading.Thread(target=self.watch, daemon=True)
+            self.watcher.start()
+    # ---------------------------------------------------------------------------------------------
+    def watch(self):
+        """
+        Function: compact the journal once no row was appended for `idle` seconds (run by the
+        watcher thread started with the journal file, which ends when the file is closed).
+        """
+        with self.lock:
+            while self.file is not None and self.watcher is threading.current_thread():
+                remaining = self.last + self.idle - time.monotonic()
+                if remaining > 0:
+                    self.wakeup.wait(remaining)
+                    continue
+                try:
+                    self.compact()
+                except OSError as e:
+                    print(f"Warning: {e}, {self.journal_path} is written into the csv later.")
+    # ---------------------------------------------------------------------------------------------
+    def release(self):
+        """
+        Function: close the journal file (reopened by the next row) and end its watcher thread.
+        """
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                self.watcher = None
+                self.wakeup.notify_all()
+    # ---------------------------------------------------------------------------------------------
+    def compact(self):
+        """
+        Function: write the rows of the journal into the csv, return the number of rows written.
+        """
+        with self.lock:
+            self.release()
+            return write_journal(self.file_path, self.columns)
+    # ---------------------------------------------------------------------------------------------
+    def close(self, compact = True):
+        """
+        Function: close the journal, and write its rows into the csv if `compact`.
+        """
+        if compact:
+            self.compact()
+        else:
+            self.release()
+
+
+# ===================================== independent functions =====================================
+
+def array_state(array: np.ndarray):
+    """
+    Function: return a picklable state of an array, only the file name for a .npy memory map.
+    """
+    if isinstance(array, np.memmap) and array.filename is not None:
+        return ("npy", array.filename)
+    return ("array", np.asarray(array))
+
+
+def array_from_state(state):
+    """
+    Function: return the array of a state made by `array_state`.
+    """
+    kind, value = state
+    if kind == "npy":
+        return np.load(value, mmap_mode='r')
+    return value
+
+
+def write_png_chunk(file, chunk_type: bytes, data: bytes):
+    """
+    Function: write one PNG chunk (length, type, data, crc).
+    """
+    file.write(struct.pack('>I', len(data)))
+    file.write(chunk_type)
+    file.write(data)
+    file.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def pack_png_rows(band: np.ndarray, bits: int):
+    """
+    Function: pack rows of palette indices to a PNG bit depth, the same way PIL does.
+    """
+    if bits == 8:
+        return band
+    if bits == 1:
+        return np.packbits(band != 0, axis=1)
+    # 2 and 4 bit depths keep the lowest bits of every index
+    per_byte = 8 // bits
+    rows, cols = band.shape
+    padded = np.zeros((rows, -(-cols // per_byte) * per_byte), dtype=np.uint8)
+    padded[:, :cols] = band & ((1 << bits) - 1)
+    padded = padded.reshape(rows, -1, per_byte)
+    packed = np.zeros(padded.shape[:2], dtype=np.uint8)
+    for k in range(per_byte):
+        packed |= padded[:, :, k] << (bits * (per_byte - 1 - k))
+    return packed
+
+
+def write_palette_png(file_path, size, palette: list, bands, compress_level = 6):
+    """
+    ### Write a palette PNG from row bands of indices, without building the full image.
+
+    `file_path` : path of the PNG file.
+    `size` : (width, height) of the image.
+    `palette` : flat RGB palette list, its length sets the bit depth like PIL does.
+    `bands` : iterable of uint8 arrays (rows x width) of palette indices, top to bottom.
+    -----------------------------------------------------------------------------------------------
+    #### Optional:
+    `compress_level` : zlib compression level. Default = `6` (same as PIL).
+
+    Rows are not filtered, so files differ from PIL's byte by byte but decode to the same pixels.
+    """
+    width, height = size
+    colors = max(min(len(palette) // 3, 256), 1)
+    bits = 1 if colors <= 2 else 2 if colors <= 4 else 4 if colors <= 16 else 8
+    palette_bytes = bytes(palette[:colors*3]).ljust(colors*3, b'\0')
+    compressor = zlib.compressobj(compress_level)
+    with open(file_path, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        write_png_chunk(file, b'IHDR', struct.pack('>IIBBBBB', width, height, bits, 3, 0, 0, 0))
+        write_png_chunk(file, b'PLTE', palette_bytes)
+        pending = b''
+        for band in bands:
+            packed = pack_png_rows(np.asarray(band, dtype=np.uint8), bits)
+            # every row starts with filter type 0 (none)
+            rows = np.zeros((packed.shape[0], packed.shape[1] + 1), dtype=np.uint8)
+            rows[:, 1:] = packed
+            pending += compressor.compress(rows.tobytes())
+            if len(pending) >= PARAMS_PNG:
+                write_png_chunk(file, b'IDAT', pending)
+                pending = b''
+        pending += compressor.flush()
+        write_png_chunk(file, b'IDAT', pending)
+        write_png_chunk(file, b'IEND', b'')
+
+
+def read_png_header(file_path):
+    """
+    Function: return ((width, height), palette) of a PNG file, without decoding its pixels.
+    """
+    size, palette = None, []
+    with open(file_path, 'rb') as file:
+        if file.read(8) != b'\x89PNG\r\n\x1a\n':
+            raise ValueError(f"{file_path} is not a PNG file")
+        while True:
+            length, chunk_type = struct.unpack('>I4s', file.read(8))
+            if chunk_type in (b'IDAT', b'IEND'):
+                break
+            data = file.read(length)
+            file.read(4)
+            if chunk_type == b'IHDR':
+                size = struct.unpack('>II', data[:8])
+            elif chunk_type == b'PLTE':
+                palette = list(data)
+    return size, palette
+
+
+def load_mask_preset(file_path, scaling_factor):
+    """
+    Function: load preset from yaml/yml, adjust for scaling factor. Return false if failed.
+    """
+    import yaml  # pylint: disable=import-outside-toplevel
+    try:
+        with open(file_path, 'r+', encoding="utf-8") as file:
+            data = yaml.safe_load(file)
+            rotation = int(data['rotation'])
+            vertical = bool(data['flip_vertical'])
+            horizontal = bool(data['flip_horizontal'])
+            x = round(float(data['x'])*scaling_factor)
+            y = round(float(data['y'])*scaling_factor)
+            w = round(float(data['w'])*scaling_factor)
+            h = round(float(data['h'])*scaling_factor)
+    except (ValueError, TypeError, RuntimeError) as e:
+        print(f"Warning: unable to load preset at {file_path}: {e}")
+        return False
+    return (rotation, vertical, horizontal, x, y, w, h)
+    # # for older txt-based preset files
+    # try:
+    #     file = open(file_path, 'r+', encoding="utf-8").readlines()
+    #     rotation = int(file[0])
+    #     vertical = False if file[1] == "0\n" else True
+    #     horizontal = False if file[2] == "0\n" else True
+    #     x = round(int(file[3])*scaling_factor)
+    #     y = round(int(file[4])*scaling_factor)
+    #     w = round(int(file[5])*scaling_factor)
+    #     h = round(int(file[6])*scaling_factor)
+    # except (ValueError, TypeError, RuntimeError) as e:
+    #     print(f"Warning: unable to load preset at {file_path}: {e}")
+    #     return False
+    # return (rotation, vertical, horizontal, x, y, w, h)
+
+
+@lru_cache(maxsize=PARAMS_RCC)
+def load_round_context(exp_folder, num_round, stamps):
+    """
+    Function: read cleave center coordinates and decode the cleave map of a round.
+    `stamps` (file modification times) is only part of the cache key, see `round_context`.
+    """
+    center_coords = read_center_coords(exp_folder, num_round)
+    round_mask = GlobalMask.open(
+        os.path.join(exp_folder, PARAMS_MAP, f"Round {num_round}.png"), use_cache=False)
+    return (center_coords, round_mask)
+
+
+def round_context(exp_folder, num_round):
+    """
+    Function: return (cleave center coordinates, cleave map) of a round, kept in memory across
+    calls and only read again if one of the files changed.
+    """
+    return load_round_context(exp_folder, num_round, round_stamps(exp_folder, num_round))
+
+
+def read_center_coords(exp_folder, num_round):
+    """
+    Function: read the cleave center coordinates (x, y, z, w, n, e, s) of a round.
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+    return pd.read_csv(os.path.join(exp_folder, PARAMS_MAP, f"Round {num_round}.csv"),
+        keep_default_na = False, usecols=[1,2,3,4,5,6,7]).values.tolist()
+
+
+def round_stamps(exp_folder, num_round):
+    """
+    Function: return the modification times (ns) of the cleave center coordinates and cleave map
+    of a round.
+    """
+    return tuple(
+        os.stat(os.path.join(exp_folder, PARAMS_MAP, f"Round {num_round}.{ext}")).st_mtime_ns
+        for ext in ("csv", "png")
+    )
+
+
+@lru_cache(maxsize=4)
+def load_calibration(file_path, stamp, scaling_factor):
+    """
+    Function: load a mask preset, cached by file modification time (`stamp`).
+    """
+    return load_mask_preset(file_path, scaling_factor)
+
+
+@lru_cache(maxsize=8)
+def compile_mask_transform(region_size, canvas_px, preset):
+    """
+    ### Compile the temp mask geometry into one remap table, for a cleave area size and preset.
+
+    `region_size` : (width, height) of the cleave area.
+    `canvas_px` : laser FOV canvas the cleave area is centered on (366 px, 732 px for 732px masks).
+    `preset` : mask calibration (rotation, vertical, horizontal, x, y, w, h).
+
+    Return a [1024, 1024] table of cleave area pixel numbers (row-major, + 1), 0 for blank pixels.
+    The table is made by sending an image of pixel numbers through the same PIL operations as the
+    mask, so nearest neighbour sampling (the only one used for palette images) matches exactly.
+    """
+    width, height = region_size
+    rota, vert, hori, x, y, w, h = preset
+    numbers = np.arange(1, width * height + 1, dtype=np.int32).reshape(height, width)
+    numbers = Image.fromarray(numbers)
+    # first paste the cleave area to the center of an empty canvas
+    mod_mask = Image.new('I', [canvas_px, canvas_px], 0)
+    mod_mask.paste(numbers, (round((canvas_px - width) / 2), round((canvas_px - height) / 2)))
+    # create new mask with 2304x2304 px and 200 px margin
+    tmp_mask = Image.new('I', [PARAMS_STR+200, PARAMS_STR+200], 0)
+    # stretch the modified mask to [2304, 2304], paste it onto the temporary mask (100 px margin)
+    tmp_mask.paste(mod_mask.resize([PARAMS_STR, PARAMS_STR], Image.Resampling.NEAREST), (100,100))
+    # apply cropping, but from the perspective of bottom-right corner
+    mod_mask = tmp_mask.crop((
+        PARAMS_STR + 100 - h - y,
+        PARAMS_STR + 100 - w - x,
+        PARAMS_STR + 100 - y,
+        PARAMS_STR + 100 - x
+    ))
+    # rotate and flip based on mask calibration preset
+    mod_mask = mod_mask.rotate(rota+180)
+    if vert:
+        mod_mask = mod_mask.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+    if hori:
+        mod_mask = mod_mask.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    # resize laser area to [1024, 1024]
+    mod_mask = mod_mask.resize([PARAMS_LMS, PARAMS_LMS], Image.Resampling.NEAREST)
+    return np.asarray(mod_mask, dtype=np.int64)
+
+
+@lru_cache(maxsize=1)
+def mask_levels():
+    """
+    Function: return the inverted gray level of every palette index of a blank (white) 'P' mask,
+    the palette temp masks are converted with.
+    """
+    levels = Image.new('P', (256, 1), color = (255,255,255))
+    levels.putdata(range(256))
+    return 255 - np.asarray(levels.convert('L'), dtype=np.uint8)[0]
+
+
+def mask_preset():
+    """
+    Function: return the mask calibration preset of default_calibration.yaml.
+    """
+    calibration = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "default_calibration.yaml")
+    return tuple(load_calibration(calibration, os.stat(calibration).st_mtime_ns, 1))
+
+
+def mask_key(pixel_per_micron = 1):
+    """
+    Function: return the canvas size and mask preset temp masks are rendered with, as an array.
+    """
+    return np.array([PARAMS_RES * pixel_per_micron, *mask_preset()], dtype=np.float64)
+
+
+def render_mask(region, preset, pixel_per_micron = 1):
+    """
+    Function: return the temp mask (inverted gray levels) of a cleave area as a PIL image.
+    """
+    # center, stretch, calibrate (crop, rotate, flip) and resize the cleave area in one
+    # remap, compiled once per cleave area size and calibration preset
+    table = compile_mask_transform(
+        (region.shape[1], region.shape[0]), PARAMS_RES * pixel_per_micron, preset)
+    # pixel number 0 is blank, palette index 0 (white) like the canvases it was pasted on
+    indices = np.concatenate([np.zeros(1, dtype=np.uint8), region.reshape(-1)])[table]
+    return Image.fromarray(mask_levels()[indices])
+
+
+def encode_mask(img: Image.Image):
+    """
+    Function: return a temp mask encoded as PNG, the same bytes as saving it to a file.
+    """
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def render_round_masks(exp_folder, num_round, areas, pixel_per_micron = 1):
+    """
+    Function: return the PNG bytes of the temp masks of some areas of a round (also used by pool
+    workers, each worker decodes the cleave map once per round).
+    """
+    center_coords, round_mask = round_context(exp_folder, num_round)
+    preset = mask_preset()
+    return [
+        encode_mask(render_mask(
+            np.asarray(round_mask.crop(center_coords[area][3:7])), preset, pixel_per_micron))
+        for area in areas
+    ]
+
+
+def mask_bundle_path(exp_folder, num_round):
+    """
+    Function: return the path of the pre-rendered temp masks of a round.
+    """
+    return os.path.join(exp_folder, PARAMS_MAP, f"Round {num_round}{PARAMS_MKB}")
+
+
+@lru_cache(maxsize=PARAMS_RCC)
+def load_mask_bundle(file_path, stamp):
+    """
+    Function: open a bundle of pre-rendered temp masks, return (masks, center coordinates, file
+    stamps, key). Masks are only read from the file when accessed.
+    `stamp` (file modification time) is only part of the cache key, see `mask_bundle`.
+    """
+    masks = np.load(file_path)
+    return (masks, masks["centers"].tolist(), tuple(masks["stamps"].tolist()), masks["key"])
+
+
+def mask_bundle(exp_folder, num_round, pixel_per_micron = 1):
+    """
+    Function: return (masks, center coordinates) pre-rendered for a round, none if there is no
+    bundle or the cleave map, coordinates or mask preset changed since it was rendered.
+    """
+    file_path = mask_bundle_path(exp_folder, num_round)
+    try:
+        masks, center_coords, stamps, key = load_mask_bundle(
+            file_path, os.stat(file_path).st_mtime_ns)
+        if stamps != round_stamps(exp_folder, num_round):
+            return None
+    except FileNotFoundError:
+        return None
+    if not np.array_equal(key, mask_key(pixel_per_micron)):
+        return None
+    return (masks, center_coords)
+
+
+MASK_SINKS = {}
+
+
+def mask_sink(exp_folder, kind = PARAMS_SNK):
+    """
+    Function: return the temp mask sink of an experiment folder, kept open across update_mask
+    calls. One sink is open at a time, the previous one is closed when another folder or kind is
+    used (see `close_mask_sinks`).
+    """
+    sink = MASK_SINKS.get((exp_folder, kind))
+    if sink is None:
+        close_mask_sinks()
+        sink = MASK_SINKS[(exp_folder, kind)] = open_mask_sink(exp_folder, kind)
+    return sink
+
+
+def open_mask_sink(exp_folder, kind = PARAMS_SNK):
+    """
+    Function: return a new temp mask sink of an experiment folder. `kind` is one of `PARAMS_SNS`,
+    the PNG file is the fallback if shared memory fails.
+    """
+    if kind == "png":
+        return PngMaskSink(exp_folder)
+    png_sink = PngMaskSink(exp_folder) if kind == "shared_memory+png" else None
+    try:
+        return SharedMaskSink(png_sink=png_sink)
+    except (OSError, ValueError) as e:
+        print(f"Warning: {e}")
+        print(f"Warning: temp masks are saved as {PARAMS_TMP} instead of shared memory.")
+        return PngMaskSink(exp_folder)
+
+
+def close_mask_sinks():
+    """
+    Function: close all open temp mask sinks (shared memory segments are removed).
+    """
+    for key in list(MASK_SINKS):
+        MASK_SINKS.pop(key).close()
+
+
+def read_shared_mask(name = PARAMS_SHM, last_sequence = None, timeout = 1.0):
+    """
+    ### Read the latest temp mask published by a `SharedMaskSink` (control software side).
+
+    `name` : name of the shared memory segment. Default = `PARAMS_SHM`.
+    `last_sequence` : sequence already read, wait for a newer mask. Default = `None` (any mask).
+    `timeout` : seconds to wait for a complete, newer mask. Default = `1.0`.
+
+    Return (sequence, round, area, pixels), none if no valid mask was published in time.
+    """
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            magic, sequence, num_round, area, width, height, checksum = \
+                struct.unpack_from(PARAMS_SHH, segment.buf)
+            if (magic != b"MRCY" or sequence % 2 or sequence == 0
+                    or sequence == last_sequence):
+                time.sleep(0)
+                continue
+            pixels = np.ndarray((height, width), dtype=np.uint8,
+                                buffer=segment.buf, offset=PARAMS_SHO).copy()
+            # the mask is valid if it was not rewritten while copying
+            if (struct.unpack_from(PARAMS_SHH, segment.buf)[1] == sequence
+                    and zlib.crc32(pixels) == checksum):
+                return (sequence, num_round, area, pixels)
+        return None
+    finally:
+        segment.close()
+
+
+def update_mask(img_folder, num_round, area, pixel_per_micron = 1, sink = PARAMS_SNK):
+    """
+    Function: update and stretch temp cleave mask based on round/area number.
+    return false if the update is unsuccessful.
+    `pixel_per_micron` is the cleave map resolution, 2 for 732px masks (see mercury_03_copy.py).
+    `sink` is where the temp mask goes, one of `PARAMS_SNS` (see `mask_sink`).
+    """
+    # check for valid input
+    if num_round < 0 or area < 0:
+        print(f"Warning: invalid round/area combination: round {num_round} area {area}.")
+        print(f"Warning: round {num_round} area {area} not executed.")
+        return [[],[],[]]
+    # try constructing the mask
+    try:
+        start = time.perf_counter()
+        exp_folder = os.path.dirname(img_folder)
+        # hand over the pre-rendered mask if the round has an up-to-date bundle
+        bundle = mask_bundle(exp_folder, num_round, pixel_per_micron)
+        if bundle is not None and f"area_{area}" in bundle[0].files:
+            masks, center_coords = bundle
+            mask_sink(exp_folder, sink)(num_round, area, masks[f"area_{area}"].tobytes())
+            print(f"Round {num_round} area {area}: mask updated in "
+                  f"{(time.perf_counter() - start) * 1000:.1f} ms (pre-rendered).")
+            return center_coords[area][0:3]
+        hits = load_round_context.cache_info().hits
+        # access cleave center coordinates and cleave mask area, read once per round
+        center_coords, round_mask = round_context(exp_folder, num_round)
+        center_coord = center_coords[area]
+        region = np.asarray(round_mask.crop(center_coord[3:7]))
+        # # if the designated area is (nearly) blank, drop this area and return
+        # px_threshold = 10
+        # if count_non_white_pixel(tgt_mask) < px_threshold:
+        #     print(f"Warning: designated area's pixel count is lower than {px_threshold}.")
+        #     print(f"Warning: round {num_round} area {area} not executed.")
+        #     return False
+        # hand the modified image over as the new temp mask
+        rtn_mask = render_mask(region, mask_preset(), pixel_per_micron)
+        mask_sink(exp_folder, sink)(num_round, area, rtn_mask)
+        cached = load_round_context.cache_info().hits > hits
+        print(f"Round {num_round} area {area}: mask updated in "
+              f"{(time.perf_counter() - start) * 1000:.1f} ms ({'cached' if cached else 'read'}).")
+        return center_coord[0:3]
+    except FileNotFoundError as e:
+        print(f"Warning: {e}")
+        print(f"Warning: round {num_round} area {area} not executed.")
+        return [[],[],[]]
+
+
+def record_laser_coord(laser_img_folder_path, coords, num_round, execute_status):
+    """
+    Function: create/append (laser imaging) coordinates into a given csv file.
+    coordinates are appended to the journal of `Round N (recorded).csv`, which is written into the
+    csv automatically (see `CoordinateJournal`).
+    """
+    # find csv file name
+    file = os.path.join(laser_img_folder_path, f"Round {num_round} (recorded).csv")
+    coordinate_journal(file, PARAMS_RCD)(coords[0], coords[1], coords[2], execute_status)
+
+
+def finish_round(laser_img_folder_path, num_round):
+    """
+    Function: write the recorded coordinates of a round into `Round N (recorded).csv` right away
+    (they are also written automatically, see `CoordinateJournal`). Return the number of rows
+    written.
+    """
+    file = os.path.join(laser_img_folder_path, f"Round {num_round} (recorded).csv")
+    return compact_journal(file, PARAMS_RCD)
+
+
+def journal_path(file_path):
+    """
+    Function: return the path of the append-only journal of a coordinate csv.
+    """
+    return os.path.splitext(file_path)[0] + PARAMS_JNL
+
+
+def journal_complete(file_path):
+    """
+    Function: return whether a journal ends with a complete line, none if it is missing or empty.
+    """
+    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        return None
+    with open(file_path, 'rb') as file:
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) == b"\n"
+
+
+def journal_base(line):
+    """
+    Function: return the number of csv rows of a journal header line (`#base,N`), none if the
+    header is not valid (e.g. cut short by a crash).
+    """
+    fields = line.split(",")
+    if len(fields) != 2 or fields[0] != "#base" or not fields[1].isdigit():
+        return None
+    return int(fields[1])
+
+
+def csv_line(fields):
+    """
+    Function: return one csv line of string fields, quoted where needed.
+    """
+    line = io.StringIO()
+    csv.writer(line, lineterminator="\n").writerow(fields)
+    return line.getvalue()
+
+
+def journal_row(line, columns):
+    """
+    Function: return whether a journal line is a complete row, one field per column and numbers
+    in the `PARAMS_NUM` columns (other columns, e.g. exec, may hold any value).
+    """
+    try:
+        fields = next(csv.reader([line], strict=True))
+        for column, field in zip(columns, fields):
+            if column in PARAMS_NUM:
+                float(field)
+    except (ValueError, StopIteration, csv.Error):
+        return False
+    return len(fields) == len(columns)
+
+
+def count_csv_rows(file_path):
+    """
+    Function: return the number of rows of a csv written by pandas (0 if it does not exist).
+    """
+    if not os.path.exists(file_path):
+        return 0
+    with open(file_path, 'rb') as file:
+        return max(sum(1 for _ in file) - 1, 0)
+
+
+OPEN_JOURNALS = {}
+
+
+def coordinate_journal(file_path, columns):
+    """
+    Function: return the open journal of a coordinate csv. Journals of other csv files in the
+    same folder are compacted when a new journal is started (e.g. the previous round).
+    """
+    journal = OPEN_JOURNALS.get(file_path)
+    if journal is not None:
+        return journal
+    folder = os.path.dirname(file_path)
+    for other in list(OPEN_JOURNALS):
+        if os.path.dirname(other) == folder:
+            OPEN_JOURNALS.pop(other).close()
+    for name in os.listdir(folder or "."):
+        other = os.path.join(folder, name[:-len(PARAMS_JNL)] + ".csv")
+        if name.endswith(PARAMS_JNL) and other != file_path:
+            compact_journal(other, columns)
+    journal = OPEN_JOURNALS[file_path] = CoordinateJournal(file_path, columns)
+    return journal
+
+
+def close_journals(compact = True):
+    """
+    Function: close all open coordinate journals, and compact them into their csv files.
+    """
+    for file_path in list(OPEN_JOURNALS):
+        OPEN_JOURNALS.pop(file_path).close(compact)
+
+
+# journals still open when python exits (e.g. the LabVIEW Python node session ends)
+atexit.register(close_journals)
+
+
+def journal_lines(file_path, columns, csv_rows, tail = False):
+    """
+    Function: return the complete rows of a coordinate journal that are not in its csv yet (as
+    lines), and the number of rows that were rejected. See `read_journal`, a last row cut short
+    is rejected too if `tail` (no writer is appending it).
+    """
+    rows, rejected = [], 0
+    journal = journal_path(file_path)
+    if os.path.exists(journal):
+        with open(journal, 'r', encoding="utf-8", newline='') as file:
+            lines = file.read().split("\n")
+        # the last element is empty if the last row is complete
+        base, rows = journal_base(lines[0]), lines[1:-1]
+        if base is None:
+            print(f"Warning: {journal} has no valid header, its first line is dropped.")
+            base = csv_rows
+        valid = [row for row in rows if journal_row(row, columns)]
+        if len(valid) != len(rows):
+            rejected = len(rows) - len(valid)
+            print(f"Warning: {rejected} incomplete rows of {journal} are dropped.")
+            rows = valid
+        if tail and len(lines) > 1 and lines[-1] != "":
+            rejected += 1
+            print(f"Warning: the last row of {journal} was cut short, it is dropped.")
+        if csv_rows == base + len(rows) and rows:
+            print(f"Warning: {journal} was already compacted into {file_path}.")
+            rows = []
+        elif csv_rows != base:
+            print(f"Warning: {file_path} changed since {journal} was started, appending its rows.")
+    return rows, rejected
+
+
+def read_journal(file_path, columns, csv_rows):
+    """
+    ### Return the rows of a coordinate journal that are not in its csv yet, as a DataFrame.
+
+    `file_path` : the coordinate csv, no rows if it has no journal.
+    `columns` : csv columns, after the index column.
+    `csv_rows` : number of rows of the csv.
+
+    Nothing is written, the journal may still be appended by its writer. A partially written last
+    row (the process stopped while appending) is skipped, other rows that are cut short and a
+    header that is not valid are dropped with a warning. Values are parsed round-trip, like the
+    rows of the csv once the journal is written into it.
+    """
+    rows = journal_lines(file_path, columns, csv_rows)[0]
+    return journal_frame(rows, columns)
+
+
+def journal_frame(rows, columns, text = False):
+    """
+    Function: return journal lines as a DataFrame, with columns other than `PARAMS_NUM` kept as
+    recorded (text) if `text`.
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+    columns = list(columns)
+    if not rows:
+        return pd.DataFrame({column: [] for column in columns})
+    if not text:
+        return pd.read_csv(io.StringIO("\n".join(rows)), header=None, names=columns,
+                           float_precision="round_trip")
+    text = {column: str for column in columns if column not in PARAMS_NUM}
+    return pd.read_csv(io.StringIO("\n".join(rows)), header=None, names=columns, dtype=text,
+                       keep_default_na=False, float_precision="round_trip")
+
+
+def read_coordinates(file_path, columns):
+    """
+    Function: return the rows of a coordinate csv followed by the rows still in its journal, as a
+    DataFrame. Neither file is changed, so this is safe while another process records coordinates.
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+    if os.path.exists(file_path):
+        df1 = pd.read_csv(file_path, usecols=range(1, len(columns) + 1))
+    else:
+        df1 = pd.DataFrame({column: [] for column in columns})
+    df2 = read_journal(file_path, columns, len(df1))
+    # avoid concat empty dataframes (may cause empty rows)
+    if df2.empty:
+        return df1
+    return df2 if df1.empty else pd.concat([df1, df2], ignore_index=True)
+
+
+def compact_journal(file_path, columns):
+    """
+    ### Write the rows of a coordinate journal into its csv (pandas layout, index column first).
+
+    `file_path` : the coordinate csv, nothing is done if it has no journal.
+    `columns` : csv columns, after the index column.
+
+    Only the writer of the journal may compact it (see `coordinate_journal`), readers use
+    `read_coordinates`. The csv is replaced atomically, then the journal is removed, or renamed to
+    `<journal>.bad` if rows were rejected (or the last row was cut short) so none are lost. Return
+    the number of rows written.
+    """
+    journal = OPEN_JOURNALS.get(file_path)
+    if journal is not None:
+        return journal.compact()
+    return write_journal(file_path, columns)
+
+
+def write_journal(file_path, columns):
+    """
+    Function: compact a journal that is not being appended, see `compact_journal`.
+    """
+    journal = journal_path(file_path)
+    if not os.path.exists(journal):
+        return 0
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+    columns = list(columns)
+    if os.path.exists(file_path):
+        # columns other than PARAMS_NUM are written back as read
+        text = {column: str for column in columns if column not in PARAMS_NUM}
+        df1 = pd.read_csv(file_path, usecols=range(1, len(columns) + 1), dtype=text,
+                          keep_default_na=False, float_precision="round_trip")
+    else:
+        df1 = pd.DataFrame({column: [] for column in columns})
+    rows, rejected = journal_lines(file_path, columns, len(df1), tail=True)
+    df2 = journal_frame(rows, columns, text=True)
+    if not df2.empty:
+        # avoid concat empty dataframes (may cause empty rows)
+        df = df2 if df1.empty else pd.concat([df1, df2], ignore_index=True)
+        df.to_csv(file_path + ".tmp", index=True)
+        os.replace(file_path + ".tmp", file_path)
+    if rejected:
+        bad = journal + PARAMS_BAD
+        for i in range(1, 1000):
+            if not os.path.exists(bad):
+                break
+            bad = f"{journal}.{i}{PARAMS_BAD}"
+        os.replace(journal, bad)
+        print(f"Warning: {journal} had rows that were not written into {file_path}, see {bad}.")
+    else:
+        os.remove(journal)
+    return len(df2)
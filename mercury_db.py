@@ -0,0 +1,300 @@
+"""
+Mercury DB: SQLite index of experiment folder files, project version 1.24 (with python 3.9).
+
+The csv files of an experiment folder stay the reference, the database (`mercury.sqlite` in the
+experiment folder, WAL mode) is an index over them: every csv is imported once with pandas (the
+same values as reading the csv directly) and imported again only when its modification time or
+size changed. Lookups by round, cleave center and spatial bin are indexed queries instead of full
+csv parses, see the query functions of `ExperimentDatabase`.
+"""
+
+import os
+import re
+import json
+import math
+import sqlite3
+from functools import lru_cache
+
+from mercury_core import PARAMS_CRC, journal_path, read_coordinates
+
+PARAMS_DBF = "mercury.sqlite"
+PARAMS_BIN = 300.0  # um, size of the spatial bins (about one FOV)
+PARAMS_MAP = "image_cleave_map"
+PARAMS_PLN = "coord_planned.csv"
+PARAMS_CRD = "coord_recorded.csv"
+PARAMS_SCT = "coord_scan_center.csv"
+PARAMS_BIT = "config_bit_scheme.csv"
+PARAMS_CTR = ("x", "y", "z", "w", "n", "e", "s")  # columns of cleave center files
+PARAMS_SUB = ("x", "y", "w", "n", "e", "s")  # columns of submasks (config_bit_scheme.csv)
+PARAMS_SRC = {
+    # table: (csv file, columns)
+    "planned": (PARAMS_PLN, ("x", "y")),
+    "recorded": (PARAMS_CRD, ("x", "y", "z")),
+    "scan_centers": (PARAMS_SCT, PARAMS_CTR),
+    "submasks": (PARAMS_BIT, PARAMS_SUB),
+}
+PARAMS_SQL = """
+CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, stamp INTEGER, size INTEGER);
+CREATE TABLE IF NOT EXISTS planned (id INTEGER PRIMARY KEY, x, y, bin_x INTEGER, bin_y INTEGER);
+CREATE TABLE IF NOT EXISTS recorded (
+    id INTEGER PRIMARY KEY, x, y, z, bin_x INTEGER, bin_y INTEGER);
+CREATE TABLE IF NOT EXISTS scan_centers (
+    id INTEGER PRIMARY KEY, x, y, z, w, n, e, s, bin_x INTEGER, bin_y INTEGER);
+CREATE TABLE IF NOT EXISTS round_centers (
+    num_round INTEGER, id INTEGER, x, y, z, w, n, e, s, bin_x INTEGER, bin_y INTEGER,
+    PRIMARY KEY (num_round, id));
+CREATE TABLE IF NOT EXISTS submasks (
+    id INTEGER PRIMARY KEY, x, y, w, n, e, s, indices TEXT, bits TEXT,
+    bin_x INTEGER, bin_y INTEGER);
+CREATE TABLE IF NOT EXISTS submask_rounds (
+    num_round INTEGER, id INTEGER, PRIMARY KEY (num_round, id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS planned_bins ON planned (bin_x, bin_y);
+CREATE INDEX IF NOT EXISTS recorded_bins ON recorded (bin_x, bin_y);
+CREATE INDEX IF NOT EXISTS scan_center_bins ON scan_centers (bin_x, bin_y);
+CREATE INDEX IF NOT EXISTS round_center_bins ON round_centers (num_round, bin_x, bin_y);
+CREATE INDEX IF NOT EXISTS submask_bins ON submasks (bin_x, bin_y);
+"""
+
+
+# ======================================= database classes ========================================
+
+class ExperimentDatabase:
+    """
+    Class: SQLite index of the coordinate and bit scheme csv files of one experiment folder.
+
+    Columns keep the values pandas reads from the csv files (int columns stay int), rows keep
+    their csv order (`id`). Cleave centers of `image_cleave_map/Round N.csv` are stored by round.
+    Every item also gets a spatial bin (`PARAMS_BIN` um) for indexed neighbourhood queries.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, exp_folder, file_name = PARAMS_DBF, bin_size = PARAMS_BIN):
+        self.exp_folder = exp_folder
+        self.bin_size = bin_size
+        self.connection = sqlite3.connect(os.path.join(exp_folder, file_name))
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(PARAMS_SQL)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def sources(self):
+        """
+        Function: return {file name (relative to the experiment folder): table} of existing csv.
+        """
+        sources = {}
+        for table, (file_name, _columns) in PARAMS_SRC.items():
+            file_path = os.path.join(self.exp_folder, file_name)
+            if os.path.exists(file_path) or os.path.exists(journal_path(file_path)):
+                sources[file_name] = table
+        map_folder = os.path.join(self.exp_folder, PARAMS_MAP)
+        if os.path.isdir(map_folder):
+            for name in os.listdir(map_folder):
+                if re.fullmatch(r"Round \d+\.csv", name):
+                    sources[f"{PARAMS_MAP}/{name}"] = "round_centers"
+        return sources
+    # ---------------------------------------------------------------------------------------------
+    def sync(self):
+        """
+        Function: import csv files that are new or changed since the last sync, drop rows of
+        removed files. Return the names of the imported files.
+        """
+        sources = self.sources()
+        stored = dict(
+            (name, (stamp, size)) for name, stamp, size in
+            self.connection.execute("SELECT name, stamp, size FROM files"))
+        imported = []
+        with self.connection:
+            for name in set(stored) - set(sources):
+                self.clear(name)
+                self.connection.execute("DELETE FROM files WHERE name = ?", (name,))
+            for name, table in sorted(sources.items()):
+                stamp = self.stamp_of(name)
+                if stored.get(name) == stamp:
+                    continue
+                self.clear(name)
+                self.load(name, table)
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (name, *stamp))
+                imported.append(name)
+        return imported
+    # ---------------------------------------------------------------------------------------------
+    def stamp_of(self, name):
+        """
+        Function: return (modification time in ns, size) of a csv file and its journal.
+        """
+        stamp, size = 0, 0
+        file_path = os.path.join(self.exp_folder, name)
+        for path in (file_path, journal_path(file_path)):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                stamp, size = max(stamp, stat.st_mtime_ns), size + stat.st_size
+        return (stamp, size)
+    # ---------------------------------------------------------------------------------------------
+    def clear(self, name):
+        """
+        Function: delete the rows imported from one csv file.
+        """
+        num_round = round_of(name)
+        if num_round is not None:
+            self.connection.execute("DELETE FROM round_centers WHERE num_round = ?", (num_round,))
+            return
+        for table, (file_name, _columns) in PARAMS_SRC.items():
+            if file_name == name:
+                self.connection.execute(f"DELETE FROM {table}")
+                if table == "submasks":
+                    self.connection.execute("DELETE FROM submask_rounds")
+    # ---------------------------------------------------------------------------------------------
+    def load(self, name, table):
+        """
+        Function: import one csv file into its table (pandas parses the file, like the modules).
+        """
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+        file_path = os.path.join(self.exp_folder, name)
+        columns = PARAMS_CTR if table == "round_centers" else PARAMS_SRC[table][1]
+        if name == PARAMS_CRD:
+            # rows still in the journal are read as well, the journal is left to its writer
+            data = read_coordinates(file_path, PARAMS_CRC)
+        else:
+            data = pd.read_csv(file_path, keep_default_na = False)
+        values = [data[column].tolist() for column in columns]
+        bins = [self.bin_of(x, y) for x, y in zip(values[0], values[1])]
+        rows = [[k, *row, *bins[k]] for k, row in enumerate(zip(*values))]
+        if table == "round_centers":
+            num_round = round_of(name)
+            self.connection.executemany(
+                "INSERT INTO round_centers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [[num_round, *row] for row in rows])
+        elif table == "submasks":
+            indices, bits = data["index"].tolist(), data["bit"].tolist()
+            rows = [[*row[:7], indices[k], bits[k], *row[7:]] for k, row in enumerate(rows)]
+            self.connection.executemany(
+                "INSERT INTO submasks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.executemany(
+                "INSERT INTO submask_rounds VALUES (?, ?)",
+                [(num_round, k) for k, bit in enumerate(bits)
+                 for num_round, value in enumerate(json.loads(bit)) if value])
+        else:
+            marks = ", ".join("?" * (len(columns) + 3))
+            self.connection.executemany(f"INSERT INTO {table} VALUES ({marks})", rows)
+    # ---------------------------------------------------------------------------------------------
+    def bin_of(self, x, y):
+        """
+        Function: return the (bin_x, bin_y) spatial bin of a point.
+        """
+        return (math.floor(x / self.bin_size), math.floor(y / self.bin_size))
+    # ---------------------------------------------------------------------------------------------
+    def select(self, table, columns, where = "", params = ()):
+        """
+        Function: return rows of selected columns of a table, in csv order.
+        """
+        allowed = PARAMS_CTR if table == "round_centers" else PARAMS_SRC[table][1]
+        if not set(columns) <= set(allowed):
+            raise ValueError(f"unknown columns {columns} of {table}.")
+        return [list(row) for row in self.connection.execute(
+            f"SELECT {', '.join(columns)} FROM {table} {where} ORDER BY id", params)]
+    # ---------------------------------------------------------------------------------------------
+    def planned_coordinates(self):
+        """
+        Function: return the [x, y] of coord_planned.csv (as `mercury_02.read_xycoordinates`).
+        """
+        return self.select("planned", ("x", "y"))
+    # ---------------------------------------------------------------------------------------------
+    def recorded_coordinates(self):
+        """
+        Function: return the [x, y, z] of coord_recorded.csv.
+        """
+        return self.select("recorded", ("x", "y", "z"))
+    # ---------------------------------------------------------------------------------------------
+    def scan_centers(self, columns = PARAMS_CTR):
+        """
+        Function: return the cleave centers of coord_scan_center.csv (selected columns).
+        """
+        return self.select("scan_centers", columns)
+    # ---------------------------------------------------------------------------------------------
+    def round_centers(self, num_round, columns = PARAMS_CTR):
+        """
+        Function: return the cleave centers of a round (`Round N.csv`, selected columns).
+        """
+        return self.select("round_centers", columns, "WHERE num_round = ?", (num_round,))
+    # ---------------------------------------------------------------------------------------------
+    def bit_length(self):
+        """
+        Function: return the bit string length of the bit scheme (number of ports), 0 if empty.
+        """
+        row = self.connection.execute("SELECT bits FROM submasks ORDER BY id LIMIT 1").fetchone()
+        return 0 if row is None else len(json.loads(row[0]))
+    # ---------------------------------------------------------------------------------------------
+    def near(self, table, x, y, radius, where = "", params = ()):
+        """
+        Function: return (where clause, params) selecting items within `radius` um of (x, y),
+        through the spatial bins first.
+        """
+        west, north = self.bin_of(x - radius, y - radius)
+        east, south = self.bin_of(x + radius, y + radius)
+        clause = (f"{where} {'AND' if where else 'WHERE'} {table}.bin_x BETWEEN ? AND ? "
+                  f"AND {table}.bin_y BETWEEN ? AND ? AND ({table}.x - ?) * ({table}.x - ?) "
+                  f"+ ({table}.y - ?) * ({table}.y - ?) <= ?")
+        return clause, (*params, west, east, north, south, x, x, y, y, radius * radius)
+    # ---------------------------------------------------------------------------------------------
+    def active_submasks(self, num_round, x = None, y = None, radius = PARAMS_BIN):
+        """
+        ### Return [id, x, y, w, n, e, s] of the submasks cleaved in a round.
+
+        `num_round` : round number (bit position).
+        `x`, `y` : only submasks within `radius` um of this point. Default = `None` (all).
+        `radius` : search radius (um). Default = `PARAMS_BIN`.
+        """
+        where, params = "WHERE submask_rounds.num_round = ?", (num_round,)
+        tables = "submask_rounds JOIN submasks"
+        if x is not None and y is not None:
+            where, params = self.near("submasks", x, y, radius, where, params)
+            # start from the spatial bins, not from every submask of the round
+            tables = "submasks CROSS JOIN submask_rounds"
+        return [list(row) for row in self.connection.execute(
+            "SELECT submasks.id, submasks.x, submasks.y, submasks.w, submasks.n, submasks.e, "
+            f"submasks.s FROM {tables} ON submasks.id = submask_rounds.id {where} "
+            "ORDER BY submasks.id", params)]
+    # ---------------------------------------------------------------------------------------------
+    def round_centers_near(self, num_round, x, y, radius = PARAMS_BIN):
+        """
+        Function: return [id, x, y, z, w, n, e, s] of the cleave centers of a round within `radius`
+        um of (x, y), closest first.
+        """
+        where, params = self.near(
+            "round_centers", x, y, radius, "WHERE num_round = ?", (num_round,))
+        return [list(row) for row in self.connection.execute(
+            f"SELECT id, {', '.join(PARAMS_CTR)} FROM round_centers {where} "
+            "ORDER BY (x - ?) * (x - ?) + (y - ?) * (y - ?), id", (*params, x, x, y, y))]
+    # ---------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Function: close the database connection.
+        """
+        self.connection.close()
+
+
+# ===================================== independent functions =====================================
+
+def round_of(name):
+    """
+    Function: return the round number of a `Round N.csv` file name, none for other files.
+    """
+    match = re.fullmatch(rf"{PARAMS_MAP}/Round (\d+)\.csv", name)
+    return None if match is None else int(match.group(1))
+
+
+@lru_cache(maxsize=4)
+def load_experiment_database(exp_folder):
+    """
+    Function: open the database of an experiment folder once, see `experiment_database`.
+    """
+    return ExperimentDatabase(exp_folder)
+
+
+def experiment_database(exp_folder):
+    """
+    Function: return the database of an experiment folder, synced with its csv files.
+    """
+    if not os.path.isdir(exp_folder):
+        raise FileNotFoundError(f"experiment folder {exp_folder} not found.")
+    database = load_experiment_database(os.path.realpath(exp_folder))
+    database.sync()
+    return database
@@ -0,0 +1,205 @@
+"""
+Mercury Worker: warm python process serving LabVIEW calls, project version 1.24 (with python 3.9).
+
+LabVIEW used to start a fresh interpreter for every call into `mercury_03.update_mask`,
+`record_laser_coord` or `ShearValve_Module.set_shear_valve`, importing pandas, PIL, yaml,
+customtkinter and matplotlib each time. This worker imports them once, keeps experiment state
+(cleave maps, pre-rendered masks, mask sinks) in memory, and serves the same functions over a
+localhost socket, one JSON-RPC 2.0 request per line. Every connection is served on its own
+thread (e.g. the laser and the fluidics VIs), calls run one at a time. See `mercury_client.py` for
+the caller side.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import builtins
+import importlib
+import threading
+
+PARAMS_HST = "127.0.0.1"  # the worker only listens on the local machine
+PARAMS_PRT = 50503  # port of the worker
+PARAMS_ACC = 0.5  # seconds between checks for shutdown while waiting for connections
+PARAMS_MOD = {
+    "update_mask": ("mercury_core", "update_mask"),
+    "update_mask_732": ("mercury_03_copy", "update_mask"),
+    "record_laser_coord": ("mercury_core", "record_laser_coord"),
+    "finish_round": ("mercury_core", "finish_round"),
+    "set_shear_valve": ("ShearValve_Module", "set_shear_valve"),
+}
+PARAMS_PRE = ["pandas", "yaml"]  # imported by mercury_core on first use, preloaded
+
+
+# ======================================== worker classes =========================================
+
+class MercuryWorker:
+    """
+    Class: preload mercury modules and serve their functions to `mercury_client` callers.
+    """
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on enable ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, exp_folder = None):
+        self.start = time.perf_counter()
+        self.methods = {
+            "ping": self.ping,
+            "warm": self.warm,
+            "shutdown": self.shutdown,
+        }
+        self.unavailable = {}
+        for module_name in PARAMS_PRE:
+            importlib.import_module(module_name)
+        for name, (module_name, function_name) in PARAMS_MOD.items():
+            try:
+                self.methods[name] = getattr(importlib.import_module(module_name), function_name)
+            except ImportError as e:
+                # e.g. pyserial is only installed on the instrument computer
+                self.unavailable[name] = str(e)
+                print(f"Warning: {name} is not available: {e}")
+        if exp_folder is not None:
+            self.warm(exp_folder)
+        self.running = True
+        self.calls = 0
+        # connections are served on their own threads, the called functions are not thread-safe
+        self.lock = threading.Lock()
+        print(f"Worker ready in {time.perf_counter() - self.start:.2f} s.")
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ on call ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __call__(self, request):
+        """
+        Function: answer one JSON-RPC request (dict), return the response (dict).
+        """
+        method = request.get("method")
+        params = request.get("params", [])
+        with self.lock:
+            start = time.perf_counter()
+            try:
+                if method in self.unavailable:
+                    raise ImportError(f"{method} is not available: {self.unavailable[method]}")
+                if method not in self.methods:
+                    raise AttributeError(f"unknown method {method}.")
+                if isinstance(params, dict):
+                    result = self.methods[method](**params)
+                else:
+                    result = self.methods[method](*params)
+                response = {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+            except Exception as e:  # pylint: disable=broad-except
+                # the error is raised again on the client side, the worker keeps serving
+                response = {"jsonrpc": "2.0", "id": request.get("id"), "error": {
+                    "code": -32000, "message": str(e), "type": type(e).__name__}}
+            self.calls += 1
+            print(f"{method}: {(time.perf_counter() - start) * 1000:.1f} ms.")
+        return response
+    # ---------------------------------------------------------------------------------------------
+    def ping(self):
+        """
+        Function: return process id, uptime (s), number of calls and unavailable methods.
+        """
+        return {
+            "pid": os.getpid(),
+            "uptime": time.perf_counter() - self.start,
+            "calls": self.calls,
+            "unavailable": sorted(self.unavailable),
+        }
+    # ---------------------------------------------------------------------------------------------
+    def warm(self, exp_folder):
+        """
+        Function: open the pre-rendered masks of every round of an experiment (decode the first
+        cleave map if there are none), return the number of rounds found.
+        """
+        mercury_core = importlib.import_module("mercury_core")
+        map_folder = os.path.join(exp_folder, mercury_core.PARAMS_MAP)
+        num_round = 0
+        while os.path.exists(os.path.join(map_folder, f"Round {num_round}.csv")):
+            if mercury_core.mask_bundle(exp_folder, num_round) is None and num_round == 0:
+                mercury_core.round_context(exp_folder, num_round)
+            num_round += 1
+        print(f"Warmed {num_round} rounds of {exp_folder}.")
+        return num_round
+    # ---------------------------------------------------------------------------------------------
+    def shutdown(self):
+        """
+        Function: stop serving once the current call is answered, compact the coordinate
+        journals written by this worker and close its temp mask sink.
+        """
+        mercury_core = importlib.import_module("mercury_core")
+        mercury_core.close_journals()
+        mercury_core.close_mask_sinks()
+        self.running = False
+        return True
+    # ---------------------------------------------------------------------------------------------
+    def serve(self, host = PARAMS_HST, port = PARAMS_PRT):
+        """
+        Function: answer requests until shut down, every connection on its own thread.
+        """
+        with socket.create_server((host, port)) as server:
+            server.settimeout(PARAMS_ACC)
+            print(f"Serving on {host}:{port}.")
+            while self.running:
+                try:
+                    connection, _address = server.accept()
+                except socket.timeout:
+                    continue
+                connection.settimeout(None)
+                threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+    # ---------------------------------------------------------------------------------------------
+    def handle(self, connection):
+        """
+        Function: answer the requests of one connection until it is closed.
+        """
+        try:
+            with connection, connection.makefile('rwb') as stream:
+                for line in stream:
+                    stream.write(json.dumps(self.answer(line)).encode() + b"\n")
+                    stream.flush()
+                    if not self.running:
+                        break
+        except OSError as e:
+            # the client went away (e.g. reset mid-reply or timed out), other clients are served
+            print(f"Warning: connection closed: {e}.")
+    # ---------------------------------------------------------------------------------------------
+    def answer(self, line):
+        """
+        Function: answer one request line (bytes), an error response if it is not a JSON-RPC
+        request object.
+        """
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {"jsonrpc": "2.0", "id": None, "error": {
+                "code": -32700, "message": f"parse error: {e}", "type": "ValueError"}}
+        if not isinstance(request, dict):
+            return {"jsonrpc": "2.0", "id": None, "error": {
+                "code": -32600, "message": "invalid request.", "type": "ValueError"}}
+        return self(request)
+
+
+# ===================================== independent functions =====================================
+
+def raise_remote_error(error):
+    """
+    Function: raise the exception of a JSON-RPC error, as its builtin type if there is one.
+    """
+    error_type = getattr(builtins, error.get("type", ""), None)
+    if not (isinstance(error_type, type) and issubclass(error_type, Exception)):
+        error_type = RuntimeError
+    raise error_type(error.get("message", "worker call failed."))
+
+
+# ========================================= main function =========================================
+
+def mercury_worker(argv = None):
+    """
+    Function: parse command line arguments and serve until shut down.
+    """
+    parser = argparse.ArgumentParser(description="Mercury Worker")
+    parser.add_argument("--host", default=PARAMS_HST, help="address to listen on")
+    parser.add_argument("--port", type=int, default=PARAMS_PRT, help="port to listen on")
+    parser.add_argument("--exp", default=None, help="experiment folder to warm up")
+    args = parser.parse_args(argv)
+    # the functions are imported from the folder of this file, like LabVIEW does
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+    MercuryWorker(args.exp).serve(args.host, args.port)
+
+if __name__ == "__main__":
+    mercury_worker()
@@ -0,0 +1,24 @@
+"""
+Tests of mercury_01.py (FOV order), run with `python -m pytest tests`.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# pylint: disable=wrong-import-position
+from mercury_01 import FOV_ORDERS, scheme_order_fovs
+
+
+def test_fov_orders_estimated(capsys):
+    """
+    The native order is kept by default, the acquisition time of every order but route (2-opt,
+    only on request) is printed.
+    """
+    coordinates = [[x * 300, y * 300] for x in range(8) for y in range(6)]
+    assert scheme_order_fovs(coordinates, 300) == list(range(len(coordinates)))
+    printed = capsys.readouterr().out
+    assert all((name in printed) == (name != "route") for name in FOV_ORDERS)
+    scheme_order_fovs(coordinates, 300, "route")
+    assert "* route" in capsys.readouterr().out
@@ -0,0 +1,66 @@
+"""
+Tests of mercury_02.py (cleave maps, command line), run with `python -m pytest tests`.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# pylint: disable=wrong-import-position
+import pytest
+import numpy as np
+from PIL import Image
+
+import mercury_02
+from mercury_02 import FocalSurface, render_cleave_maps, mercury_02_main
+
+
+def test_cleave_map_overlapping_boxes():
+    """
+    Cleave maps show the global mask on every active submask, like pasting the active submasks
+    onto a blank map: an inactive submask does not hide an active one it overlaps.
+    """
+    rng = np.random.default_rng(0)
+    global_mask = Image.fromarray(rng.integers(0, 4, (40, 50), dtype=np.uint8)).convert('P')
+    global_mask.putpalette([0,0,0, 255,255,255, 255,0,0, 0,0,255])
+    regions = [[0, 0, 20, 20], [10, 10, 30, 30], [25, 5, 45, 35]]
+    bits = [[1, 0], [0, 1], [1, 1]]
+    maps = {}
+    render_cleave_maps(global_mask, regions, bits, lambda k, img: maps.update({k: img}))
+    for num_round in range(2):
+        expected = Image.new('P', global_mask.size, color = (255,255,255))
+        for region, bit in zip(regions, bits):
+            if bit[num_round]:
+                expected.paste(global_mask.crop(region), region)
+        assert np.array_equal(np.asarray(maps[num_round]), np.asarray(expected))
+
+
+def test_gui_receives_command_line_options(monkeypatch):
+    """
+    Without --headless, the folder, entries, z model and bit scheme engine are passed to the GUI,
+    and --preview (headless only) is rejected.
+    """
+    started = []
+    monkeypatch.setattr(mercury_02, "mercury_02", lambda *args: started.append(args))
+    mercury_02_main(["--folder", "exp", "--ports", "7", "--concatenations", "auto",
+                     "--z-model", "linear", "--bit-scheme", "balanced"])
+    assert started == [(1, "exp", [7, 300, 0, 3, 100], "linear", "balanced")]
+    with pytest.raises(SystemExit):
+        mercury_02_main(["--preview", "preview.png"])
+    assert len(started) == 1
+
+
+def test_focal_surface_exact_at_fovs():
+    """
+    The default focal surface keeps the recorded z at every FOV of a warped slide, and uses the
+    nearest FOV z if the FOVs cannot be triangulated.
+    """
+    grid = np.array([[x, y] for x in range(0, 3000, 300) for y in range(0, 3000, 300)], float)
+    z = 20 * np.sin(grid[:, 0] / 400) * np.cos(grid[:, 1] / 500)
+    surface = FocalSurface(grid, z)
+    assert surface.method == "linear"
+    assert np.allclose(surface.predict(grid), z)
+    row = FocalSurface(grid[:10], z[:10])
+    assert row.method == "nearest"
+    assert np.allclose(row.predict(grid[:10] + 1), z[:10])
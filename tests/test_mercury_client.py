@@ -0,0 +1,102 @@
+"""
+Tests of mercury_client.py (worker start and fallback), run with `python -m pytest tests`.
+"""
+
+import os
+import sys
+import time
+import socket
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# pylint: disable=wrong-import-position
+import mercury_client
+from mercury_client import WorkerClient, WorkerUnavailable, WorkerNoReply
+from mercury_worker import MercuryWorker
+
+
+def free_port():
+    """
+    Function: return a local port nothing listens on.
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def test_worker_started_once(monkeypatch):
+    """
+    A worker that does not come up is started once, later calls give up right away.
+    """
+    started = []
+    monkeypatch.setattr(mercury_client, "PARAMS_WST", 0.5)
+    monkeypatch.setattr(mercury_client.subprocess, "Popen", lambda *a, **k: started.append(a))
+    client = WorkerClient(port=free_port())
+    with pytest.raises(WorkerUnavailable):
+        client("ping")
+    assert len(started) == 1
+    start = time.perf_counter()
+    with pytest.raises(WorkerUnavailable):
+        client("ping")
+    assert len(started) == 1
+    assert time.perf_counter() - start < 0.5
+
+
+def test_worker_interpreter_missing(monkeypatch, tmp_path):
+    """
+    An interpreter that cannot be started gives WorkerUnavailable, not a second start.
+    """
+    monkeypatch.setattr(mercury_client, "PARAMS_PYX", str(tmp_path / "python"))
+    client = WorkerClient(port=free_port())
+    with pytest.raises(WorkerUnavailable):
+        client("ping")
+    assert client.launch_failed
+
+
+def test_worker_serves_concurrent_clients():
+    """
+    A second client is answered while the first keeps its connection open.
+    """
+    port = free_port()
+    worker = MercuryWorker()
+    server = threading.Thread(target=worker.serve, args=("127.0.0.1", port), daemon=True)
+    server.start()
+    first = WorkerClient(port=port, start_worker=False)
+    second = WorkerClient(port=port, start_worker=False)
+    for _ in range(50):
+        try:
+            first("ping")
+            break
+        except WorkerUnavailable:
+            time.sleep(0.1)
+    assert second("ping")["calls"] == 1
+    assert first("shutdown")
+    first.close()
+    second.close()
+    server.join(5)
+    assert not server.is_alive()
+
+
+def test_request_not_sent_twice(monkeypatch):
+    """
+    A request that was sent but not answered raises WorkerNoReply and is not sent again.
+    """
+    monkeypatch.setattr(mercury_client, "PARAMS_WTO", 5)
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        server.settimeout(5)
+        client = WorkerClient(port=server.getsockname()[1], start_worker=False)
+        def answer_nothing():
+            connection, _address = server.accept()
+            with connection, connection.makefile('rb') as stream:
+                stream.readline()
+        thread = threading.Thread(target=answer_nothing)
+        thread.start()
+        with pytest.raises(WorkerNoReply):
+            client("record_laser_coord", "folder", [1.5, 2.5, 3.5], 0, 1)
+        thread.join()
+        server.settimeout(0.5)
+        with pytest.raises(socket.timeout):
+            server.accept()
@@ -0,0 +1,187 @@
+"""
+Tests of mercury_core.py, run with `python -m pytest tests`.
+"""
+
+import os
+import sys
+import time
+import subprocess
+from multiprocessing import shared_memory
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# pylint: disable=wrong-import-position
+import pytest
+import pandas as pd
+from PIL import Image
+
+from mercury_core import (
+    PARAMS_RCD,
+    PARAMS_SHM,
+    MASK_SINKS,
+    CoordinateJournal,
+    mask_sink,
+    close_mask_sinks,
+    journal_path,
+    read_coordinates,
+    compact_journal,
+    coordinate_journal,
+    close_journals,
+    record_laser_coord,
+    finish_round
+)
+
+
+def write_journal(file_path, text):
+    """
+    Function: write the raw text of a journal, as left behind by a crashed writer.
+    """
+    with open(journal_path(file_path), 'w', encoding="utf-8", newline='') as file:
+        file.write(text)
+
+
+def test_journal_header_cut_short(tmp_path):
+    """
+    A journal whose header was cut short (no rows) is discarded, the csv is unchanged.
+    """
+    file_path = str(tmp_path / "Round 0 (recorded).csv")
+    pd.DataFrame([[1.0, 2.0, 3.0, 1]], columns=list(PARAMS_RCD)).to_csv(file_path, index=True)
+    write_journal(file_path, "#ba")
+    assert read_coordinates(file_path, PARAMS_RCD).values.tolist() == [[1.0, 2.0, 3.0, 1]]
+    assert compact_journal(file_path, PARAMS_RCD) == 0
+    assert not os.path.exists(journal_path(file_path))
+    assert pd.read_csv(file_path, usecols=[1,2,3,4]).values.tolist() == [[1.0, 2.0, 3.0, 1]]
+
+
+def test_journal_header_cut_short_then_appended(tmp_path):
+    """
+    Rows appended after a cut short header are kept, the next writer starts a new line.
+    """
+    file_path = str(tmp_path / "Round 0 (recorded).csv")
+    write_journal(file_path, "#base,")
+    journal = coordinate_journal(file_path, PARAMS_RCD)
+    journal(1.5, 2.5, 3.5, 1)
+    journal(4.5, 5.5, 6.5, 0)
+    close_journals()
+    rows = [[1.5, 2.5, 3.5, 1], [4.5, 5.5, 6.5, 0]]
+    assert pd.read_csv(file_path, usecols=[1,2,3,4]).values.tolist() == rows
+
+
+def test_journal_row_cut_short(tmp_path):
+    """
+    A row cut short by a crash is dropped, rows appended by the next writer are kept.
+    """
+    file_path = str(tmp_path / "Round 0 (recorded).csv")
+    write_journal(file_path, "#base,0\n1.5,2.5,3.5,1\n4.5,5.")
+    coordinate_journal(file_path, PARAMS_RCD)(7.5, 8.5, 9.5, 0)
+    rows = [[1.5, 2.5, 3.5, 1], [7.5, 8.5, 9.5, 0]]
+    assert read_coordinates(file_path, PARAMS_RCD).values.tolist() == rows
+    close_journals()
+    assert pd.read_csv(file_path, usecols=[1,2,3,4]).values.tolist() == rows
+
+
+def test_journal_compacted_automatically(tmp_path):
+    """
+    A journal is written into its csv after `max_rows` rows, and after `idle` seconds without rows.
+    """
+    file_path = str(tmp_path / "Round 0 (recorded).csv")
+    journal = CoordinateJournal(file_path, PARAMS_RCD, max_rows=2, idle=0.2)
+    journal(1.5, 2.5, 3.5, 1)
+    journal(4.5, 5.5, 6.5, 0)
+    assert not os.path.exists(journal_path(file_path))
+    assert len(pd.read_csv(file_path)) == 2
+    journal(7.5, 8.5, 9.5, 1)
+    assert os.path.exists(journal_path(file_path))
+    for _ in range(50):
+        time.sleep(0.1)
+        if not os.path.exists(journal_path(file_path)):
+            break
+    assert pd.read_csv(file_path, usecols=[1,2,3,4]).values.tolist()[-1] == [7.5, 8.5, 9.5, 1]
+    assert not os.path.exists(journal_path(file_path))
+    journal.close()
+
+
+def test_finish_round(tmp_path):
+    """
+    The recorded coordinates of the last round are written into its csv by finish_round.
+    """
+    record_laser_coord(str(tmp_path), [1.5, 2.5, 3.5], 0, 1)
+    record_laser_coord(str(tmp_path), [4.5, 5.5, 6.5], 0, 0)
+    assert finish_round(str(tmp_path), 0) == 2
+    file_path = str(tmp_path / "Round 0 (recorded).csv")
+    assert not os.path.exists(journal_path(file_path))
+    rows = [[1.5, 2.5, 3.5, 1], [4.5, 5.5, 6.5, 0]]
+    assert pd.read_csv(file_path, usecols=[1,2,3,4]).values.tolist() == rows
+
+
+def test_update_mask_never_imports_gui(tmp_path):
+    """
+    Importing mercury_core and decoding a cleave map on demand (no pre-rendered masks) does not
+    load mercury_02, customtkinter or matplotlib.
+    """
+    os.makedirs(tmp_path / "image_cleave_map")
+    os.makedirs(tmp_path / "image_laser")
+    pd.DataFrame([[183.0, 183.0, 0.0, 0, 0, 366, 366]], columns=list("xyzwnes")).to_csv(
+        tmp_path / "image_cleave_map" / "Round 0.csv", index=True)
+    mask = Image.new('P', (400, 400), color=(255,255,255))
+    mask.paste(Image.new('P', (100, 100), color=(0,0,0)), (100, 100))
+    mask.save(tmp_path / "image_cleave_map" / "Round 0.png")
+    script = (
+        "import sys\n"
+        "from mercury_core import update_mask\n"
+        f"print(update_mask({str(tmp_path / 'image_laser')!r}, 0, 0))\n"
+        "print(sorted(name for name in ('mercury_02', 'customtkinter', 'matplotlib')"
+        " if name in sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    lines = result.stdout.strip().splitlines()
+    assert lines[-2] == "[183.0, 183.0, 0.0]"
+    assert lines[-1] == "[]"
+    assert os.path.exists(tmp_path / "image_mask_tmp.png")
+
+
+def test_mask_sinks_closed(tmp_path):
+    """
+    A shared memory sink is closed and removed when another folder is used, and on shutdown.
+    """
+    first = mask_sink(str(tmp_path / "a"), "shared_memory")
+    second = mask_sink(str(tmp_path / "b"), "shared_memory")
+    assert first is not second and not hasattr(first, "pixels")
+    assert mask_sink(str(tmp_path / "b"), "shared_memory") is second
+    close_mask_sinks()
+    assert not MASK_SINKS
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=PARAMS_SHM)
+
+
+def test_journal_keeps_exec_status(tmp_path):
+    """
+    Execute status values that are not numbers (bool or text from LabVIEW) are written into the
+    csv as recorded.
+    """
+    for status in [True, False, "done, late"]:
+        record_laser_coord(str(tmp_path), [1.5, 2.5, 3.5], 0, status)
+    assert finish_round(str(tmp_path), 0) == 3
+    file_path = tmp_path / "Round 0 (recorded).csv"
+    with open(file_path, 'r', encoding="utf-8") as file:
+        lines = file.read().splitlines()
+    assert lines[1:] == ["0,1.5,2.5,3.5,True", "1,1.5,2.5,3.5,False", '2,1.5,2.5,3.5,"done, late"']
+    record_laser_coord(str(tmp_path), [4.5, 5.5, 6.5], 0, 1)
+    assert finish_round(str(tmp_path), 0) == 1
+    with open(file_path, 'r', encoding="utf-8") as file:
+        assert file.read().splitlines()[1:] == lines[1:] + ["3,4.5,5.5,6.5,1"]
+
+
+def test_journal_with_rejected_rows_kept(tmp_path):
+    """
+    A journal with rows that cannot be written into the csv is renamed, not removed.
+    """
+    file_path = str(tmp_path / "Round 0 (recorded).csv")
+    write_journal(file_path, "#base,0\n1.5,2.5,3.5,1\nx,2.5,3.5,1\n")
+    assert compact_journal(file_path, PARAMS_RCD) == 1
+    assert not os.path.exists(journal_path(file_path))
+    with open(journal_path(file_path) + ".bad", 'r', encoding="utf-8") as file:
+        assert "x,2.5,3.5,1" in file.read()
+    assert pd.read_csv(file_path, usecols=[1,2,3,4]).values.tolist() == [[1.5, 2.5, 3.5, 1]]
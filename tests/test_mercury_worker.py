@@ -0,0 +1,24 @@
+"""
+Tests of mercury_worker.py (request handling), run with `python -m pytest tests`.
+"""
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# pylint: disable=wrong-import-position
+from mercury_worker import MercuryWorker
+
+
+def test_worker_answers_malformed_lines():
+    """
+    Lines that are not JSON-RPC request objects get an error response, the worker keeps serving.
+    """
+    worker = MercuryWorker()
+    assert worker.answer(b"not json\n")["error"]["code"] == -32700
+    assert worker.answer(b"\xff\xfe\n")["error"]["code"] == -32700
+    assert worker.answer(b"[1, 2]\n")["error"]["code"] == -32600
+    request = json.dumps({"jsonrpc": "2.0", "id": 1, "method": "ping"}).encode()
+    assert worker.answer(request)["result"]["pid"] == os.getpid()